@@ -0,0 +1,608 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module implements the Soulseek networking engine on top of asyncio.
+Messages are parsed and built by the same code as in SlskProtoThread, but
+connections are handled by asyncio transports instead of a selector loop.
+"""
+
+import asyncio
+import os
+import socket
+import time
+
+from functools import partial
+from gettext import gettext as _
+from random import uniform
+
+from pynicotine.logfacility import log
+from pynicotine.slskmessages import ConnClose
+from pynicotine.slskmessages import ConnectError
+from pynicotine.slskmessages import FileError
+from pynicotine.slskmessages import IncConn
+from pynicotine.slskmessages import OutConn
+from pynicotine.slskmessages import ServerConn
+from pynicotine.slskmessages import SetCurrentConnectionCount
+from pynicotine.slskproto import Connection
+from pynicotine.slskproto import PeerConnection
+from pynicotine.slskproto import SlskProtoThread
+
+
+def new_event_loop():
+    """ Returns a uvloop event loop if uvloop is installed, and a selector
+    event loop otherwise """
+
+    try:
+        import uvloop
+
+    except ImportError:
+        # The proactor event loop on Windows can't watch sockets that are connecting
+        return asyncio.SelectorEventLoop()
+
+    return uvloop.new_event_loop()
+
+
+class SlskProtocol(getattr(asyncio, "BufferedProtocol", asyncio.Protocol)):
+    """ Protocol of a server, peer, file transfer or distributed connection.
+    The protocol object is the handle of the connection in messages and in the
+    connection dictionaries, where SlskProtoThread uses socket objects. msg_obj
+    is the ServerConn or OutConn message of an outgoing connection.
+
+    Since Python 3.7, transports read into the receive buffer of the engine
+    instead of passing new bytes objects to data_received(). """
+
+    __slots__ = "engine", "msg_obj", "transport", "write_paused"
+
+    def __init__(self, engine, msg_obj=None):
+        self.engine = engine
+        self.msg_obj = msg_obj
+        self.transport = None
+        self.write_paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.engine.connection_made(self)
+
+    def data_received(self, data):
+        self.engine.data_received(self, data)
+
+    def get_buffer(self, sizehint):
+        return self.engine.get_buffer(self)
+
+    def buffer_updated(self, nbytes):
+        self.engine.buffer_updated(self, nbytes)
+
+    def connection_lost(self, error):
+        self.engine.connection_lost(self, error)
+
+    def pause_writing(self):
+        self.write_paused = True
+
+    def resume_writing(self):
+        self.write_paused = False
+        self.engine.send_file_data(self)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class AsyncProtoThread(SlskProtoThread):
+    """ Networking thread that runs an asyncio event loop, or an uvloop event loop
+    if available. It's a drop-in replacement for SlskProtoThread, and is selected
+    with the "networkengine" option in the server section of the config. """
+
+    # Size of the file reads of uploads
+    UPLOAD_CHUNK_SIZE = 65536
+
+    # Size of the parts of uploads sent with sendfile, between progress updates
+    SENDFILE_CHUNK_SIZE = 1048576
+
+    def __init__(self, ui_callback, queue, bindip, port, config, eventprocessor):
+
+        # Set up before the thread is started by SlskProtoThread
+        self._loop = new_event_loop()
+        self._server = None
+        self._stopped = None
+        self._server_socket = None
+        self._wakeup_pending = False
+        self._throttled = set()  # Speed limited transfers waiting for their token bucket
+        self._sendfile_tasks = {}  # Uploads sent by the kernel
+
+        SlskProtoThread.__init__(self, ui_callback, queue, bindip, port, config, eventprocessor)
+
+    def socket_still_active(self, conn):
+        try:
+            connection = self._conns[conn]
+        except KeyError:
+            return False
+
+        if len(connection.oframes) > 0 or len(connection.ibuf) > 0:
+            return True
+
+        transport = conn.transport
+        return transport is not None and not transport.is_closing() and transport.get_write_buffer_size() > 0
+
+    def unregister_socket(self, sock):
+        """ Stops watching a socket that is still connecting, before it's closed """
+
+        if isinstance(sock, socket.socket):
+            self._loop.remove_writer(sock)
+
+    def process_messages(self):
+        """ Processes the messages sent by the UI thread, and sends the
+        messages they queued on connections """
+
+        connsinprogress = self._connsinprogress
+        in_progress = set(connsinprogress)
+
+        _conns, _connsinprogress, self._server_socket = self.process_queue(
+            self._queue, self._conns, connsinprogress, self._server_socket)
+
+        for sock in connsinprogress:
+            if sock not in in_progress:
+                # The socket is writable once the connection is established, or has failed
+                self._loop.add_writer(sock, self.connect_done, sock)
+
+        curtime = time.time()
+
+        for protocol, conn_obj in list(self._conns.items()):
+            if conn_obj.ibuf and conn_obj.init is not None and conn_obj.init.type == 'F':
+                # The file transfer data that arrived before the UploadFile or DownloadFile message
+                try:
+                    self.process_conn_input(self._conns, protocol, self._server_socket)
+                except KeyError:
+                    continue
+
+                if self._is_upload_pending(conn_obj):
+                    self.send_file_data(protocol)
+
+            if conn_obj.oframes and protocol not in self._sendfile_tasks:
+                # The transport can't be written to while sendfile is in progress
+                transport = conn_obj.conn.transport
+                transport.writelines(conn_obj.oframes)
+                conn_obj.oframes.clear()
+                conn_obj.lastactive = curtime
+
+    def connect_done(self, sock):
+
+        self.unregister_socket(sock)
+        conn_obj = self._connsinprogress.pop(sock)
+        msg_obj = conn_obj.msg_obj
+        error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+
+        if error:
+            self._ui_callback([ConnectError(msg_obj, socket.error(error, os.strerror(error)))])
+            sock.close()
+            return
+
+        addr = msg_obj.addr
+
+        if msg_obj.__class__ is not ServerConn and self.ip_blocked(addr[0]):
+            log.add_conn("Blocking peer connection in progress to IP: %(ip)s Port: %(port)s", {"ip": addr[0], "port": addr[1]})
+            sock.close()
+            return
+
+        self._loop.create_task(self.open_connection(sock, msg_obj))
+
+    async def open_connection(self, sock, msg_obj):
+        """ Wraps an established connection in a transport """
+
+        try:
+            await self._loop.create_connection(partial(SlskProtocol, self, msg_obj), sock=sock)
+
+        except OSError as error:
+            self._ui_callback([ConnectError(msg_obj, error)])
+            sock.close()
+
+    def connection_made(self, protocol):
+
+        msg_obj = protocol.msg_obj
+
+        if msg_obj is None:
+            addr = protocol.transport.get_extra_info("peername")[:2]
+
+            if self.ip_blocked(addr[0]):
+                log.add_conn(_("Ignoring connection request from blocked IP Address %(ip)s:%(port)s"), {
+                    'ip': addr[0],
+                    'port': addr[1]
+                })
+                protocol.transport.abort()
+                return
+
+            self._conns[protocol] = PeerConnection(conn=protocol, addr=addr)
+            self._ui_callback([IncConn(protocol, addr)])
+
+        elif msg_obj.__class__ is ServerConn:
+            self._server_socket = protocol
+            self._conns[protocol] = Connection(conn=protocol, addr=msg_obj.addr)
+            self._ui_callback([ServerConn(protocol, msg_obj.addr)])
+
+            # Send messages that were queued before we were connected
+            for pending_msg in self._pending_server_msgs:
+                self._queue.put(pending_msg)
+
+            self._pending_server_msgs = []
+
+        else:
+            self._conns[protocol] = PeerConnection(conn=protocol, addr=msg_obj.addr, init=msg_obj.init)
+            self._ui_callback([OutConn(protocol, msg_obj.addr)])
+
+    def get_buffer(self, protocol):
+        """ Returns the part of the receive buffer the next data of a connection is
+        read into """
+
+        conn_obj = self._conns.get(protocol)
+
+        if conn_obj is None:
+            length = self.MAX_READ_LENGTH
+
+        elif self._is_download(conn_obj) and conn_obj.limiter is not None:
+            limiter = conn_obj.limiter
+            length = min(max(limiter.available(), limiter.quantum), self.MAX_READ_LENGTH)
+
+        else:
+            length = conn_obj.lastreadlength
+
+        return self._recv_view[:length]
+
+    def buffer_updated(self, protocol, nbytes):
+
+        conn_obj = self._conns.get(protocol)
+
+        if conn_obj is not None:
+            self.update_read_length(conn_obj, nbytes)
+
+        self.data_received(protocol, self._recv_view[:nbytes])
+
+    def data_received(self, protocol, data):
+
+        conns = self._conns
+        conn_obj = conns.get(protocol)
+
+        if conn_obj is None:
+            return
+
+        conn_obj.lastactive = time.time()
+        conn_obj.ibuf.extend(data)
+
+        if self._is_download(conn_obj) and conn_obj.limiter is not None:
+            conn_obj.limiter.consume(len(data))
+
+            if conn_obj.limiter.available() == 0:
+                # Download used its limit, stop reading until the bucket is refilled
+                protocol.transport.pause_reading()
+                self.wait_for_limiter(protocol)
+
+        try:
+            self.process_conn_input(conns, protocol, self._server_socket)
+        except KeyError:
+            return
+
+        if self._is_upload(conn_obj) and self._is_upload_pending(conn_obj):
+            # The peer has sent the offset to start the upload from
+            self.send_file_data(protocol)
+
+    def connection_lost(self, protocol, error):
+
+        sendfile_task = self._sendfile_tasks.pop(protocol, None)
+
+        if sendfile_task is not None:
+            sendfile_task.cancel()
+
+        conn_obj = self._conns.pop(protocol, None)
+
+        if conn_obj is None:
+            # Closed by us
+            return
+
+        self.flush_download(conn_obj)
+
+        if error is not None:
+            self._ui_callback([ConnectError(conn_obj, error)])
+        else:
+            self._ui_callback([ConnClose(protocol, conn_obj.addr)])
+
+    def send_file_data(self, protocol):
+        """ Reads the next part of an upload and passes it to the transport, until
+        the transport buffer is full or the limit of the interval is used """
+
+        conn_obj = self._conns.get(protocol)
+
+        if conn_obj is None or not self._is_upload(conn_obj) or not self._is_upload_pending(conn_obj):
+            return
+
+        if protocol in self._sendfile_tasks:
+            return
+
+        if conn_obj.sendfile and hasattr(self._loop, "sendfile"):
+            self._sendfile_tasks[protocol] = self._loop.create_task(self.sendfile_upload(protocol))
+            return
+
+        upload = conn_obj.fileupl
+        limiter = conn_obj.limiter
+        bytes_send = 0
+
+        while not protocol.write_paused and self._is_upload_pending(conn_obj):
+            limit = None if limiter is None else limiter.available()
+
+            if limit == 0:
+                # Upload used its limit, continue once the bucket is refilled
+                self.wait_for_limiter(protocol)
+                break
+
+            try:
+                data = upload.file.read(self.UPLOAD_CHUNK_SIZE if limit is None else min(self.UPLOAD_CHUNK_SIZE, limit))
+
+            except IOError as strerror:
+                self._ui_callback([FileError(conn_obj, upload.file, strerror)])
+                break
+
+            except ValueError:
+                break
+
+            if not data:
+                self.upload_file_truncated(conn_obj)
+                return
+
+            protocol.transport.write(data)
+            upload.sentbytes += len(data)
+            bytes_send += len(data)
+
+            if limiter is not None:
+                limiter.consume(len(data))
+
+        if bytes_send > 0:
+            self.upload_progress(conn_obj)
+
+    async def sendfile_upload(self, protocol):
+        """ Sends an upload with sendfile, straight from the file to the socket.
+        Falls back to send_file_data() if sendfile is unsupported for the file or
+        the event loop. """
+
+        conn_obj = self._conns[protocol]
+        upload = conn_obj.fileupl
+        limiter = conn_obj.limiter
+
+        try:
+            while self._is_upload_pending(conn_obj):
+                limit = None if limiter is None else limiter.available()
+
+                if limit == 0:
+                    # Upload used its limit, continue once the bucket is refilled
+                    await asyncio.sleep(limiter.wait_time())
+                    continue
+
+                offset = upload.offset + upload.sentbytes
+                count = min(upload.size - offset, self.SENDFILE_CHUNK_SIZE if limit is None else limit)
+
+                try:
+                    bytes_send = await self._loop.sendfile(protocol.transport, upload.file, offset, count, fallback=False)
+
+                except (asyncio.SendfileNotAvailableError, NotImplementedError):
+                    # Not a regular file, or the event loop doesn't support sendfile
+                    conn_obj.sendfile = False
+                    upload.file.seek(offset)
+                    break
+
+                except (OSError, RuntimeError):
+                    # Connection closed, connection_lost() is called by the transport
+                    protocol.transport.abort()
+                    return
+
+                except ValueError:
+                    # File closed
+                    return
+
+                if not bytes_send:
+                    self.upload_file_truncated(conn_obj)
+                    return
+
+                upload.sentbytes += bytes_send
+
+                if limiter is not None:
+                    limiter.consume(bytes_send)
+
+                self.upload_progress(conn_obj)
+
+        finally:
+            if self._sendfile_tasks.get(protocol) is asyncio.current_task(self._loop):
+                del self._sendfile_tasks[protocol]
+
+        self.send_file_data(protocol)
+
+    def upload_progress(self, conn_obj):
+        """ Notifies the UI of the progress of an upload """
+
+        curtime = time.time()
+        conn_obj.lastactive = curtime
+
+        # Same UI callback cooldown as in SlskProtoThread.write_data()
+        cooldown = max(1.0, min(self.total_uploads * uniform(0.8, 1.0), 15))
+
+        if not self._is_upload_pending(conn_obj) or (curtime - conn_obj.lastcallback) > cooldown:
+            self._ui_callback([conn_obj.fileupl])
+            conn_obj.lastcallback = curtime
+
+    def wait_for_limiter(self, protocol):
+        """ Continues a speed limited transfer once its token bucket is refilled """
+
+        if protocol in self._throttled:
+            return
+
+        self._throttled.add(protocol)
+        self._loop.call_later(self._conns[protocol].limiter.wait_time(), self.limiter_refilled, protocol)
+
+    def limiter_refilled(self, protocol):
+
+        self._throttled.discard(protocol)
+        conn_obj = self._conns.get(protocol)
+
+        if conn_obj is None:
+            return
+
+        if self._is_upload(conn_obj):
+            self.send_file_data(protocol)
+
+        elif conn_obj.limiter is not None and conn_obj.limiter.available() == 0:
+            self.wait_for_limiter(protocol)
+
+        else:
+            protocol.transport.resume_reading()
+
+    def check_connections(self):
+        """ Closes connections that are stale, idle or blocked, and updates the
+        connection count in the UI. Runs once per interval. """
+
+        curtime = time.time()
+        conns = self._conns
+        connsinprogress = self._connsinprogress
+
+        for sock, conn_obj in list(connsinprogress.items()):
+            if (curtime - conn_obj.lastactive) > self.IN_PROGRESS_STALE_AFTER:
+                self.close_connection(connsinprogress, sock, ConnectError(conn_obj.msg_obj))
+
+        for protocol, conn_obj in list(conns.items()):
+            if protocol is self._server_socket:
+                continue
+
+            addr = conn_obj.addr
+
+            if curtime - conn_obj.lastactive > self.CONNECTION_MAX_IDLE:
+                self.close_connection(conns, protocol, ConnClose(protocol, addr))
+
+            elif self.conn_blocked(conn_obj):
+                log.add_conn("Blocking peer connection to IP: %(ip)s Port: %(port)s", {"ip": addr[0], "port": addr[1]})
+                self.close_connection(conns, protocol)
+
+        numsockets = len(conns) + len(connsinprogress)
+
+        if numsockets != self.last_conncount:
+            self._ui_callback([SetCurrentConnectionCount(numsockets)])
+            self.last_conncount_ui_update = curtime
+            self.last_conncount = numsockets
+
+        if curtime >= self._next_limit_update and self.has_transfer_limits():
+            self.update_transfer_limits()
+
+        if self._poll_queue:
+            self.process_messages()
+            interval = self.QUEUE_POLL_INTERVAL
+        else:
+            interval = self.CONNCOUNT_UI_INTERVAL
+
+        self._loop.call_later(interval, self.check_connections)
+
+    async def serve(self):
+
+        loop = self._loop
+        self._stopped = loop.create_future()
+        self._server = await loop.create_server(partial(SlskProtocol, self), sock=self._p)
+
+        loop.call_soon(self.process_messages)
+        loop.call_soon(self.check_connections)
+
+        if not self._want_abort:
+            await self._stopped
+
+    def run(self):
+        """ Actual networking loop is here."""
+
+        asyncio.set_event_loop(self._loop)
+
+        try:
+            self._loop.run_until_complete(self.serve())
+
+        except OSError as error:
+            log.add_warning(_("Major Socket Error: Networking terminated! %s"), str(error))
+
+        finally:
+            self.close_all()
+
+        # Networking thread aborted
+
+    def close_all(self):
+
+        loop = self._loop
+
+        for sock in list(self._connsinprogress):
+            self.close_connection(self._connsinprogress, sock)
+
+        sendfile_tasks = list(self._sendfile_tasks.values())
+        self._sendfile_tasks.clear()
+
+        for task in sendfile_tasks:
+            task.cancel()
+
+        if sendfile_tasks:
+            loop.run_until_complete(asyncio.gather(*sendfile_tasks, return_exceptions=True))
+
+        # Write the rest of the downloads before their files are closed
+        for conn_obj in self._conns.values():
+            self.flush_download(conn_obj)
+
+        conns = list(self._conns)
+        self._conns.clear()
+
+        for protocol in conns:
+            if protocol.transport is not None:
+                protocol.transport.abort()
+
+        if self._server is not None:
+            self._server.close()
+
+        # Let the transports finish closing
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+
+        self._selector.close()
+
+        for fileobj in self._wakeup_fds:
+            fileobj.close()
+
+        self._compression_pool.shutdown(wait=False)
+        self._download_write_pool.shutdown()
+
+    def on_wakeup(self):
+
+        self._wakeup_pending = False
+
+        if self._want_abort:
+            if self._stopped is not None and not self._stopped.done():
+                self._stopped.set_result(None)
+
+            return
+
+        self.process_messages()
+
+    def wakeup(self):
+        """ Schedules the processing of queued messages in the event loop. Called
+        from other threads when a message is queued. """
+
+        if self._wakeup_pending:
+            return
+
+        self._wakeup_pending = True
+
+        try:
+            self._loop.call_soon_threadsafe(self.on_wakeup)
+
+        except RuntimeError:
+            # Networking thread stopped
+            pass
@@ -73,6 +73,7 @@ class Config:
         self.filename = filename
         self.data_dir = data_dir
         self.parser = configparser.RawConfigParser()
+        self.revision = 0  # Increased every time the config is written, after settings are changed
 
         try:
             self.parser.read([self.filename], encoding="utf-8")
@@ -100,7 +101,8 @@ class Config:
                 "ipblocklist": {},
                 "autojoin": ["nicotine"],
                 "autoaway": 15,
-                "private_chatrooms": False
+                "private_chatrooms": False,
+                "networkengine": "thread"
             },
 
             "transfers": {
@@ -114,6 +116,10 @@ class Config:
                 "uselimit": False,
                 "uploadlimit": 150,
                 "downloadlimit": 0,
+                "preallocate": True,
+                "downloadbuffersize": 1024,
+                "downloadfsync": False,
+                "downloadwriterthread": False,
                 "preferfriends": False,
                 "useupslots": False,
                 "uploadslots": 2,
@@ -154,6 +160,9 @@ class Config:
                 "bfileindex": {},
                 "bsharedmtimes": {},
                 "rescanonstartup": 0,
+                "rescanthrottle": False,
+                "rescanfilespersecond": 100,
+                "rescanpauseuploads": 0,
                 "enablefilters": True,
                 "downloadregexp": "",
                 "downloadfilters": [
@@ -675,6 +684,8 @@ class Config:
 
     def write_configuration(self):
 
+        self.revision += 1
+
         external_sections = [
             "sharedfiles", "sharedfilesstreams", "wordindex", "fileindex",
             "sharedmtimes", "bsharedfiles", "bsharedfilesstreams",
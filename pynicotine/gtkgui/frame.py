@@ -781,6 +781,11 @@ class NicotineFrame:
         self.rescan_buddy_action.connect("activate", self.on_buddy_rescan)
         self.application.add_action(self.rescan_buddy_action)
 
+        self.cancel_rescan_action = Gio.SimpleAction.new("cancelrescan", None)
+        self.cancel_rescan_action.connect("activate", self.on_cancel_rescan)
+        self.cancel_rescan_action.set_enabled(False)
+        self.application.add_action(self.cancel_rescan_action)
+
         self.browse_public_shares_action = Gio.SimpleAction.new("browsepublicshares", None)
         self.browse_public_shares_action.connect("activate", self.on_browse_public_shares)
         self.application.add_action(self.browse_public_shares_action)
@@ -1110,6 +1115,7 @@ class NicotineFrame:
 
         self.rescan_public_action.set_enabled(False)
         self.browse_public_shares_action.set_enabled(False)
+        self.cancel_rescan_action.set_enabled(True)
 
         log.add(_("Rescanning started"))
 
@@ -1124,11 +1130,16 @@ class NicotineFrame:
 
         self.rescan_buddy_action.set_enabled(False)
         self.browse_buddy_shares_action.set_enabled(False)
+        self.cancel_rescan_action.set_enabled(True)
 
         log.add(_("Rescanning Buddy Shares started"))
 
         _thread.start_new_thread(self.np.shares.rescan_buddy_shares, (rebuild,))
 
+    def on_cancel_rescan(self, *args):
+        self.cancel_rescan_action.set_enabled(False)
+        self.np.shares.cancel_scans()
+
     def on_browse_public_shares(self, *args):
         """ Browse your own public shares """
 
@@ -1683,6 +1694,7 @@ class NicotineFrame:
             self.browse_buddy_shares_action.set_enabled(True)
 
         self.brescanning = False
+        self.cancel_rescan_action.set_enabled(self.rescanning)
         log.add(_("Rescanning Buddy Shares finished"))
 
         self.BuddySharesProgress.hide()
@@ -1694,6 +1706,7 @@ class NicotineFrame:
             self.browse_public_shares_action.set_enabled(True)
 
         self.rescanning = False
+        self.cancel_rescan_action.set_enabled(self.brescanning)
         log.add(_("Rescanning finished"))
 
         self.SharesProgress.hide()
@@ -2367,15 +2380,25 @@ class NicotineFrame:
 
     def show_scan_progress(self, sharestype):
         if sharestype == "normal":
-            GLib.idle_add(self.SharesProgress.show)
+            progressbar = self.SharesProgress
         else:
-            GLib.idle_add(self.BuddySharesProgress.show)
+            progressbar = self.BuddySharesProgress
+
+        GLib.idle_add(progressbar.set_show_text, False)
+        GLib.idle_add(progressbar.show)
 
-    def set_scan_progress(self, sharestype, value):
+    def set_scan_progress(self, sharestype, value, rate=None):
         if sharestype == "normal":
-            GLib.idle_add(self.SharesProgress.set_fraction, value)
+            progressbar = self.SharesProgress
         else:
-            GLib.idle_add(self.BuddySharesProgress.set_fraction, value)
+            progressbar = self.BuddySharesProgress
+
+        GLib.idle_add(progressbar.set_fraction, value)
+
+        if rate is not None:
+            # Background scans report how many files they read per second
+            GLib.idle_add(progressbar.set_show_text, True)
+            GLib.idle_add(progressbar.set_text, _("%(rate).1f files/s") % {"rate": rate})
 
     def hide_scan_progress(self, sharestype):
         if sharestype == "normal":
@@ -2632,6 +2655,9 @@ class NicotineFrame:
         if self.np.transfers is not None:
             self.np.transfers.save_downloads()
 
+        # Stop scanning shares, the scan will resume on next startup
+        self.np.shares.cancel_scans()
+
         # Closing up all shelves db
         self.np.shares.close_shares()
 
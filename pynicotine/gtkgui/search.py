@@ -51,7 +51,7 @@ from pynicotine.gtkgui.utils import set_treeview_selected_row
 from pynicotine.gtkgui.utils import show_country_tooltip
 from pynicotine.gtkgui.wishlist import WishList
 from pynicotine.logfacility import log
-from pynicotine.utils import get_result_bitrate_length
+from pynicotine.utils import human_bitrate_length
 
 
 class Searches(IconNotebook):
@@ -668,7 +668,6 @@ class Search:
 
         inqueue = msg.inqueue
         ulspeed = msg.ulspeed
-        h_speed = human_speed(ulspeed)
 
         if msg.freeulslots:
             imdl = "Y"
@@ -676,17 +675,19 @@ class Search:
         else:
             imdl = "N"
 
-        h_queue = humanize(inqueue)
+        # Remember the country flag of the user
+        self.get_flag(user, country)
 
         append = False
         maxstoredresults = self.searches.maxstoredresults
+        files = msg.list
 
-        for result in msg.list:
+        for i in range(len(files)):
 
             if counter > maxstoredresults:
                 break
 
-            fullpath = result[1]
+            fullpath = files.paths[i]
             fullpath_lower = fullpath.lower()
 
             if any(word in fullpath_lower for word in self.searchterm_words_ignore):
@@ -699,15 +700,9 @@ class Search:
                 log.add_search(_("Filtered out inexact or incorrect search result " + fullpath + " from user " + user))
                 continue
 
-            fullpath_split = reversed(fullpath.split('\\'))
-            name = next(fullpath_split)
-            directory = '\\'.join(fullpath_split)
-
-            size = result[2]
-            h_size = human_size(size)
-            h_bitrate, bitrate, h_length = get_result_bitrate_length(size, result[4])
-
-            self.append([counter, user, self.get_flag(user, country), imdl, h_speed, h_queue, directory, name, h_size, h_bitrate, h_length, bitrate, fullpath, country, size, ulspeed, inqueue])
+            # Strings for the size, bitrate and length are created when the row is displayed
+            self.append((counter, user, country, imdl, ulspeed, inqueue, fullpath, files.name_offsets[i],
+                         files.sizes[i], files.bitrates[i], files.lengths[i], files.vbr[i]))
             append = True
             counter += 1
 
@@ -762,7 +757,14 @@ class Search:
                 collapse_treeview(self.ResultsList, self.ResultGrouping.get_active())
 
     def add_row_to_model(self, row):
-        counter, user, flag, immediatedl, h_speed, h_queue, directory, filename, h_size, h_bitrate, length, bitrate, fullpath, country, size, speed, queue = row
+        counter, user, country, immediatedl, speed, queue, fullpath, name_offset, size, bitrate, length, vbr = row
+
+        directory = fullpath[:max(name_offset - 1, 0)]
+        filename = fullpath[name_offset:]
+        h_speed = human_speed(speed)
+        h_queue = humanize(queue)
+        h_bitrate, h_length = human_bitrate_length(bitrate, length, vbr)
+        bitrate = bitrate or 0
 
         if self.ResultGrouping.get_active() > 0:
             # Group by folder or user
@@ -784,13 +786,14 @@ class Search:
                         [0, user, self.get_flag(user, country), immediatedl, h_speed, h_queue, directory, "", "", "", "", 0, fullpath.rsplit('\\', 1)[0] + '\\', country, 0, speed, queue]
                     )
 
-                row = row[:]
-                row[6] = ""  # Directory not visible for file row if "group by folder" is enabled
-
                 parent = self.directoryiters[directory]
+                directory = ""  # Directory not visible for file row if "group by folder" is enabled
         else:
             parent = None
 
+        row = [counter, user, self.get_flag(user, country), immediatedl, h_speed, h_queue, directory, filename,
+               human_size(size), h_bitrate, h_length, bitrate, fullpath, country, size, speed, queue]
+
         try:
             iterator = self.resultsmodel.append(parent, row)
 
@@ -848,18 +851,18 @@ class Search:
         if not self.filtersCheck.get_active():
             return True
 
-        # "Included text"-filter, check full file path (located at index 12 in row)
-        if filters[0] and not filters[0].search(row[12].lower()):
+        # "Included text"-filter, check full file path (located at index 6 in row)
+        if filters[0] and not filters[0].search(row[6].lower()):
             return False
 
-        # "Excluded text"-filter, check full file path (located at index 12 in row)
-        if filters[1] and filters[1].search(row[12].lower()):
+        # "Excluded text"-filter, check full file path (located at index 6 in row)
+        if filters[1] and filters[1].search(row[6].lower()):
             return False
 
-        if filters[2] and not self.check_digit(filters[2], row[14]):
+        if filters[2] and not self.check_digit(filters[2], row[8]):
             return False
 
-        if filters[3] and not self.check_digit(filters[3], row[11], False):
+        if filters[3] and not self.check_digit(filters[3], row[9] or 0, False):
             return False
 
         if filters[4] and row[3] != "Y":
@@ -869,13 +872,13 @@ class Search:
             for cc in filters[5]:
                 if not cc:
                     continue
-                if row[13] is None:
+                if row[2] is None:
                     return False
 
                 if cc[0] == "-":
-                    if row[13].upper() == cc[1:].upper():
+                    if row[2].upper() == cc[1:].upper():
                         return False
-                elif cc.upper() != row[13].upper():
+                elif cc.upper() != row[2].upper():
                     return False
 
         return True
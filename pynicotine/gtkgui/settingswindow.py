@@ -631,6 +631,9 @@ class SharesFrame(BuildFrame):
                 "shared": self.Shares,
                 "friendsonly": self.FriendsOnly,
                 "rescanonstartup": self.RescanOnStartup,
+                "rescanthrottle": self.RescanThrottle,
+                "rescanfilespersecond": self.RescanFilesPerSecond,
+                "rescanpauseuploads": self.RescanPauseUploads,
                 "buddyshared": self.BuddyShares,
                 "enablebuddyshares": self.enableBuddyShares
             }
@@ -644,6 +647,7 @@ class SharesFrame(BuildFrame):
 
         self.p.set_widgets_data(config, self.options)
         self.on_enabled_buddy_shares_toggled(self.enableBuddyShares)
+        self.on_rescan_throttle_toggled(self.RescanThrottle)
 
         if transfers["shared"] is not None:
 
@@ -721,12 +725,18 @@ class SharesFrame(BuildFrame):
             "transfers": {
                 "shared": self.shareddirs[:],
                 "rescanonstartup": self.RescanOnStartup.get_active(),
+                "rescanthrottle": self.RescanThrottle.get_active(),
+                "rescanfilespersecond": self.RescanFilesPerSecond.get_value_as_int(),
+                "rescanpauseuploads": self.RescanPauseUploads.get_value_as_int(),
                 "buddyshared": self.bshareddirs[:],
                 "enablebuddyshares": buddies,
                 "friendsonly": friendsonly
             }
         }
 
+    def on_rescan_throttle_toggled(self, widget):
+        self.RescanThrottleOptions.set_sensitive(widget.get_active())
+
     def on_enabled_buddy_shares_toggled(self, widget):
         self.on_friends_only_toggled(widget)
         self.needrescan = True
@@ -66,6 +66,7 @@ class UserBrowse:
         self.selected_files = []
 
         self.shares = []
+        self.receiving = False
 
         # Iters for current DirStore
         self.directories = {}
@@ -347,18 +348,36 @@ class UserBrowse:
 
         return True
 
-    def make_new_model(self, list):
+    def clear_model(self):
 
-        self.shares = list
         self.selected_folder = None
         self.selected_files = []
         self.directories.clear()
         self.files.clear()
         self.dir_store.clear()
+        self.totalsize = 0
+
+    def make_new_model(self, list):
+
+        self.receiving = False
+        self.clear_model()
+        self.shares = list
 
         # Compute the number of shared dirs and total size
-        self.totalsize = 0
-        for dir, files in self.shares:
+        self.add_total_size(self.shares)
+
+        # Generate the directory tree and select first directory
+        currentdir = self.browse_get_dirs()
+        self.finish_model(currentdir)
+
+    def add_total_size(self, shares):
+
+        for dir, files in shares:
+            if isinstance(files, slskmessages.PackedFolderFiles):
+                # Total size is known without decoding the files
+                self.totalsize += files.size
+                continue
+
             for filedata in files:
                 if filedata[2] < maxsize:
                     self.totalsize += filedata[2]
@@ -366,8 +385,7 @@ class UserBrowse:
         self.AmountShared.set_text(_("Shared: %s") % human_size(self.totalsize))
         self.NumDirectories.set_text(_("Dirs: %s") % len(self.shares))
 
-        # Generate the directory tree and select first directory
-        currentdir = self.browse_get_dirs()
+    def finish_model(self, currentdir):
 
         sel = self.FolderTreeView.get_selection()
         sel.unselect_all()
@@ -385,6 +403,26 @@ class UserBrowse:
         else:
             self.FolderTreeView.collapse_all()
 
+    def add_directories(self, shares):
+        """ Adds directories to the tree while a browse response is being received """
+
+        dirseparator = '\\'
+
+        for directory, files in shares:
+            current_path = None
+            parent = None
+
+            for subdir in directory.split(dirseparator):
+                if parent is None:
+                    current_path = subdir
+                else:
+                    current_path = dirseparator.join([current_path, subdir])
+
+                if current_path not in self.directories:
+                    self.directories[current_path] = self.dir_store.append(parent, [subdir, current_path])
+
+                parent = self.directories[current_path]
+
     def browse_get_dirs(self):
 
         directory = ""
@@ -547,8 +585,37 @@ class UserBrowse:
 
     def show_info(self, msg):
         self.conn = None
+
+        if self.receiving and len(self.shares) == len(msg.list):
+            # All directories were added while the response was being received
+            self.receiving = False
+            self.shares = msg.list
+
+            if self.selected_folder is None and self.directories:
+                self.finish_model(sorted(self.directories)[0])
+            else:
+                self.SaveButton.set_sensitive(True)
+            return
+
         self.make_new_model(msg.list)
 
+    def show_partial_info(self, msg):
+
+        if not self.receiving:
+            self.receiving = True
+            self.clear_model()
+            self.shares = []
+
+            self.dir_store.set_sort_column_id(0, Gtk.SortType.ASCENDING)
+            self.FolderTreeView.set_model(self.dir_store)
+            self.FolderTreeView.set_sensitive(True)
+            self.FileTreeView.set_sensitive(True)
+            self.SaveButton.set_sensitive(False)
+
+        self.shares.extend(msg.list)
+        self.add_total_size(msg.list)
+        self.add_directories(msg.list)
+
     def load_shares(self, list):
         self.make_new_model(list)
 
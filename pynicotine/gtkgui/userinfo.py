@@ -130,6 +130,12 @@ class UserTabs(IconNotebook):
 
         self.frame.show_tab(['userinfo', self.frame.userinfovbox])
 
+    def show_partial_info(self, msg):
+
+        for i in list(self.users.values()):
+            if i.conn == msg.conn.conn:
+                i.show_partial_info(msg)
+
     def show_interests(self, msg):
 
         if msg.user in self.users:
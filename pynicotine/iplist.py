@@ -0,0 +1,179 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module contains the compiled IP lists used to block and ignore addresses.
+"""
+
+import socket
+import struct
+
+from bisect import bisect_right
+
+""" IP lists hold addresses (1.2.3.4), wildcard patterns (1.2.*.*) and CIDR
+ranges (1.2.0.0/16). Each pattern is a range of IPv4 addresses as 32-bit
+integers. The ranges are sorted and merged, so an address is looked up with
+a binary search over the start of the ranges.
+
+A wildcard in front of a number (1.*.3.4) matches addresses that aren't
+consecutive. These rare patterns are matched segment by segment instead. """
+
+ADDRESS_UNPACK = struct.Struct("!I").unpack
+
+
+def address_to_int(address):
+    """ Returns an IPv4 address as an integer, or None if it's invalid """
+
+    try:
+        return ADDRESS_UNPACK(socket.inet_aton(address))[0]
+    except (OSError, TypeError):
+        return None
+
+
+def segments_to_int(segments):
+
+    value = 0
+
+    for segment in segments:
+        value = (value << 8) | int(segment)
+
+    return value
+
+
+def parse_pattern(pattern):
+    """ Returns the first and last address matched by a pattern as integers, the
+    segments of a pattern that isn't a range, or None if the pattern is invalid """
+
+    address, separator, prefix = pattern.partition("/")
+    segments = address.split(".")
+
+    if len(segments) != 4 or not all(
+            segment == "*" or (segment.isdecimal() and int(segment) <= 255) for segment in segments):
+        return None
+
+    if separator:
+        if "*" in segments or not prefix.isdecimal() or int(prefix) > 32:
+            return None
+
+        size = 1 << (32 - int(prefix))
+        start = segments_to_int(segments) & ~(size - 1)
+        return start, start + size - 1
+
+    if "*" not in segments:
+        start = segments_to_int(segments)
+        return start, start
+
+    num_wildcards = len(segments) - segments.index("*")
+
+    if segments[-num_wildcards:] != ["*"] * num_wildcards:
+        return segments
+
+    start = segments_to_int(segments[:-num_wildcards] + ["0"] * num_wildcards)
+    return start, start + (1 << (8 * num_wildcards)) - 1
+
+
+class IPList:
+    """ Compiled version of an IP list in the config. Config lists are replaced by
+    the settings dialog, and otherwise changed in place, followed by writing the
+    config. The list is compiled again when the dictionary object, its length or
+    the revision of the config changes. """
+
+    __slots__ = ("patterns", "num_patterns", "config_revision", "starts", "ends", "segment_patterns",
+                 "revision")
+
+    def __init__(self, patterns=None):
+
+        self.patterns = None
+        self.num_patterns = 0
+        self.config_revision = None
+        self.starts = []
+        self.ends = []
+        self.segment_patterns = []
+        self.revision = 0  # Increased every time the list is compiled
+
+        if patterns is not None:
+            self.compile(patterns)
+
+    def update(self, patterns, config_revision=None):
+        """ Compiles the list again if the patterns have changed. config_revision is
+        the revision of the config the patterns are part of. """
+
+        if (patterns is not self.patterns or len(patterns) != self.num_patterns or
+                config_revision != self.config_revision):
+            self.compile(patterns)
+            self.config_revision = config_revision
+
+    def compile(self, patterns):
+
+        ranges = []
+        segment_patterns = []
+
+        for pattern in list(patterns):
+            parsed = parse_pattern(pattern)
+
+            if parsed is None:
+                continue
+
+            if isinstance(parsed, list):
+                segment_patterns.append(parsed)
+                continue
+
+            ranges.append(parsed)
+
+        ranges.sort()
+        starts = []
+        ends = []
+
+        for start, end in ranges:
+            if ends and start <= ends[-1] + 1:
+                # Overlapping or adjacent ranges are merged
+                ends[-1] = max(ends[-1], end)
+                continue
+
+            starts.append(start)
+            ends.append(end)
+
+        self.patterns = patterns
+        self.num_patterns = len(patterns)
+        self.starts = starts
+        self.ends = ends
+        self.segment_patterns = segment_patterns
+        self.revision += 1
+
+    def __contains__(self, address):
+
+        value = address_to_int(address)
+
+        if value is None or address.count(".") != 3:
+            return False
+
+        index = bisect_right(self.starts, value) - 1
+
+        if index >= 0 and value <= self.ends[index]:
+            return True
+
+        if not self.segment_patterns:
+            return False
+
+        segments = address.split(".")
+
+        for pattern in self.segment_patterns:
+            if all(part in (segment, "*") for part, segment in zip(pattern, segments)):
+                return True
+
+        return False
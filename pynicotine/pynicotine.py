@@ -31,19 +31,19 @@ This is the actual client code. Actual GUI classes are in the separate modules
 
 import configparser
 import os
-import queue
 import shutil
 import threading
 import time
 
 from gettext import gettext as _
-from socket import socket
 
+from pynicotine import asyncproto
 from pynicotine import slskmessages
 from pynicotine import slskproto
 from pynicotine import transfers
 from pynicotine.config import Config
 from pynicotine.geoip.ip2location import IP2Location
+from pynicotine.iplist import IPList
 from pynicotine.logfacility import log
 from pynicotine.pluginsystem import PluginHandler
 from pynicotine.shares import Shares
@@ -132,11 +132,12 @@ class NetworkEventProcessor:
         self.watchedusers = []
         self.ipblock_requested = {}
         self.ipignore_requested = {}
+        self.ip_ignore_list = IPList()
         self.ip_requested = []
         self.private_message_queue = {}
         self.users = {}
         self.user_addr_requested = set()
-        self.queue = queue.Queue(0)
+        self.queue = slskproto.MessageQueue()
         self.shares = Shares(self, self.config, self.queue, self.ui_callback)
         self.pluginhandler = PluginHandler(self.ui_callback, plugins, self.config)
 
@@ -147,7 +148,12 @@ class NetworkEventProcessor:
         # Give the logger information about log folder
         self.update_debug_log_options()
 
-        self.protothread = slskproto.SlskProtoThread(self.network_callback, self.queue, self.bindip, self.port, self.config, self)
+        if self.config.sections["server"]["networkengine"] == "asyncio":
+            protothread_class = asyncproto.AsyncProtoThread
+        else:
+            protothread_class = slskproto.SlskProtoThread
+
+        self.protothread = protothread_class(self.network_callback, self.queue, self.bindip, self.port, self.config, self)
 
         uselimit = self.config.sections["transfers"]["uselimit"]
         uploadlimit = self.config.sections["transfers"]["uploadlimit"]
@@ -209,6 +215,7 @@ class NetworkEventProcessor:
             slskmessages.CantConnectToPeer: self.cant_connect_to_peer,
             slskmessages.PeerTransfer: self.peer_transfer,
             slskmessages.SharedFileList: self.shared_file_list,
+            slskmessages.SharedFileListProgress: self.shared_file_list_progress,
             slskmessages.GetSharedFileList: self.get_shared_file_list,
             slskmessages.FileSearchRequest: self.file_search_request,
             slskmessages.FileSearchResult: self.file_search_result,
@@ -422,10 +429,7 @@ class NetworkEventProcessor:
 
     def contents(self, obj):
         """ Returns variables for object, for debug output """
-        try:
-            return {s: getattr(obj, s) for s in obj.__slots__ if hasattr(obj, s)}
-        except AttributeError:
-            return vars(obj)
+        return slskmessages.msg_contents(obj)
 
     def popup_message(self, msg):
         self.set_status(_(msg.title))
@@ -826,35 +830,8 @@ class NetworkEventProcessor:
         if address is None:
             return True
 
-        ips = self.config.sections["server"]["ipignorelist"]
-        s_address = address.split(".")
-
-        for ip in ips:
-
-            # No Wildcard in IP
-            if "*" not in ip:
-                if address == ip:
-                    return True
-                continue
-
-            # Wildcard in IP
-            parts = ip.split(".")
-            seg = 0
-
-            for part in parts:
-                # Stop if there's no wildcard or matching string number
-                if part not in (s_address[seg], "*"):
-                    break
-
-                seg += 1
-
-                # Last time around
-                if seg == 4:
-                    # Wildcard blocked
-                    return True
-
-        # Not blocked
-        return False
+        self.ip_ignore_list.update(self.config.sections["server"]["ipignorelist"], self.config.revision)
+        return address in self.ip_ignore_list
 
     def say_chat_room(self, msg):
 
@@ -1276,17 +1253,18 @@ class NetworkEventProcessor:
         if not self.protothread.socket_still_active(conn):
             self.queue.put(slskmessages.ConnClose(conn))
 
-            if isinstance(peerconn, socket):
+            if isinstance(peerconn, PeerConnection):
+                try:
+                    self.peerconns.remove(peerconn)
+                except ValueError:
+                    pass
+            else:
+                # Connection handle of the networking thread
 
                 for i in self.peerconns:
                     if i.conn == peerconn:
                         self.peerconns.remove(i)
                         break
-            else:
-                try:
-                    self.peerconns.remove(peerconn)
-                except ValueError:
-                    pass
 
     def user_info_reply(self, msg):
         conn = msg.conn.conn
@@ -1394,6 +1372,10 @@ class NetworkEventProcessor:
                     self.userbrowse.show_info(i.username, msg)
                     break
 
+    def shared_file_list_progress(self, msg):
+        if self.userbrowse is not None:
+            self.userbrowse.show_partial_info(msg)
+
     def file_search_result(self, msg):
         conn = msg.conn
         addr = conn.addr
@@ -1756,9 +1738,16 @@ class NetworkEventProcessor:
         if msg.code in self.protothread.peerclasses:
             peermsg = self.protothread.peerclasses[msg.code](None)
             peermsg.parse_network_message(msg.msg)
-            peermsg.tunneleduser = msg.user
-            peermsg.tunneledreq = msg.req
-            peermsg.tunneledaddr = msg.addr
+
+            try:
+                peermsg.tunneleduser = msg.user
+                peermsg.tunneledreq = msg.req
+                peermsg.tunneledaddr = msg.addr
+
+            except AttributeError:
+                # Messages with __slots__ have no room for the tunnel, only TransferRequest reads it
+                pass
+
             self.network_callback([peermsg])
         else:
             log.add_msg_contents(_("Unknown tunneled message: %s"), (self.contents(msg)))
@@ -1915,6 +1904,8 @@ class NetworkEventProcessor:
 
 class UserAddr:
 
+    __slots__ = "addr", "behindfw", "status"
+
     def __init__(self, addr=None, behindfw=None, status=None):
         self.addr = addr
         self.behindfw = behindfw
@@ -20,6 +20,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import glob
 import os
 import pickle
 import re
@@ -28,12 +29,15 @@ import stat
 import string
 import sys
 import taglib
+import threading
+import time
 import _thread
 
 from gettext import gettext as _
 
 from pynicotine import slskmessages
 from pynicotine.logfacility import log
+from pynicotine.wordindex import WordIndex
 
 if sys.platform == "win32":
     # Use semidbm for faster shelves on Windows
@@ -45,11 +49,95 @@ if sys.platform == "win32":
     shelve.open = shelve_open_semidbm
 
 
+class ScanCancelled(Exception):
+    pass
+
+
+class ScanThrottle:
+    """ Limits the rate at which files are read during a share scan, to leave disk
+    bandwidth for uploads. The scan is paused while uploads are faster than the
+    configured threshold. Waits end early once the cancelled event is set. """
+
+    def __init__(self, np, config, cancelled=None):
+
+        self.np = np
+        self.cancelled = cancelled if cancelled is not None else threading.Event()
+        self.enabled = config.sections["transfers"]["rescanthrottle"]
+
+        filespersecond = config.sections["transfers"]["rescanfilespersecond"]
+        self.interval = 1.0 / filespersecond if filespersecond > 0 else 0
+        self.pause_speed = config.sections["transfers"]["rescanpauseuploads"] * 1024
+
+        self.start_time = self.next_time = time.time()
+        self.num_files = 0
+
+    def lower_priority(self):
+        """ Lower the CPU priority of the scanning thread. On Linux, this also lowers
+        its disk priority, unless an I/O scheduling class was set explicitly. """
+
+        if not self.enabled:
+            return
+
+        try:
+            thread_id = threading.get_native_id()
+            os.setpriority(os.PRIO_PROCESS, thread_id, 19)
+
+        except (AttributeError, OSError):
+            # Not supported on this platform
+            pass
+
+    def get_upload_speed(self):
+
+        if self.np is None or self.np.transfers is None:
+            return 0
+
+        return sum(i.speed for i in self.np.transfers.uploads if i.conn is not None and i.speed is not None)
+
+    def get_rate(self):
+        """ Returns the number of files scanned per second so far """
+
+        elapsed = time.time() - self.start_time
+
+        if elapsed <= 0:
+            return 0.0
+
+        return self.num_files / elapsed
+
+    def file_scanned(self):
+        """ Called after reading a file, waits until the next file can be read """
+
+        self.num_files += 1
+
+        if not self.enabled:
+            return
+
+        if self.pause_speed:
+            while self.get_upload_speed() > self.pause_speed:
+                if self.cancelled.wait(1):
+                    return
+
+                self.next_time = time.time()
+
+        if not self.interval:
+            return
+
+        self.next_time += self.interval
+        delay = self.next_time - time.time()
+
+        if delay > 0:
+            self.cancelled.wait(delay)
+
+        elif delay < -1:
+            # Don't read a burst of files to catch up after a slow period
+            self.next_time = time.time()
+
+
 class Shares:
 
     def __init__(self, np, config, queue, ui_callback=None):
         self.np = np
         self.ui_callback = ui_callback
+        self.scan_cancelled = threading.Event()
         self.config = config
         self.queue = queue
         self.translatepunctuation = str.maketrans(dict.fromkeys(string.punctuation, ' '))
@@ -61,8 +149,8 @@ class Shares:
                 ("bsharedfiles", os.path.join(self.config.data_dir, "buddyfiles.db")),
                 ("sharedfilesstreams", os.path.join(self.config.data_dir, "streams.db")),
                 ("bsharedfilesstreams", os.path.join(self.config.data_dir, "buddystreams.db")),
-                ("wordindex", os.path.join(self.config.data_dir, "wordindex.db")),
-                ("bwordindex", os.path.join(self.config.data_dir, "buddywordindex.db")),
+                ("wordindex", os.path.join(self.config.data_dir, "wordindex.idx")),
+                ("bwordindex", os.path.join(self.config.data_dir, "buddywordindex.idx")),
                 ("fileindex", os.path.join(self.config.data_dir, "fileindex.db")),
                 ("bfileindex", os.path.join(self.config.data_dir, "buddyfileindex.db")),
                 ("sharedmtimes", os.path.join(self.config.data_dir, "mtimes.db")),
@@ -138,11 +226,28 @@ class Shares:
         errors = []
 
         for destination, shelvefile in dbs:
+            if destination in ("wordindex", "bwordindex") and not os.path.exists(shelvefile) \
+                    and self.legacy_word_index_files(shelvefile):
+                # Word indexes of older versions were stored in shelves, and have to be
+                # rebuilt. Clearing the shares below also removes the old shelves.
+                errors.append(shelvefile)
+                self.config.sections["transfers"][destination] = WordIndex()
+                continue
+
             try:
-                self.config.sections["transfers"][destination] = shelve.open(shelvefile, protocol=pickle.HIGHEST_PROTOCOL)
+                if destination in ("wordindex", "bwordindex"):
+                    self.config.sections["transfers"][destination] = WordIndex(shelvefile)
+                else:
+                    self.config.sections["transfers"][destination] = shelve.open(shelvefile, protocol=pickle.HIGHEST_PROTOCOL)
             except Exception:
                 errors.append(shelvefile)
 
+                if destination in ("wordindex", "bwordindex"):
+                    # The word index is damaged, start with an empty one
+                    self.config.sections["transfers"][destination] = WordIndex()
+
+        errors += self.get_stale_word_indexes(dict(dbs), errors)
+
         if errors:
             log.add_warning(_("Failed to process the following databases: %(names)s") % {'names': '\n'.join(errors)})
 
@@ -150,6 +255,27 @@ class Shares:
 
             log.add_warning(_("Shared files database seems to be corrupted, rescan your shares"))
 
+    def get_stale_word_indexes(self, dbs, errors):
+        """ Returns the word indexes that don't cover every file in their file index.
+        Files added to the shares after a download are only written to the word index
+        when it's closed, so it falls behind the file index if we exit abruptly. """
+
+        stale = []
+
+        for wordindex, fileindex in (("wordindex", "fileindex"), ("bwordindex", "bfileindex")):
+            if wordindex not in dbs or fileindex not in dbs or dbs[wordindex] in errors or dbs[fileindex] in errors:
+                continue
+
+            try:
+                num_files = len(self.config.sections["transfers"][fileindex])
+            except TypeError:
+                num_files = len(list(self.config.sections["transfers"][fileindex]))
+
+            if self.config.sections["transfers"][wordindex].get_num_files() != num_files:
+                stale.append(dbs[wordindex])
+
+        return stale
+
     def set_shares(self, sharestype="normal", files=None, streams=None, mtimes=None, wordindex=None, fileindex=None):
 
         if sharestype == "normal":
@@ -157,7 +283,7 @@ class Shares:
                 (files, "sharedfiles", "files.db"),
                 (streams, "sharedfilesstreams", "streams.db"),
                 (mtimes, "sharedmtimes", "mtimes.db"),
-                (wordindex, "wordindex", "wordindex.db"),
+                (wordindex, "wordindex", "wordindex.idx"),
                 (fileindex, "fileindex", "fileindex.db")
             ]
         else:
@@ -165,7 +291,7 @@ class Shares:
                 (files, "bsharedfiles", "buddyfiles.db"),
                 (streams, "bsharedfilesstreams", "buddystreams.db"),
                 (mtimes, "bsharedmtimes", "buddymtimes.db"),
-                (wordindex, "bwordindex", "buddywordindex.db"),
+                (wordindex, "bwordindex", "buddywordindex.idx"),
                 (fileindex, "bfileindex", "buddyfileindex.db")
             ]
 
@@ -173,6 +299,11 @@ class Shares:
             if source is not None:
                 try:
                     self.config.sections["transfers"][destination].close()
+
+                    if destination in ("wordindex", "bwordindex"):
+                        self.set_word_index(destination, filename, source)
+                        continue
+
                     self.config.sections["transfers"][destination] = shelve.open(os.path.join(self.config.data_dir, filename), flag='n', protocol=pickle.HIGHEST_PROTOCOL)
                     self.config.sections["transfers"][destination].update(source)
 
@@ -180,10 +311,29 @@ class Shares:
                     log.add_warning(_("Can't save %s: %s") % (filename, e))
                     return
 
+    def set_word_index(self, destination, filename, wordindex):
+        """ Write a compact word index to disk, and load it """
+
+        path = os.path.join(self.config.data_dir, filename)
+
+        wordindex.save(path)
+        self.config.sections["transfers"][destination] = WordIndex(path)
+
+        # Word indexes used to be stored in shelves, remove them to free up disk space
+        for legacyfile in self.legacy_word_index_files(path):
+            try:
+                os.remove(legacyfile)
+            except OSError:
+                pass
+
+    def legacy_word_index_files(self, path):
+        """ Returns the files of the shelve a word index was stored in by older versions """
+        return glob.glob(glob.escape(os.path.splitext(path)[0] + ".db") + "*")
+
     def clear_shares(self):
 
-        self.set_shares(sharestype="normal", files={}, streams={}, mtimes={}, wordindex={}, fileindex={})
-        self.set_shares(sharestype="buddy", files={}, streams={}, mtimes={}, wordindex={}, fileindex={})
+        self.set_shares(sharestype="normal", files={}, streams={}, mtimes={}, wordindex=WordIndex(), fileindex={})
+        self.set_shares(sharestype="buddy", files={}, streams={}, mtimes={}, wordindex=WordIndex(), fileindex={})
 
     def compress_shares(self, sharestype):
 
@@ -240,6 +390,33 @@ class Shares:
 
     """ Scanning """
 
+    # Seconds between saving the folders scanned so far
+    CHECKPOINT_INTERVAL = 30
+
+    def cancel_scans(self):
+        """ Stop running scans. Folders scanned so far are kept in a checkpoint,
+        and the next scan resumes from there. """
+        self.scan_cancelled.set()
+
+    def get_checkpoint_path(self, sharestype):
+
+        if sharestype == "normal":
+            filename = "scancheckpoint.db"
+        else:
+            filename = "buddyscancheckpoint.db"
+
+        return os.path.join(self.config.data_dir, filename)
+
+    def remove_checkpoint(self, sharestype):
+
+        path = self.get_checkpoint_path(sharestype)
+
+        for checkpointfile in glob.glob(glob.escape(path) + "*"):
+            try:
+                os.remove(checkpointfile)
+            except OSError:
+                pass
+
     def rebuild_shares(self):
         self._rescan_shares("normal", rebuild=True)
 
@@ -283,13 +460,19 @@ class Shares:
                 self.ui_callback.set_scan_progress(sharestype, 0.0)
                 self.ui_callback.show_scan_progress(sharestype)
 
+            self.scan_cancelled.clear()
+
+            throttle = ScanThrottle(self.np, self.config, self.scan_cancelled)
+            throttle.lower_priority()
+
             self.rescan_dirs(
                 sharestype,
                 shared_folders,
                 mtimes,
                 files,
                 filesstreams,
-                rebuild=rebuild
+                rebuild=rebuild,
+                throttle=throttle
             )
 
             if self.ui_callback:
@@ -298,6 +481,12 @@ class Shares:
             self.compress_shares(sharestype)
             self.send_num_shared_folders_files()
 
+        except ScanCancelled:
+            log.add(_("Share scan cancelled, it will resume from where it stopped next time"))
+
+            if self.ui_callback:
+                self.ui_callback.rescan_finished(sharestype)
+
         except Exception as ex:
             log.add(
                 _("Failed to rebuild share, serious error occurred. If this problem persists delete %s/*.db and try again. If that doesn't help please file a bug report with the stack trace included (see terminal output after this message). Technical details: %s"), (self.config.data_dir, ex)
@@ -307,7 +496,7 @@ class Shares:
 
             raise
 
-    def rescan_dirs(self, sharestype, shared, oldmtimes, oldfiles, oldstreams, rebuild=False):
+    def rescan_dirs(self, sharestype, shared, oldmtimes, oldfiles, oldstreams, rebuild=False, throttle=None):
         """
         Check for modified or new files via OS's last mtime on a directory,
         or, if rebuild is True, all directories
@@ -342,16 +531,19 @@ class Shares:
         # Get list of files
         # returns dict in format { Directory : { File : metadata, ... }, ... }
         # returns dict in format { Directory : hex string of files+metadata, ... }
-        newsharedfiles, newsharedfilesstreams = self.get_files_list(sharestype, newmtimes, oldmtimes, oldfiles, oldstreams, rebuild)
+        newsharedfiles, newsharedfilesstreams = self.get_files_list(sharestype, newmtimes, oldmtimes, oldfiles, oldstreams, rebuild, throttle)
 
         # Save data to shelves
         self.set_shares(sharestype=sharestype, files=newsharedfiles, streams=newsharedfilesstreams, mtimes=newmtimes)
 
         # Update Search Index
-        # wordindex is a dict in format {word: [num, num, ..], ... } with num matching keys in newfileindex
+        # wordindex maps each word to the nums of the files it appears in, with num matching keys in newfileindex
         # fileindex is a dict in format { num: (path, size, (bitrate, vbr), length), ... }
         self.get_files_index(sharestype, newsharedfiles)
 
+        # The scan is complete, we don't need to resume it
+        self.remove_checkpoint(sharestype)
+
         log.add(_("%(num)s folders found after rescan"), {"num": len(newsharedfiles)})
 
     def is_hidden(self, folder, filename=None, folder_obj=None):
@@ -382,18 +574,21 @@ class Shares:
 
         return False
 
-    def add_file_to_index(self, index, filename, folder, fileinfo, wordindex, fileindex):
+    def get_words(self, text):
+        """ Returns the set of words in a file or folder name, as used for the search index """
+        return set(text.lower().translate(self.translatepunctuation).split())
+
+    def add_file_to_index(self, index, filename, folder, fileinfo, wordindex, fileindex, folderwords=None):
         """ Add a file to the file index database """
 
         fileindex[repr(index)] = (folder + '\\' + filename, *fileinfo[1:])
 
-        # Collect words from filenames for Search index
-        # Use set to prevent duplicates
-        for k in set((folder + " " + filename).lower().translate(self.translatepunctuation).split()):
-            try:
-                wordindex[k].append(index)
-            except KeyError:
-                wordindex[k] = [index]
+        # Words in the folder name are indexed once for the folder, not for each file in it
+        if folderwords is None:
+            folderwords = self.get_words(folder)
+            wordindex.add_folder(folderwords, index)
+
+        wordindex.add_file(self.get_words(filename) - folderwords, index)
 
     def add_file_to_shared(self, name):
         """ Add a file to the normal shares database """
@@ -512,16 +707,52 @@ class Shares:
 
         return mtimes
 
-    def get_files_list(self, sharestype, mtimes, oldmtimes, oldfiles, oldstreams, rebuild=False):
+    def get_files_list(self, sharestype, mtimes, oldmtimes, oldfiles, oldstreams, rebuild=False, throttle=None):
         """ Get a list of files with their filelength, bitrate and track length in seconds """
 
+        if throttle is None:
+            throttle = ScanThrottle(self.np, self.config, self.scan_cancelled)
+
+        """ Scanned folders are saved to a checkpoint as we go, in format
+        { Directory : (mtime, virtual directory, files, stream), ... }.
+        If a previous scan was interrupted, folders it scanned are reused, unless
+        the shares are rebuilt, which reads every folder again. """
+        if rebuild:
+            self.remove_checkpoint(sharestype)
+
+        checkpoint = shelve.open(self.get_checkpoint_path(sharestype), protocol=pickle.HIGHEST_PROTOCOL)
+
+        try:
+            return self._get_files_list(sharestype, mtimes, oldmtimes, oldfiles, oldstreams, rebuild, throttle, checkpoint)
+
+        finally:
+            checkpoint.close()
+
+    def _get_files_list(self, sharestype, mtimes, oldmtimes, oldfiles, oldstreams, rebuild, throttle, checkpoint):
+
         files = {}
         streams = {}
         count = 0
         lastpercent = 0.0
+        lastcheckpoint = time.time()
+
+        try:
+            num_checkpoint_folders = len(checkpoint)
+        except TypeError:
+            num_checkpoint_folders = len(list(checkpoint))
+
+        if num_checkpoint_folders:
+            log.add(_("Resuming share scan, %(num)s folders were already scanned"), {"num": num_checkpoint_folders})
 
         for folder in mtimes:
 
+            if self.scan_cancelled.is_set():
+                raise ScanCancelled
+
+            if time.time() - lastcheckpoint >= self.CHECKPOINT_INTERVAL:
+                checkpoint.sync()
+                lastcheckpoint = time.time()
+
             try:
                 count += 1
 
@@ -530,7 +761,8 @@ class Shares:
                     percent = float("%.2f" % (float(count) / len(mtimes) * 0.75))
 
                     if percent > lastpercent and percent <= 1.0:
-                        self.ui_callback.set_scan_progress(sharestype, percent)
+                        rate = throttle.get_rate() if throttle.enabled else None
+                        self.ui_callback.set_scan_progress(sharestype, percent, rate)
                         lastpercent = percent
 
                 virtualdir = self.real2virtual(folder)
@@ -551,6 +783,14 @@ class Shares:
                             log.add_debug(_("Dropping missing folder %(dir)s"), {'dir': folder})
                             continue
 
+                if folder in checkpoint:
+                    mtime, checkpointvdir, checkpointfiles, checkpointstream = checkpoint[folder]
+
+                    if mtime == mtimes[folder] and checkpointvdir == virtualdir:
+                        files[virtualdir] = checkpointfiles
+                        streams[virtualdir] = checkpointstream
+                        continue
+
                 files[virtualdir] = []
 
                 for entry in os.scandir(folder):
@@ -566,7 +806,13 @@ class Shares:
                         if data is not None:
                             files[virtualdir].append(data)
 
+                        throttle.file_scanned()
+
+                        if self.scan_cancelled.is_set():
+                            raise ScanCancelled
+
                 streams[virtualdir] = self.get_dir_stream(files[virtualdir])
+                checkpoint[folder] = (mtimes[folder], virtualdir, files[virtualdir], streams[virtualdir])
 
             except OSError as errtuple:
                 log.add(_("Error while scanning folder %(path)s: %(error)s"), {'path': folder, 'error': errtuple})
@@ -661,8 +907,9 @@ class Shares:
             shelve.open(os.path.join(self.config.data_dir, target + ".db"), flag='n', protocol=pickle.HIGHEST_PROTOCOL)
 
         """ For the word index, we can't use the same approach as above, as we need
-        to access dict elements frequently. This would take too long on a shelf. """
-        wordindex = {}
+        to access its elements frequently. Words are collected in memory, and written
+        to a compact index file once all files have been added. """
+        wordindex = WordIndex()
 
         index = 0
         count = len(sharedfiles)
@@ -679,8 +926,16 @@ class Shares:
                     self.ui_callback.set_scan_progress(sharestype, percent)
                     lastpercent = percent
 
-            for fileinfo in sharedfiles[folder]:
-                self.add_file_to_index(index, fileinfo[0], folder, fileinfo, wordindex, fileindex)
+            files = sharedfiles[folder]
+
+            if not files:
+                continue
+
+            folderwords = self.get_words(folder)
+            wordindex.add_folder(folderwords, index)
+
+            for fileinfo in files:
+                self.add_file_to_index(index, fileinfo[0], folder, fileinfo, wordindex, fileindex, folderwords)
                 index += 1
 
         self.set_shares(sharestype=sharestype, wordindex=wordindex)
@@ -690,35 +945,11 @@ class Shares:
     def create_search_result_list(self, searchterm, wordindex, maxresults=50):
 
         try:
-            """ Stage 1: Check if each word in the search term is included in our word index.
-            If this is the case, we select the word that has the most file matches in our
-            word index. If not, exit, since we don't have relevant results. """
-
-            largest = 0
-
-            for i in re.finditer(r'\S+', searchterm):
-                i = i.group(0)
-
-                if i not in wordindex:
-                    return
-
-                list_size = len(wordindex[i])
-
-                if list_size > largest:
-                    largest = list_size
-                    largest_key = i
-
-            """ Stage 2: Start with the word that has the most file matches, which we selected
-            in the previous step, and gradually remove matches that other words in the search
-            term don't have. Return the remaining matches, if any. """
-
-            results = wordindex[largest_key]
-            searchterm.replace(largest_key, '')
-
-            for i in re.finditer(r'\S+', searchterm):
-                results = set(results).intersection(wordindex[i.group(0)])
+            """ Words in folder names are indexed per folder, and words in file names per
+            file. The word index intersects them folder by folder, starting with the word
+            that has the fewest matches, and stops once we have enough results. """
 
-            return results
+            return wordindex.search(searchterm.split(), maxresults)
 
         except ValueError:
             # DB is closed, perhaps when rescanning share or closing Nicotine+
@@ -24,12 +24,15 @@ import socket
 import struct
 import zlib
 
+from array import array
 from gettext import gettext as _
 from itertools import count
 from itertools import islice
+from sys import maxsize
 
 from pynicotine.logfacility import log
 from pynicotine.utils import debug
+from pynicotine.utils import get_bitrate_length
 
 """ This module contains message classes, that networking and UI thread
 exchange. Basically there are three types of messages: internal messages,
@@ -37,6 +40,192 @@ server messages and p2p messages (between clients)."""
 
 counter = count(100)
 
+""" Precompiled structs, used to decode and encode message fields """
+
+INT_PACK = struct.Struct("<i").pack
+UINT_PACK = struct.Struct("<I").pack
+ULONGLONG_PACK = struct.Struct("<Q").pack
+
+INT_UNPACK_FROM = struct.Struct("<i").unpack_from
+UINT_UNPACK_FROM = struct.Struct("<I").unpack_from
+USHORT_UNPACK_FROM = struct.Struct("<H").unpack_from
+ULONGLONG_UNPACK_FROM = struct.Struct("<Q").unpack_from
+UINT_PAIR_UNPACK_FROM = struct.Struct("<II").unpack_from
+IP_UNPACK_FROM = struct.Struct("4s").unpack_from
+
+
+def unpack_length(message, start):
+    """ Returns the length prefix of a string in a message """
+
+    try:
+        return UINT_UNPACK_FROM(message, start)[0]
+    except struct.error:
+        if start > len(message):
+            # Past the end of the message, don't keep reading empty strings
+            raise
+
+        # Truncated message, pad the length with zeros
+        return int.from_bytes(bytes(message[start:start + 4]), "little")
+
+
+def unpack_string(message, start):
+    """ Returns the position following a string in a message, and the string.
+    Strings are decoded from UTF-8, or Latin-1 for older clients (Soulseek NS). """
+
+    end = start + 4 + unpack_length(message, start)
+    string = message[start + 4:end]
+
+    try:
+        return end, str(string, "utf-8")
+    except UnicodeDecodeError:
+        return end, str(string, "iso-8859-1")
+
+
+""" Message schemas. Messages that consist of a plain sequence of fields declare
+them, e.g. "uint32 token, string user, uint64 size", and their make_network_message
+and parse_network_message methods are generated from the declaration when the
+module is imported. Consecutive fixed size fields are packed and unpacked with a
+single precompiled struct. """
+
+FIXED_FIELD_TYPES = {
+    # Type: (struct format, conversion when unpacking, conversion when packing)
+    "uint8": ("B", "%s", "%s"),
+    "bool": ("B", "bool(%s)", "%s"),
+    "uint16": ("H2x", "%s", "%s"),  # Stored in 4 bytes
+    "int32": ("i", "%s", "%s"),
+    "uint32": ("I", "%s", "%s"),
+    "uint64": ("Q", "%s", "%s"),
+    "ip": ("4s", "socket.inet_ntoa(%s[::-1])", "socket.inet_aton(%s)[::-1]")
+}
+FIELD_TYPES = set(FIXED_FIELD_TYPES) | {"string", "bytes"}
+
+
+def get_fields(declaration):
+    """ Returns a tuple of (type, name) pairs from a field declaration """
+
+    fields = []
+
+    for field in declaration.split(","):
+        field_type, name = field.split()
+
+        if field_type not in FIELD_TYPES:
+            raise ValueError("Unknown field type %s" % field_type)
+
+        fields.append((field_type, name))
+
+    return tuple(fields)
+
+
+def _group_fields(fields):
+    """ Yields runs of consecutive fixed size fields as lists, and other fields
+    on their own """
+
+    group = []
+
+    for field in fields:
+        if field[0] in FIXED_FIELD_TYPES:
+            group.append(field)
+            continue
+
+        if group:
+            yield group
+            group = []
+
+        yield field
+
+    if group:
+        yield group
+
+
+def _build_function(name, lines, namespace):
+
+    source = "\n".join(lines)
+    exec(compile(source, "<message fields>", "exec"), namespace)
+
+    return namespace[name]
+
+
+def build_message_maker(fields):
+    """ Returns a make_network_message function that packs the given fields """
+
+    namespace = {"INT_PACK": INT_PACK, "socket": socket}
+    lines = ["def make_network_message(self):", "    msg = bytearray()"]
+
+    for group in _group_fields(fields):
+        if isinstance(group, list):
+            pack = "pack%i" % len(namespace)
+            namespace[pack] = struct.Struct("<" + "".join(FIXED_FIELD_TYPES[t][0] for t, n in group)).pack
+            values = ", ".join(FIXED_FIELD_TYPES[t][2] % ("self." + n) for t, n in group)
+
+            lines.append("    msg.extend(%s(%s))" % (pack, values))
+            continue
+
+        field_type, name = group
+
+        if field_type == "string":
+            lines.append("    value = self.%s.encode('utf-8', 'replace')" % name)
+        else:
+            lines.append("    value = self.%s" % name)
+
+        lines.append("    msg.extend(INT_PACK(len(value)))")
+        lines.append("    msg.extend(value)")
+
+    lines.append("    return msg")
+    return _build_function("make_network_message", lines, namespace)
+
+
+def build_message_parser(fields):
+    """ Returns a parse_network_message function that unpacks the given fields """
+
+    namespace = {"unpack_length": unpack_length, "unpack_string": unpack_string, "socket": socket, "struct": struct}
+    lines = ["def parse_network_message(self, message):", "    pos = 0", "    try:"]
+
+    for group in _group_fields(fields):
+        if isinstance(group, list):
+            unpacker = struct.Struct("<" + "".join(FIXED_FIELD_TYPES[t][0] for t, n in group))
+            unpack = "unpack%i" % len(namespace)
+            namespace[unpack] = unpacker.unpack_from
+            values = ["value%i" % i for i in range(len(group))]
+
+            lines.append("        %s, = %s(message, pos)" % (", ".join(values), unpack))
+
+            for (field_type, name), value in zip(group, values):
+                lines.append("        self.%s = %s" % (name, FIXED_FIELD_TYPES[field_type][1] % value))
+
+            lines.append("        pos += %i" % unpacker.size)
+            continue
+
+        field_type, name = group
+
+        if field_type == "string":
+            lines.append("        pos, self.%s = unpack_string(message, pos)" % name)
+        else:
+            lines.append("        end = pos + 4 + unpack_length(message, pos)")
+            lines.append("        self.%s = bytes(message[pos + 4:end])" % name)
+            lines.append("        pos = end")
+
+    lines.append("    except struct.error as error:")
+    lines.append("        self._unpack_error(error, 'fields', message, pos, True)")
+    return _build_function("parse_network_message", lines, namespace)
+
+
+def message_fields(make=None, parse=None):
+    """ Class decorator that generates the make_network_message and/or
+    parse_network_message methods of a message from its field declarations """
+
+    def generate(cls):
+        if make is not None:
+            cls.make_fields = get_fields(make)
+            cls.make_network_message = build_message_maker(cls.make_fields)
+
+        if parse is not None:
+            cls.parse_fields = get_fields(parse)
+            cls.parse_network_message = build_message_parser(cls.parse_fields)
+
+        return cls
+
+    return generate
+
 
 def new_id():
     global counter
@@ -44,8 +233,27 @@ def new_id():
     return new_id
 
 
+def msg_contents(obj):
+    """ Returns the variables of a message, for debug output. Works for messages
+    with and without __slots__, unlike vars(). """
+
+    contents = dict(getattr(obj, "__dict__", {}))
+
+    for cls in type(obj).__mro__:
+        slots = cls.__dict__.get("__slots__", ())
+
+        if isinstance(slots, str):
+            slots = (slots,)
+
+        for s in slots:
+            if hasattr(obj, s):
+                contents[s] = getattr(obj, s)
+
+    return contents
+
+
 class InternalMessage:
-    pass
+    __slots__ = ()
 
 
 class ConnectToServer(InternalMessage):
@@ -73,22 +281,26 @@ class OutConn(Conn):
     """ UI thread sends this to make networking thread establish a connection,
     when a connection is established, networking thread returns an object
     of this type."""
-    pass
+
+    __slots__ = ()
 
 
 class IncConn(Conn):
     """ Sent by networking thread to indicate an incoming connection."""
-    pass
+
+    __slots__ = ()
 
 
 class ConnClose(Conn):
     """ Sent by networking thread to indicate a connection has been closed."""
-    pass
+
+    __slots__ = ()
 
 
 class ServerConn(OutConn):
     """ A connection to the server has been established"""
-    pass
+
+    __slots__ = ()
 
 
 class ConnectError(InternalMessage):
@@ -122,6 +334,17 @@ class PeerTransfer(InternalMessage):
         self.msg = msg
 
 
+class SharedFileListProgress(InternalMessage):
+    """ Sent by networking thread with the directories of a browse response
+    that have been parsed so far, while the rest is still being received. """
+
+    __slots__ = "conn", "list"
+
+    def __init__(self, conn=None, shares=None):
+        self.conn = conn
+        self.list = shares
+
+
 class DownloadFile(InternalMessage):
     """ Sent by networking thread to indicate file transfer progress.
     Sent by UI to pass the file object to write and offset to resume download
@@ -205,70 +428,111 @@ class PopupMessage:
 class SlskMessage:
     """ This is a parent class for all protocol messages. """
 
+    __slots__ = ()
+
     def get_object(self, message, type, start=0, getintasshort=False, getsignedint=False, getunsignedlonglong=False, printerror=True, rawbytes=False):
         """ Returns object of specified type, extracted from message (which is
-        a binary array). start is an offset."""
-        intsize = struct.calcsize("<I")
+        a binary array). start is an offset. Messages use the specialised
+        readers below, this method is kept for compatibility. """
+
+        if type is int:
+            if getintasshort:
+                return self.get_uint16(message, start, printerror)
+
+            if getsignedint:
+                return self.get_int32(message, start, printerror)
+
+            if getunsignedlonglong:
+                return self.get_uint64(message, start, printerror)
+
+            return self.get_uint32(message, start, printerror)
+
+        if type is bytes:
+            if rawbytes:
+                return self.get_bytes(message, start, printerror)
+
+            return self.get_string(message, start, printerror)
+
+        return start, None
+
+    """ The readers below return the position following the value, and the value.
+    message can be a bytes-like object or a memoryview, values are unpacked in place
+    with precompiled structs. """
+
+    def get_uint16(self, message, start=0, printerror=True):
+        """ Little-endian unsigned short integer, stored in 4 bytes """
+
         try:
-            if type is int:
-                if getintasshort:
+            return start + 4, USHORT_UNPACK_FROM(message, start)[0]
+        except struct.error as error:
+            self._unpack_error(error, "uint16", message, start, printerror)
 
-                    # little-endian unsigned short integer (2 bytes)
-                    return intsize + start, struct.unpack("<H", message[start:start + struct.calcsize("<H")])[0]
-                elif getsignedint:
+    def get_uint32(self, message, start=0, printerror=True):
+        """ Little-endian unsigned integer (4 bytes) """
 
-                    # little-endian signed integer (4 bytes)
-                    return intsize + start, struct.unpack("<i", message[start:start + intsize])[0]
-                elif getunsignedlonglong:
+        try:
+            return start + 4, UINT_UNPACK_FROM(message, start)[0]
+        except struct.error as error:
+            self._unpack_error(error, "uint32", message, start, printerror)
 
-                    # little-endian unsigned long long (8 bytes)
-                    try:
-                        return struct.calcsize("<Q") + start, struct.unpack("<Q", message[start:start + struct.calcsize("<Q")])[0]
-                    except Exception:
-                        return intsize + start, struct.unpack("<I", message[start:start + intsize])[0]
-                else:
+    def get_int32(self, message, start=0, printerror=True):
+        """ Little-endian signed integer (4 bytes) """
 
-                    # little-endian unsigned integer (4 bytes)
-                    return intsize + start, struct.unpack("<I", message[start:start + intsize])[0]
-            elif type is bytes:
-                length = struct.unpack("<I", message[start:start + intsize].ljust(intsize, b'\0'))[0]
-                string = message[start + intsize:start + length + intsize]
+        try:
+            return start + 4, INT_UNPACK_FROM(message, start)[0]
+        except struct.error as error:
+            self._unpack_error(error, "int32", message, start, printerror)
 
-                if rawbytes is False:
-                    try:
-                        string = string.decode('utf-8')
-                    except Exception:
-                        # Older clients (Soulseek NS)
+    def get_uint64(self, message, start=0, printerror=True):
+        """ Little-endian unsigned long long (8 bytes). Falls back to an unsigned
+        integer (4 bytes) at the end of a message. """
 
-                        try:
-                            string = string.decode('iso-8859-1')
-                        except Exception as error:
-                            if printerror:
-                                log.add_warning("Error trying to decode string '%s': %s", (string, error))
+        try:
+            return start + 8, ULONGLONG_UNPACK_FROM(message, start)[0]
+        except struct.error:
+            pass
 
-                return length + intsize + start, string
-            else:
-                return start, None
+        try:
+            return start + 4, UINT_UNPACK_FROM(message, start)[0]
         except struct.error as error:
-            if printerror:
-                log.add_warning("%s %s trying to unpack %s at '%s' at %s/%s", (self.__class__, error, type, message[start:].__repr__(), start, len(message)))
-            raise struct.error(error)
+            self._unpack_error(error, "uint64", message, start, printerror)
+
+    def get_bytes(self, message, start=0, printerror=True):
+        """ String prefixed with its length, returned as bytes """
+
+        end = start + 4 + unpack_length(message, start)
+        return end, bytes(message[start + 4:end])
+
+    def get_string(self, message, start=0, printerror=True):
+        """ String prefixed with its length, decoded from UTF-8 """
+        return unpack_string(message, start)
+
+    def get_ip(self, message, start=0):
+        """ IPv4 address, sent in reverse byte order """
+        return start + 4, socket.inet_ntoa(IP_UNPACK_FROM(message, start)[0][::-1])
+
+    def _unpack_error(self, error, type, message, start, printerror):
+
+        if printerror:
+            log.add_warning("%s %s trying to unpack %s at '%s' at %s/%s", (self.__class__, error, type, bytes(message[start:]).__repr__(), start, len(message)))
+
+        raise struct.error(error)
 
     def pack_object(self, object, unsignedint=False, unsignedlonglong=False):
         """ Returns object (integer, long or string packed into a
         binary array."""
         if isinstance(object, int):
             if unsignedint:
-                return struct.pack("<I", object)
+                return UINT_PACK(object)
             elif unsignedlonglong:
-                return struct.pack("<Q", object)
+                return ULONGLONG_PACK(object)
             else:
-                return struct.pack("<i", object)
+                return INT_PACK(object)
         elif isinstance(object, bytes):
-            return struct.pack("<i", len(object)) + object
+            return INT_PACK(len(object)) + object
         elif isinstance(object, str):
             encoded = object.encode("utf-8", 'replace')
-            return struct.pack("<i", len(encoded)) + encoded
+            return INT_PACK(len(encoded)) + encoded
 
         log.add_warning(_("Warning: unknown object type %(obj_type)s in message %(msg_type)s"), {'obj_type': type(object), 'msg_type': self.__class__})
         return b""
@@ -294,7 +558,7 @@ class SlskMessage:
         return '.'.join(strlist)
 
     def debug(self, message=None):
-        debug(type(self).__name__, self.__dict__, message.__repr__())
+        debug(type(self).__name__, getattr(self, "__dict__", None), message.__repr__())
 
 
 """
@@ -303,7 +567,7 @@ Server Messages
 
 
 class ServerMessage(SlskMessage):
-    pass
+    __slots__ = ()
 
 
 class Login(ServerMessage):
@@ -338,25 +602,26 @@ class Login(ServerMessage):
     def parse_network_message(self, message):
         pos, self.success = 1, message[0]
         if not self.success:
-            pos, self.reason = self.get_object(message, bytes, pos)
+            pos, self.reason = self.get_string(message, pos)
 
         else:
-            pos, self.banner = self.get_object(message, bytes, pos)
+            pos, self.banner = self.get_string(message, pos)
         if len(message[pos:]) > 0:
             try:
-                pos, self.ip = pos + 4, socket.inet_ntoa(message[pos:pos + 4][::-1])
+                pos, self.ip = self.get_ip(message, pos)
                 # Unknown number
             except Exception as error:
                 log.add_warning("Error unpacking IP address: %s", error)
             try:
                 # MD5 hexdigest of the password you sent
                 if len(message[pos:]) > 0:
-                    pos, self.checksum = self.get_object(message, bytes, pos)
+                    pos, self.checksum = self.get_string(message, pos)
             except Exception:
                 # Not an official client on the official server
                 pass
 
 
+@message_fields(make="int32 port")
 class SetWaitPort(ServerMessage):
     """ Server code: 2 """
     """ We send this to the server to indicate the port number that we
@@ -368,10 +633,8 @@ class SetWaitPort(ServerMessage):
     def __repr__(self):
         return 'SetWaitPort({})'.format(self.port)
 
-    def make_network_message(self):
-        return self.pack_object(self.port)
-
 
+@message_fields(make="string user", parse="string user, ip ip, uint16 port")
 class GetPeerAddress(ServerMessage):
     """ Server code: 3 """
     """ We send this to the server to ask for a peer's address
@@ -380,15 +643,8 @@ class GetPeerAddress(ServerMessage):
     def __init__(self, user=None):
         self.user = user
 
-    def make_network_message(self):
-        return self.pack_object(self.user)
-
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.ip = pos + 4, socket.inet_ntoa(message[pos:pos + 4][::-1])
-        pos, self.port = self.get_object(message, int, pos, 1)
-
 
+@message_fields(make="string user")
 class AddUser(ServerMessage):
     """ Server code: 5 """
     """ Used to be kept updated about a user's stats. When a user's
@@ -405,24 +661,22 @@ class AddUser(ServerMessage):
         self.country = None
         self.privileged = None
 
-    def make_network_message(self):
-        return self.pack_object(self.user)
-
     def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
+        pos, self.user = self.get_string(message)
         pos, self.userexists = pos + 1, message[pos]
         if message[pos:]:
-            pos, self.status = self.get_object(message, int, pos)
-            pos, self.avgspeed = self.get_object(message, int, pos)
-            pos, self.downloadnum = self.get_object(message, int, pos, getunsignedlonglong=True)
+            pos, self.status = self.get_uint32(message, pos)
+            pos, self.avgspeed = self.get_uint32(message, pos)
+            pos, self.downloadnum = self.get_uint64(message, pos)
 
-            pos, self.files = self.get_object(message, int, pos)
-            pos, self.dirs = self.get_object(message, int, pos)
+            pos, self.files = self.get_uint32(message, pos)
+            pos, self.dirs = self.get_uint32(message, pos)
 
             if message[pos:]:
-                pos, self.country = self.get_object(message, bytes, pos)
+                pos, self.country = self.get_string(message, pos)
 
 
+@message_fields(make="string user")
 class RemoveUser(ServerMessage):
     """ Server code: 6 """
     """ Used when we no longer want to be kept updated about a
@@ -431,10 +685,8 @@ class RemoveUser(ServerMessage):
     def __init__(self, user=None):
         self.user = user
 
-    def make_network_message(self):
-        return self.pack_object(self.user)
-
 
+@message_fields(make="string user")
 class GetUserStatus(ServerMessage):
     """ Server code: 7 """
     """ The server tells us if a user has gone away or has returned. """
@@ -443,12 +695,9 @@ class GetUserStatus(ServerMessage):
         self.user = user
         self.privileged = None
 
-    def make_network_message(self):
-        return self.pack_object(self.user)
-
     def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.status = self.get_object(message, int, pos)
+        pos, self.user = self.get_string(message)
+        pos, self.status = self.get_uint32(message, pos)
         # Exception handler is for Soulfind compatibility
         try:
             pos, self.privileged = pos + 1, message[pos]
@@ -456,6 +705,7 @@ class GetUserStatus(ServerMessage):
             pass
 
 
+@message_fields(make="string room, string msg", parse="string room, string user, string msg")
 class SayChatroom(ServerMessage):
     """ Server code: 13 """
     """ Either we want to say something in the chatroom, or someone else did. """
@@ -464,14 +714,6 @@ class SayChatroom(ServerMessage):
         self.room = room
         self.msg = msg
 
-    def make_network_message(self):
-        return self.pack_object(self.room) + self.pack_object(self.msg)
-
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.user = self.get_object(message, bytes, pos)
-        pos, self.msg = self.get_object(message, bytes, pos)
-
 
 class JoinRoom(ServerMessage):
     """ Server code: 14 """
@@ -490,43 +732,43 @@ class JoinRoom(ServerMessage):
         return self.pack_object(self.room)
 
     def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
+        pos, self.room = self.get_string(message)
         pos1 = pos
         pos, self.users = self.get_users(message[pos:])
         pos = pos1 + pos
 
         if len(message[pos:]) > 0:
             self.private = True
-            pos, self.owner = self.get_object(message, bytes, pos)
+            pos, self.owner = self.get_string(message, pos)
         if len(message[pos:]) > 0 and self.private:
-            pos, numops = self.get_object(message, int, pos)
+            pos, numops = self.get_uint32(message, pos)
             for i in range(numops):
-                pos, operator = self.get_object(message, bytes, pos)
+                pos, operator = self.get_string(message, pos)
                 self.operators.append(operator)
 
     def get_users(self, message):
-        pos, numusers = self.get_object(message, int)
+        pos, numusers = self.get_uint32(message)
         users = []
         for i in range(numusers):
-            pos, username = self.get_object(message, bytes, pos)
+            pos, username = self.get_string(message, pos)
             users.append([username, None, None, None, None, None, None, None, None])
-        pos, statuslen = self.get_object(message, int, pos)
+        pos, statuslen = self.get_uint32(message, pos)
         for i in range(statuslen):
-            pos, users[i][1] = self.get_object(message, int, pos)
-        pos, statslen = self.get_object(message, int, pos)
+            pos, users[i][1] = self.get_uint32(message, pos)
+        pos, statslen = self.get_uint32(message, pos)
         for i in range(statslen):
-            pos, users[i][2] = self.get_object(message, int, pos, getsignedint=True)
-            pos, users[i][3] = self.get_object(message, int, pos)
-            pos, users[i][4] = self.get_object(message, int, pos)
-            pos, users[i][5] = self.get_object(message, int, pos)
-            pos, users[i][6] = self.get_object(message, int, pos)
-        pos, slotslen = self.get_object(message, int, pos)
+            pos, users[i][2] = self.get_int32(message, pos)
+            pos, users[i][3] = self.get_uint32(message, pos)
+            pos, users[i][4] = self.get_uint32(message, pos)
+            pos, users[i][5] = self.get_uint32(message, pos)
+            pos, users[i][6] = self.get_uint32(message, pos)
+        pos, slotslen = self.get_uint32(message, pos)
         for i in range(slotslen):
-            pos, users[i][7] = self.get_object(message, int, pos)
+            pos, users[i][7] = self.get_uint32(message, pos)
         if len(message[pos:]) > 0:
-            pos, countrylen = self.get_object(message, int, pos)
+            pos, countrylen = self.get_uint32(message, pos)
             for i in range(countrylen):
-                pos, users[i][8] = self.get_object(message, bytes, pos)
+                pos, users[i][8] = self.get_string(message, pos)
 
         usersdict = {}
         for i in users:
@@ -535,6 +777,7 @@ class JoinRoom(ServerMessage):
         return pos, usersdict
 
 
+@message_fields(make="string room", parse="string room")
 class LeaveRoom(ServerMessage):
     """ Server code: 15 """
     """ We send this to the server when we want to leave a room. """
@@ -542,39 +785,31 @@ class LeaveRoom(ServerMessage):
     def __init__(self, room=None):
         self.room = room
 
-    def make_network_message(self):
-        return self.pack_object(self.room)
-
-    def parse_network_message(self, message):
-        self.room = self.get_object(message, bytes)[1]
-
 
 class UserJoinedRoom(ServerMessage):
     """ Server code: 16 """
     """ The server tells us someone has just joined a room we're in. """
 
     def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.username = self.get_object(message, bytes, pos)
+        pos, self.room = self.get_string(message)
+        pos, self.username = self.get_string(message, pos)
         i = [None, None, None, None, None, None, None, None]
-        pos, i[0] = self.get_object(message, int, pos)
-        pos, i[1] = self.get_object(message, int, pos, getsignedint=True)
+        pos, i[0] = self.get_uint32(message, pos)
+        pos, i[1] = self.get_int32(message, pos)
         for j in range(2, 7):
-            pos, i[j] = (self.get_object(message, int, pos))
+            pos, i[j] = (self.get_uint32(message, pos))
         if len(message[pos:]) > 0:
-            pos, i[7] = self.get_object(message, bytes, pos)
+            pos, i[7] = self.get_string(message, pos)
         self.userdata = UserData(i)
 
 
+@message_fields(parse="string room, string username")
 class UserLeftRoom(ServerMessage):
     """ Server code: 17 """
     """ The server tells us someone has just left a room we're in. """
 
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.username = self.get_object(message, bytes, pos)
-
 
+@message_fields(make="uint32 token, string user, string type")
 class ConnectToPeer(ServerMessage):
     """ Server code: 18 """
     """ Either we ask server to tell someone else we want to establish a
@@ -588,25 +823,18 @@ class ConnectToPeer(ServerMessage):
         self.user = user
         self.type = type
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.token, unsignedint=True))
-        msg.extend(self.pack_object(self.user))
-        msg.extend(self.pack_object(self.type))
-
-        return msg
-
     def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.type = self.get_object(message, bytes, pos)
-        pos, self.ip = pos + 4, socket.inet_ntoa(message[pos:pos + 4][::-1])
-        pos, self.port = self.get_object(message, int, pos, 1)
-        pos, self.token = self.get_object(message, int, pos)
+        pos, self.user = self.get_string(message)
+        pos, self.type = self.get_string(message, pos)
+        pos, self.ip = self.get_ip(message, pos)
+        pos, self.port = self.get_uint16(message, pos)
+        pos, self.token = self.get_uint32(message, pos)
 
         if len(message[pos:]) > 0:
             pos, self.privileged = pos + 1, message[pos]
 
 
+@message_fields(make="string user, string msg")
 class MessageUser(ServerMessage):
     """ Server code: 22 """
     """ Chat phrase sent to someone or received by us in private. """
@@ -615,18 +843,11 @@ class MessageUser(ServerMessage):
         self.user = user
         self.msg = msg
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.user))
-        msg.extend(self.pack_object(self.msg))
-
-        return msg
-
     def parse_network_message(self, message):
-        pos, self.msgid = self.get_object(message, int)
-        pos, self.timestamp = self.get_object(message, int, pos)
-        pos, self.user = self.get_object(message, bytes, pos)
-        pos, self.msg = self.get_object(message, bytes, pos)
+        pos, self.msgid = self.get_uint32(message)
+        pos, self.timestamp = self.get_uint32(message, pos)
+        pos, self.user = self.get_string(message, pos)
+        pos, self.msg = self.get_string(message, pos)
 
         if len(message[pos:]) > 0:
             pos, self.newmessage = pos + 1, message[pos]
@@ -634,6 +855,7 @@ class MessageUser(ServerMessage):
             self.newmessage = 1
 
 
+@message_fields(make="uint32 msgid")
 class MessageAcked(ServerMessage):
     """ Server code: 23 """
     """ We send this to the server to confirm that we received a private message.
@@ -643,10 +865,8 @@ class MessageAcked(ServerMessage):
     def __init__(self, msgid=None):
         self.msgid = msgid
 
-    def make_network_message(self):
-        return self.pack_object(self.msgid, unsignedint=True)
-
 
+@message_fields(make="uint32 searchid, string searchterm", parse="string user, uint32 searchid, string searchterm")
 class FileSearch(ServerMessage):
     """ Server code: 26 """
     """ We send this to the server when we search for something. Alternatively,
@@ -662,19 +882,8 @@ class FileSearch(ServerMessage):
         if text:
             self.searchterm = ' '.join((x for x in text.split() if x != '-'))
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.searchid, unsignedint=True))
-        msg.extend(self.pack_object(self.searchterm))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.searchid = self.get_object(message, int, pos)
-        pos, self.searchterm = self.get_object(message, bytes, pos)
-
 
+@message_fields(make="int32 status")
 class SetStatus(ServerMessage):
     """ Server code: 28 """
     """ We send our new status to the server. Status is a way to define whether
@@ -689,9 +898,6 @@ class SetStatus(ServerMessage):
     def __init__(self, status=None):
         self.status = status
 
-    def make_network_message(self):
-        return self.pack_object(self.status)
-
 
 class ServerPing(ServerMessage):
     """ Server code: 32 """
@@ -705,6 +911,7 @@ class ServerPing(ServerMessage):
         pass
 
 
+@message_fields(make="string user, uint32 speed")
 class SendSpeed(ServerMessage):
     """ Server code: 34 """
     """ We used to send this after a finished download to let the server update
@@ -714,14 +921,8 @@ class SendSpeed(ServerMessage):
         self.user = user
         self.speed = speed
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.user))
-        msg.extend(self.pack_object(self.speed, unsignedint=True))
-
-        return msg
-
 
+@message_fields(make="uint32 folders, uint32 files")
 class SharedFoldersFiles(ServerMessage):
     """ Server code: 35 """
     """ We send this to server to indicate the number of folder and files
@@ -731,14 +932,8 @@ class SharedFoldersFiles(ServerMessage):
         self.folders = folders
         self.files = files
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.folders, unsignedint=True))
-        msg.extend(self.pack_object(self.files, unsignedint=True))
-
-        return msg
-
 
+@message_fields(make="string user", parse="string user, int32 avgspeed, uint64 downloadnum, uint32 files, uint32 dirs")
 class GetUserStats(ServerMessage):
     """ Server code: 36 """
     """ The server sends this to indicate a change in a user's statistics,
@@ -750,26 +945,13 @@ class GetUserStats(ServerMessage):
         self.user = user
         self.country = None
 
-    def make_network_message(self):
-        return self.pack_object(self.user)
-
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.avgspeed = self.get_object(message, int, pos, getsignedint=True)
-        pos, self.downloadnum = self.get_object(message, int, pos, getunsignedlonglong=True)
-        pos, self.files = self.get_object(message, int, pos)
-        pos, self.dirs = self.get_object(message, int, pos)
-
 
+@message_fields(parse="string user, uint32 slotsfull")
 class QueuedDownloads(ServerMessage):
     """ Server code: 40 """
     """ The server sends this to indicate if someone has download slots available
     or not. DEPRECATED """
 
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.slotsfull = self.get_object(message, int, pos)
-
 
 class Relogged(ServerMessage):
     """ Server code: 41 """
@@ -781,6 +963,7 @@ class Relogged(ServerMessage):
         pass
 
 
+@message_fields(make="string suser, uint32 searchid, string searchterm", parse="string user, uint32 searchid, string searchterm")
 class UserSearch(ServerMessage):
     """ Server code: 42 """
     """ We send this to the server when we search a specific user's shares.
@@ -792,20 +975,8 @@ class UserSearch(ServerMessage):
         self.searchid = requestid
         self.searchterm = text
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.suser))
-        msg.extend(self.pack_object(self.searchid, unsignedint=True))
-        msg.extend(self.pack_object(self.searchterm))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.searchid = self.get_object(message, int, pos)
-        pos, self.searchterm = self.get_object(message, bytes, pos)
-
 
+@message_fields(make="string thing")
 class AddThingILike(ServerMessage):
     """ Server code: 51 """
     """ We send this to the server when we add an item to our likes list. """
@@ -813,10 +984,8 @@ class AddThingILike(ServerMessage):
     def __init__(self, thing=None):
         self.thing = thing
 
-    def make_network_message(self):
-        return self.pack_object(self.thing)
-
 
+@message_fields(make="string thing")
 class RemoveThingILike(ServerMessage):
     """ Server code: 52 """
     """ We send this to the server when we remove an item from our likes list. """
@@ -824,9 +993,6 @@ class RemoveThingILike(ServerMessage):
     def __init__(self, thing=None):
         self.thing = thing
 
-    def make_network_message(self):
-        return self.pack_object(self.thing)
-
 
 class Recommendations(ServerMessage):
     """ Server code: 54 """
@@ -846,19 +1012,19 @@ class Recommendations(ServerMessage):
     def unpack_recommendations(self, message, pos=0):
         self.recommendations = {}
         self.unrecommendations = {}
-        pos, num = self.get_object(message, int, pos)
+        pos, num = self.get_uint32(message, pos)
         for i in range(num):
-            pos, key = self.get_object(message, bytes, pos)
-            pos, rating = self.get_object(message, int, pos, getsignedint=True)
+            pos, key = self.get_string(message, pos)
+            pos, rating = self.get_int32(message, pos)
             self.recommendations[key] = rating
 
         if len(message[pos:]) == 0:
             return
 
-        pos, num2 = self.get_object(message, int, pos)
+        pos, num2 = self.get_uint32(message, pos)
         for i in range(num2):
-            pos, key = self.get_object(message, bytes, pos)
-            pos, rating = self.get_object(message, int, pos, getsignedint=True)
+            pos, key = self.get_string(message, pos)
+            pos, rating = self.get_int32(message, pos)
             self.unrecommendations[key] = rating
 
 
@@ -885,20 +1051,21 @@ class UserInterests(ServerMessage):
 
     def parse_network_message(self, message, pos=0):
         # Receive a users' interests
-        pos, self.user = self.get_object(message, bytes, pos)
-        pos, likesnum = self.get_object(message, int, pos)
+        pos, self.user = self.get_string(message, pos)
+        pos, likesnum = self.get_uint32(message, pos)
         self.likes = []
         for i in range(likesnum):
-            pos, key = self.get_object(message, bytes, pos)
+            pos, key = self.get_string(message, pos)
             self.likes.append(key)
 
-        pos, hatesnum = self.get_object(message, int, pos)
+        pos, hatesnum = self.get_uint32(message, pos)
         self.hates = []
         for i in range(hatesnum):
-            pos, key = self.get_object(message, bytes, pos)
+            pos, key = self.get_string(message, pos)
             self.hates.append(key)
 
 
+@message_fields(make="string user, uint32 req, uint32 place", parse="string user, uint32 req, uint32 place")
 class PlaceInLineResponse(ServerMessage):
     """ Server code: 60 """
     """ Server sends this to indicate change in place in queue while we're
@@ -909,35 +1076,18 @@ class PlaceInLineResponse(ServerMessage):
         self.user = user
         self.place = place
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.user))
-        msg.extend(self.pack_object(self.req, unsignedint=True))
-        msg.extend(self.pack_object(self.place, unsignedint=True))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.req = self.get_object(message, int, pos)
-        pos, self.place = self.get_object(message, int, pos)
-
 
+@message_fields(parse="string room")
 class RoomAdded(ServerMessage):
     """ Server code: 62 """
     """ The server tells us a new room has been added. """
 
-    def parse_network_message(self, message):
-        self.room = self.get_object(message, bytes)[1]
-
 
+@message_fields(parse="string room")
 class RoomRemoved(ServerMessage):
     """ Server code: 63 """
     """ The server tells us a room has been removed. """
 
-    def parse_network_message(self, message):
-        self.room = self.get_object(message, bytes)[1]
-
 
 class RoomList(ServerMessage):
     """ Server code: 64 """
@@ -949,16 +1099,16 @@ class RoomList(ServerMessage):
         return b""
 
     def parse_network_message(self, message):
-        pos, numrooms = self.get_object(message, int)
+        pos, numrooms = self.get_uint32(message)
         self.rooms = []
         self.ownedprivaterooms = []
         self.otherprivaterooms = []
         for i in range(numrooms):
-            pos, room = self.get_object(message, bytes, pos)
+            pos, room = self.get_string(message, pos)
             self.rooms.append([room, None])
-        pos, numusercounts = self.get_object(message, int, pos)
+        pos, numusercounts = self.get_uint32(message, pos)
         for i in range(numusercounts):
-            pos, usercount = self.get_object(message, int, pos)
+            pos, usercount = self.get_uint32(message, pos)
             self.rooms[i][1] = usercount
         if len(message[pos:]) == 0:
             return
@@ -967,14 +1117,14 @@ class RoomList(ServerMessage):
 
     def _get_rooms(self, originalpos, message):
         try:
-            pos, numberofrooms = self.get_object(message, int, originalpos)
+            pos, numberofrooms = self.get_uint32(message, originalpos)
             rooms = []
             for i in range(numberofrooms):
-                pos, room = self.get_object(message, bytes, pos)
+                pos, room = self.get_string(message, pos)
                 rooms.append([room, None])
-            pos, numberofusers = self.get_object(message, int, pos)
+            pos, numberofusers = self.get_uint32(message, pos)
             for i in range(numberofusers):
-                pos, usercount = self.get_object(message, int, pos)
+                pos, usercount = self.get_uint32(message, pos)
                 rooms[i][1] = usercount
             return (pos, rooms)
         except Exception as error:
@@ -982,27 +1132,18 @@ class RoomList(ServerMessage):
             return (originalpos, [])
 
 
+@message_fields(parse="string user, uint32 req, string file, string folder, uint64 size, uint32 checksum")
 class ExactFileSearch(ServerMessage):
     """ Server code: 65 """
     """ Someone is searching for a file with an exact name. DEPRECATED
     (no results even with official client) """
 
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.req = self.get_object(message, int, pos)
-        pos, self.file = self.get_object(message, bytes, pos)
-        pos, self.folder = self.get_object(message, bytes, pos)
-        pos, self.size = self.get_object(message, int, pos, getunsignedlonglong=True)
-        pos, self.checksum = self.get_object(message, int, pos)
-
 
+@message_fields(parse="string msg")
 class AdminMessage(ServerMessage):
     """ Server code: 66 """
     """ A global message from the server admin has arrived. """
 
-    def parse_network_message(self, message):
-        self.msg = self.get_object(message, bytes)[1]
-
 
 class GlobalUserList(JoinRoom):
     """ Server code: 67 """
@@ -1035,13 +1176,13 @@ class TunneledMessage(ServerMessage):
         return msg
 
     def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.code = self.get_object(message, int, pos)
-        pos, self.req = self.get_object(message, int, pos)
-        pos, self.ip = pos + 4, socket.inet_ntoa(self.strrev(message[pos:pos + 4]))
-        pos, port = self.get_object(message, int, pos, 1)
+        pos, self.user = self.get_string(message)
+        pos, self.code = self.get_uint32(message, pos)
+        pos, self.req = self.get_uint32(message, pos)
+        pos, self.ip = self.get_ip(message, pos)
+        pos, port = self.get_uint16(message, pos)
         self.addr = (self.ip, port)
-        pos, self.msg = self.get_object(message, bytes, pos)
+        pos, self.msg = self.get_string(message, pos)
 
 
 class PrivilegedUsers(ServerMessage):
@@ -1056,12 +1197,13 @@ class PrivilegedUsers(ServerMessage):
         except Exception:
             pass
         self.users = []
-        pos, numusers = self.get_object(message, int)
+        pos, numusers = self.get_uint32(message)
         for i in range(numusers):
-            pos, user = self.get_object(message, bytes, pos)
+            pos, user = self.get_string(message, pos)
             self.users.append(user)
 
 
+@message_fields(make="uint8 noparent")
 class HaveNoParent(ServerMessage):
     """ Server code: 71 """
     """ We inform the server if we have a distributed parent or not.
@@ -1071,9 +1213,6 @@ class HaveNoParent(ServerMessage):
     def __init__(self, noparent=None):
         self.noparent = noparent
 
-    def make_network_message(self):
-        return bytes([self.noparent])
-
 
 class SearchParent(ServerMessage):
     """ Server code: 73 """
@@ -1086,63 +1225,52 @@ class SearchParent(ServerMessage):
         return self.pack_object(socket.inet_aton(self.strunreverse(self.parentip)))
 
 
+@message_fields(parse="uint32 num")
 class ParentMinSpeed(ServerMessage):
     """ Server code: 83 """
     """ UNUSED """
 
-    def parse_network_message(self, message):
-        pos, self.num = self.get_object(message, int)
-
 
 class ParentSpeedRatio(ParentMinSpeed):
     """ Server code: 84 """
     """ UNUSED """
 
     def parse_network_message(self, message):
-        pos, self.num = self.get_object(message, int)
+        pos, self.num = self.get_uint32(message)
 
 
+@message_fields(parse="uint32 seconds")
 class ParentInactivityTimeout(ServerMessage):
     """ Server code: 86 """
     """ DEPRECATED """
 
-    def parse_network_message(self, message):
-        pos, self.seconds = self.get_object(message, int)
-
 
+@message_fields(parse="uint32 seconds")
 class SearchInactivityTimeout(ServerMessage):
     """ Server code: 87 """
     """ DEPRECATED """
 
-    def parse_network_message(self, message):
-        pos, self.seconds = self.get_object(message, int)
-
 
+@message_fields(parse="uint32 num")
 class MinParentsInCache(ServerMessage):
     """ Server code: 88 """
     """ DEPRECATED """
 
-    def parse_network_message(self, message):
-        pos, self.num = self.get_object(message, int)
-
 
+@message_fields(parse="uint32 seconds")
 class DistribAliveInterval(ServerMessage):
     """ Server code: 90 """
     """ DEPRECATED """
 
-    def parse_network_message(self, message):
-        pos, self.seconds = self.get_object(message, int)
-
 
+@message_fields(parse="string user")
 class AddToPrivileged(ServerMessage):
     """ Server code: 91 """
     """ The server sends us the username of a new privileged user, which we
     add to our list of global privileged users. """
 
-    def parse_network_message(self, message):
-        l2, self.user = self.get_object(message, bytes)
-
 
+@message_fields(parse="uint32 seconds")
 class CheckPrivileges(ServerMessage):
     """ Server code: 92 """
     """ We ask the server how much time we have left of our privileges.
@@ -1151,22 +1279,16 @@ class CheckPrivileges(ServerMessage):
     def make_network_message(self):
         return b""
 
-    def parse_network_message(self, message):
-        pos, self.seconds = self.get_object(message, int)
-
 
+@message_fields(parse="uint8 code, uint32 something, string user, uint32 searchid, string searchterm")
 class SearchRequest(ServerMessage):
     """ Server code: 93 """
     """ The server sends us search requests from other users. """
 
-    def parse_network_message(self, message):
-        pos, self.code = 1, message[0]
-        pos, self.something = self.get_object(message, int, pos)
-        pos, self.user = self.get_object(message, bytes, pos)
-        pos, self.searchid = self.get_object(message, int, pos)
-        pos, self.searchterm = self.get_object(message, bytes, pos)
+    __slots__ = "code", "something", "user", "searchid", "searchterm"
 
 
+@message_fields(make="uint8 enabled")
 class AcceptChildren(ServerMessage):
     """ Server code: 100 """
     """ We tell the server if we want to accept child nodes.
@@ -1175,9 +1297,6 @@ class AcceptChildren(ServerMessage):
     def __init__(self, enabled=None):
         self.enabled = enabled
 
-    def make_network_message(self):
-        return bytes([self.enabled])
-
 
 class PossibleParents(ServerMessage):
     """ Server code: 102 """
@@ -1187,11 +1306,11 @@ class PossibleParents(ServerMessage):
 
     def parse_network_message(self, message: bytes):
         self.list = {}
-        pos, num = self.get_object(message, int)
+        pos, num = self.get_uint32(message)
         for i in range(num):
-            pos, username = self.get_object(message, bytes, pos)
-            pos, self.ip = pos + 4, socket.inet_ntoa(message[pos:pos + 4][::-1])
-            pos, port = self.get_object(message, int, pos)
+            pos, username = self.get_string(message, pos)
+            pos, self.ip = self.get_ip(message, pos)
+            pos, port = self.get_uint32(message, pos)
             self.list[username] = (self.ip, port)
 
 
@@ -1200,12 +1319,10 @@ class WishlistSearch(FileSearch):
     pass
 
 
+@message_fields(parse="uint32 seconds")
 class WishlistInterval(ServerMessage):
     """ Server code: 104 """
 
-    def parse_network_message(self, message):
-        pos, self.seconds = self.get_object(message, int)
-
 
 class SimilarUsers(ServerMessage):
     """ Server code: 110 """
@@ -1219,13 +1336,14 @@ class SimilarUsers(ServerMessage):
 
     def parse_network_message(self, message):
         self.users = {}
-        pos, num = self.get_object(message, int)
+        pos, num = self.get_uint32(message)
         for i in range(num):
-            pos, user = self.get_object(message, bytes, pos)
-            pos, rating = self.get_object(message, int, pos)
+            pos, user = self.get_string(message, pos)
+            pos, rating = self.get_uint32(message, pos)
             self.users[user] = rating
 
 
+@message_fields(make="string thing")
 class ItemRecommendations(GlobalRecommendations):
     """ Server code: 111 """
     """ The server sends us a list of recommendations related to a specific
@@ -1236,14 +1354,12 @@ class ItemRecommendations(GlobalRecommendations):
         GlobalRecommendations.__init__(self)
         self.thing = thing
 
-    def make_network_message(self):
-        return self.pack_object(self.thing)
-
     def parse_network_message(self, message):
-        pos, self.thing = self.get_object(message, bytes)
+        pos, self.thing = self.get_string(message)
         self.unpack_recommendations(message, pos)
 
 
+@message_fields(make="string thing")
 class ItemSimilarUsers(ServerMessage):
     """ Server code: 112 """
     """ The server sends us a list of similar users related to a specific item,
@@ -1253,15 +1369,12 @@ class ItemSimilarUsers(ServerMessage):
         self.thing = thing
         self.users = None
 
-    def make_network_message(self):
-        return self.pack_object(self.thing)
-
     def parse_network_message(self, message):
         self.users = []
-        pos, self.thing = self.get_object(message, bytes)
-        pos, num = self.get_object(message, int, pos)
+        pos, self.thing = self.get_string(message)
+        pos, num = self.get_uint32(message, pos)
         for i in range(num):
-            pos, user = self.get_object(message, bytes, pos)
+            pos, user = self.get_string(message, pos)
             self.users.append(user)
 
 
@@ -1278,14 +1391,15 @@ class RoomTickerState(ServerMessage):
         self.msgs = {}
 
     def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, n = self.get_object(message, int, pos)
+        pos, self.room = self.get_string(message)
+        pos, n = self.get_uint32(message, pos)
         for i in range(n):
-            pos, user = self.get_object(message, bytes, pos)
-            pos, msg = self.get_object(message, bytes, pos)
+            pos, user = self.get_string(message, pos)
+            pos, msg = self.get_string(message, pos)
             self.msgs[user] = msg
 
 
+@message_fields(parse="string room, string user, string msg")
 class RoomTickerAdd(ServerMessage):
     """ Server code: 114 """
     """ The server sends us a new ticker that was added to a chat room.
@@ -1298,12 +1412,8 @@ class RoomTickerAdd(ServerMessage):
         self.user = None
         self.msg = None
 
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.user = self.get_object(message, bytes, pos)
-        pos, self.msg = self.get_object(message, bytes, pos)
-
 
+@message_fields(parse="string room, string user")
 class RoomTickerRemove(ServerMessage):
     """ Server code: 115 """
     """ The server informs us that a ticker was removed from a chat room.
@@ -1315,11 +1425,8 @@ class RoomTickerRemove(ServerMessage):
         self.user = None
         self.room = room
 
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.user = self.get_object(message, bytes, pos)
-
 
+@message_fields(make="string room, string msg")
 class RoomTickerSet(ServerMessage):
     """ Server code: 116 """
     """ We send this to the server when we change our own ticker in
@@ -1332,13 +1439,6 @@ class RoomTickerSet(ServerMessage):
         self.room = room
         self.msg = msg
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.room))
-        msg.extend(self.pack_object(self.msg))
-
-        return msg
-
 
 class AddThingIHate(AddThingILike):
     """ Server code: 117 """
@@ -1352,6 +1452,7 @@ class RemoveThingIHate(RemoveThingILike):
     pass
 
 
+@message_fields(make="string room, uint32 searchid, string searchterm", parse="string room, uint32 searchid, string searchterm")
 class RoomSearch(ServerMessage):
     """ Server code: 120 """
 
@@ -1360,23 +1461,11 @@ class RoomSearch(ServerMessage):
         self.searchid = requestid
         self.searchterm = ' '.join([x for x in text.split() if x != '-'])
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.room))
-        msg.extend(self.pack_object(self.searchid, unsignedint=True))
-        msg.extend(self.pack_object(self.searchterm))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.searchid = self.get_object(message, int, pos)
-        pos, self.searchterm = self.get_object(message, bytes, pos)
-
     def __repr__(self):
         return "RoomSearch(room=%s, requestid=%s, text=%s)" % (self.room, self.searchid, self.searchterm)
 
 
+@message_fields(make="uint32 speed")
 class SendUploadSpeed(ServerMessage):
     """ Server code: 121 """
     """ We send this after a finished upload to let the server update the speed
@@ -1385,10 +1474,8 @@ class SendUploadSpeed(ServerMessage):
     def __init__(self, speed=None):
         self.speed = speed
 
-    def make_network_message(self):
-        return self.pack_object(self.speed, unsignedint=True)
-
 
+@message_fields(make="string user", parse="string user, bool privileged")
 class UserPrivileged(ServerMessage):
     """ Server code: 122 """
     """ We ask the server whether a user is privileged or not. """
@@ -1397,14 +1484,8 @@ class UserPrivileged(ServerMessage):
         self.user = user
         self.privileged = None
 
-    def make_network_message(self):
-        return self.pack_object(self.user)
-
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes, 0)
-        pos, self.privileged = pos + 1, bool(message[pos])
-
 
+@message_fields(make="string user, int32 days")
 class GivePrivileges(ServerMessage):
     """ Server code: 123 """
     """ We give (part of) our privileges, specified in days, to another
@@ -1414,14 +1495,8 @@ class GivePrivileges(ServerMessage):
         self.user = user
         self.days = days
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.user))
-        msg.extend(self.pack_object(self.days))
-
-        return msg
-
 
+@message_fields(make="int32 token, string user", parse="uint32 token, string user")
 class NotifyPrivileges(ServerMessage):
     """ Server code: 124 """
     """ Server tells us something about privileges. """
@@ -1430,54 +1505,32 @@ class NotifyPrivileges(ServerMessage):
         self.token = token
         self.user = user
 
-    def parse_network_message(self, message):
-        pos, self.token = self.get_object(message, int)
-        pos, self.user = self.get_object(message, bytes, pos)
-
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.token))
-        msg.extend(self.pack_object(self.user))
-
-        return msg
-
 
+@message_fields(make="uint32 token", parse="uint32 token")
 class AckNotifyPrivileges(ServerMessage):
     """ Server code: 125 """
 
     def __init__(self, token=None):
         self.token = token
 
-    def parse_network_message(self, message):
-        pos, self.token = self.get_object(message, int)
-
-    def make_network_message(self):
-        return self.pack_object(self.token, unsignedint=True)
-
 
+@message_fields(parse="uint32 value")
 class BranchLevel(ServerMessage):
     """ Server code: 126 """
     """ TODO: implement fully """
 
-    def parse_network_message(self, message):
-        pos, self.value = self.get_object(message, int)
-
 
+@message_fields(parse="string user")
 class BranchRoot(ServerMessage):
     """ Server code: 127 """
     """ TODO: implement fully """
 
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-
 
+@message_fields(parse="uint32 value")
 class ChildDepth(ServerMessage):
     """ Server code: 129 """
     """ TODO: implement fully """
 
-    def parse_network_message(self, message):
-        pos, self.value = self.get_object(message, int)
-
 
 class PrivateRoomUsers(ServerMessage):
     """ Server code: 133 """
@@ -1490,11 +1543,11 @@ class PrivateRoomUsers(ServerMessage):
         self.users = users
 
     def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.numusers = self.get_object(message, int, pos)
+        pos, self.room = self.get_string(message)
+        pos, self.numusers = self.get_uint32(message, pos)
         self.users = []
         for i in range(self.numusers):
-            pos, user = self.get_object(message, bytes, pos)
+            pos, user = self.get_string(message, pos)
             self.users.append(user)
 
 
@@ -1502,6 +1555,8 @@ class UserData:
     """ When we join a room the server send us a bunch of these,
     for each user."""
 
+    __slots__ = "status", "avgspeed", "downloadnum", "something", "files", "dirs", "slotsfull", "country"
+
     def __init__(self, list):
         self.status = list[0]
         self.avgspeed = list[1]
@@ -1513,6 +1568,7 @@ class UserData:
         self.country = list[7]
 
 
+@message_fields(make="string room, string user", parse="string room, string user")
 class PrivateRoomAddUser(ServerMessage):
     """ Server code: 134 """
     """ We send this to inform the server that we've added a user to a private room. """
@@ -1521,17 +1577,6 @@ class PrivateRoomAddUser(ServerMessage):
         self.room = room
         self.user = user
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.room))
-        msg.extend(self.pack_object(self.user))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.user = self.get_object(message, bytes, pos)
-
 
 class PrivateRoomRemoveUser(PrivateRoomAddUser):
     """ Server code: 135 """
@@ -1539,6 +1584,7 @@ class PrivateRoomRemoveUser(PrivateRoomAddUser):
     pass
 
 
+@message_fields(make="string room")
 class PrivateRoomDismember(ServerMessage):
     """ Server code: 136 """
     """ We send this to the server to remove our own membership of a private room. """
@@ -1546,10 +1592,8 @@ class PrivateRoomDismember(ServerMessage):
     def __init__(self, room=None):
         self.room = room
 
-    def make_network_message(self):
-        return self.pack_object(self.room)
-
 
+@message_fields(make="string room")
 class PrivateRoomDisown(ServerMessage):
     """ Server code: 137 """
     """ We send this to the server to stop owning a private room. """
@@ -1557,10 +1601,8 @@ class PrivateRoomDisown(ServerMessage):
     def __init__(self, room=None):
         self.room = room
 
-    def make_network_message(self):
-        return self.pack_object(self.room)
-
 
+@message_fields(make="string room", parse="string room")
 class PrivateRoomSomething(ServerMessage):
     """ Server code: 138 """
     """ UNKNOWN """
@@ -1568,13 +1610,8 @@ class PrivateRoomSomething(ServerMessage):
     def __init__(self, room=None):
         self.room = room
 
-    def make_network_message(self):
-        return self.pack_object(self.room)
-
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-
 
+@message_fields(parse="string room")
 class PrivateRoomAdded(ServerMessage):
     """ Server code: 139 """
     """ The server sends us this message when we are added to a private room. """
@@ -1582,9 +1619,6 @@ class PrivateRoomAdded(ServerMessage):
     def __init__(self, room=None):
         self.room = room
 
-    def parse_network_message(self, message):
-        self.room = self.get_object(message, bytes)[1]
-
 
 class PrivateRoomRemoved(PrivateRoomAdded):
     """ Server code: 140 """
@@ -1592,6 +1626,7 @@ class PrivateRoomRemoved(PrivateRoomAdded):
     pass
 
 
+@message_fields(make="uint8 enabled", parse="bool enabled")
 class PrivateRoomToggle(ServerMessage):
     """ Server code: 141 """
     """ We send this when we want to enable or disable invitations to private rooms. """
@@ -1599,14 +1634,8 @@ class PrivateRoomToggle(ServerMessage):
     def __init__(self, enabled=None):
         self.enabled = None if enabled is None else int(enabled)
 
-    def make_network_message(self):
-        return bytes([self.enabled])
-
-    def parse_network_message(self, message):
-        # When this is received, we store it in the config, and disable the appropriate menu item
-        pos, self.enabled = 1, bool(int(message[0]))  # noqa: F841
-
 
+@message_fields(make="string password", parse="string password")
 class ChangePassword(ServerMessage):
     """ Server code: 142 """
     """ We send this to the server to change our password. We receive a
@@ -1615,12 +1644,6 @@ class ChangePassword(ServerMessage):
     def __init__(self, password=None):
         self.password = password
 
-    def make_network_message(self):
-        return self.pack_object(self.password)
-
-    def parse_network_message(self, message):
-        pos, self.password = self.get_object(message, bytes)
-
 
 class PrivateRoomAddOperator(PrivateRoomAddUser):
     """ Server code: 143 """
@@ -1634,6 +1657,7 @@ class PrivateRoomRemoveOperator(PrivateRoomAddUser):
     pass
 
 
+@message_fields(parse="string room")
 class PrivateRoomOperatorAdded(ServerMessage):
     """ Server code: 145 """
     """ The server send us this message when we're given operator abilities
@@ -1642,10 +1666,8 @@ class PrivateRoomOperatorAdded(ServerMessage):
     def __init__(self, room=None):
         self.room = room
 
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-
 
+@message_fields(make="string room", parse="string room")
 class PrivateRoomOperatorRemoved(ServerMessage):
     """ Server code: 146 """
     """ The server send us this message when our operator abilities are removed
@@ -1654,12 +1676,6 @@ class PrivateRoomOperatorRemoved(ServerMessage):
     def __init__(self, room=None):
         self.room = room
 
-    def make_network_message(self):
-        return self.pack_object(self.room)
-
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-
 
 class PrivateRoomOwned(ServerMessage):
     """ Server code: 148 """
@@ -1671,11 +1687,11 @@ class PrivateRoomOwned(ServerMessage):
         self.number = number
 
     def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.number = self.get_object(message, int, pos)
+        pos, self.room = self.get_string(message)
+        pos, self.number = self.get_uint32(message, pos)
         self.operators = []
         for i in range(self.number):
-            pos, user = self.get_object(message, bytes, pos)
+            pos, user = self.get_string(message, pos)
             self.operators.append(user)
 
 
@@ -1697,17 +1713,14 @@ class LeavePublicRoom(ServerMessage):
         return b""
 
 
+@message_fields(parse="string room, string user, string msg")
 class PublicRoomMessage(ServerMessage):
     """ Server code: 152 """
     """ The server sends this when a new message has been written in a public
     room (every single line written in every public room). """
 
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.user = self.get_object(message, bytes, pos)
-        pos, self.msg = self.get_object(message, bytes, pos)
-
 
+@message_fields(make="uint32 token, string user", parse="uint32 token")
 class CantConnectToPeer(ServerMessage):
     """ Message 1001 """
     """ We send this to say we can't connect to peer after it has asked us
@@ -1719,16 +1732,6 @@ class CantConnectToPeer(ServerMessage):
         self.token = token
         self.user = user
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.token, unsignedint=True))
-        msg.extend(self.pack_object(self.user))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.token = self.get_object(message, int)
-
 # These are probably leftovers, not sure what to do with them
 
 
@@ -1744,9 +1747,10 @@ Peer Messages
 
 
 class PeerMessage(SlskMessage):
-    pass
+    __slots__ = ()
 
 
+@message_fields(make="uint32 token", parse="uint32 token")
 class PierceFireWall(PeerMessage):
     """ This is the very first message sent by the peer that established a
     connection, if it has been asked by the other peer to do so. The token
@@ -1756,13 +1760,8 @@ class PierceFireWall(PeerMessage):
         self.conn = conn
         self.token = token
 
-    def make_network_message(self):
-        return self.pack_object(self.token, unsignedint=True)
-
-    def parse_network_message(self, message):
-        pos, self.token = self.get_object(message, int)
-
 
+@message_fields(make="string user, string type, uint32 token", parse="string user, string type, uint32 token")
 class PeerInit(PeerMessage):
     """ This message is sent by the peer that initiated a connection,
     not necessarily a peer that actually established it. Token apparently
@@ -1775,19 +1774,6 @@ class PeerInit(PeerMessage):
         self.type = type
         self.token = token
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.user))
-        msg.extend(self.pack_object(self.type))
-        msg.extend(self.pack_object(self.token, unsignedint=True))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.type = self.get_object(message, bytes, pos)
-        pos, self.token = self.get_object(message, int, pos)
-
 
 class GetSharedFileList(PeerMessage):
     """ Peer code: 4 """
@@ -1804,6 +1790,84 @@ class GetSharedFileList(PeerMessage):
         pass
 
 
+class PackedFolderFiles:
+    """ Files of a directory in a browse response, kept in their packed form.
+    Browse responses can contain millions of files, and most directories are
+    never opened, so files are only decoded when the list is used. """
+
+    __slots__ = "message", "start", "count", "size", "files"
+
+    def __init__(self, message, start, count, size):
+        self.message = message
+        self.start = start
+        self.count = count
+        self.size = size
+        self.files = None  # Decoded files, once they're accessed by index
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+
+        if self.files is not None:
+            return iter(self.files)
+
+        return self.unpack_files()
+
+    def unpack_files(self):
+        message = self.message
+        pos = self.start
+
+        for i in range(self.count):
+            code = message[pos]
+            pos, name = unpack_string(message, pos + 1)
+
+            try:
+                size = ULONGLONG_UNPACK_FROM(message, pos)[0]
+                pos += 8
+            except struct.error:
+                size = UINT_UNPACK_FROM(message, pos)[0]
+                pos += 4
+
+            if message[pos - 1] == '\xff':
+                # Buggy SLSK?
+                # Some file sizes will be huge if unpacked as a signed
+                # LongType, namely somewhere in the area of 17179869 Terabytes.
+                # It would seem these files are indeed big, but in the Gigabyte range.
+                # The following will undo the damage (and if we fuck up it
+                # doesn't matter, it can never be worse than reporting 17
+                # exabytes for a single file)
+                size = struct.unpack("Q", '\xff' * struct.calcsize("Q"))[0] - size
+
+            pos, ext = unpack_string(message, pos)
+            numattr = UINT_UNPACK_FROM(message, pos)[0]
+            pos += 4
+
+            attrs = []
+
+            for k in range(numattr):
+                attrs.append(UINT_PAIR_UNPACK_FROM(message, pos)[1])
+                pos += 8
+
+            yield (code, name, size, ext, attrs)
+
+    def __getitem__(self, index):
+
+        if self.files is None:
+            self.files = list(self.unpack_files())
+
+        return self.files[index]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # Saved shares are loaded as regular lists
+        return (list, (list(self),))
+
+
 class SharedFileList(PeerMessage):
     """ Peer code: 5 """
     """ A peer responds with a list of shared files when we've sent
@@ -1818,6 +1882,8 @@ class SharedFileList(PeerMessage):
         try:
             if not nozlib:
                 message = zlib.decompress(message)
+            else:
+                message = bytes(message)
 
             self._parse_network_message(message)
         except Exception as error:
@@ -1826,44 +1892,120 @@ class SharedFileList(PeerMessage):
 
     def _parse_network_message(self, message):
         shares = []
-        pos, ndir = self.get_object(message, int)
+        pos, ndir = self.get_uint32(message)
 
         for i in range(ndir):
-            pos, directory = self.get_object(message, bytes, pos)
-            pos, nfiles = self.get_object(message, int, pos)
+            pos, directory = self._parse_directory(message, pos)
+            shares.append(directory)
 
-            files = []
+        self.list = shares
 
-            for j in range(nfiles):
-                pos, code = pos + 1, message[pos]
-                pos, name = self.get_object(message, bytes, pos)
-                pos, size = self.get_object(message, int, pos, getunsignedlonglong=True, printerror=False)
+    def _parse_directory(self, message, pos):
+        """ Returns the position following a directory in a message, and the
+        directory with its files. Files are only located here, and decoded
+        when they're needed. """
 
-                if message[pos - 1] == '\xff':
-                    # Buggy SLSK?
-                    # Some file sizes will be huge if unpacked as a signed
-                    # LongType, namely somewhere in the area of 17179869 Terabytes.
-                    # It would seem these files are indeed big, but in the Gigabyte range.
-                    # The following will undo the damage (and if we fuck up it
-                    # doesn't matter, it can never be worse than reporting 17
-                    # exabytes for a single file)
-                    size = struct.unpack("Q", '\xff' * struct.calcsize("Q"))[0] - size
+        pos, directory = unpack_string(message, pos)
+        nfiles = UINT_UNPACK_FROM(message, pos)[0]
+        pos += 4
 
-                pos, ext = self.get_object(message, bytes, pos, printerror=False)
-                pos, numattr = self.get_object(message, int, pos, printerror=False)
+        start = pos
+        totalsize = 0
 
-                attrs = []
+        for j in range(nfiles):
+            # Code and file name
+            pos += 5 + unpack_length(message, pos + 1)
 
-                for k in range(numattr):
-                    pos, attrnum = self.get_object(message, int, pos, printerror=False)
-                    pos, attr = self.get_object(message, int, pos, printerror=False)
-                    attrs.append(attr)
+            try:
+                size = ULONGLONG_UNPACK_FROM(message, pos)[0]
+                pos += 8
+            except struct.error:
+                size = UINT_UNPACK_FROM(message, pos)[0]
+                pos += 4
 
-                files.append((code, name, size, ext, attrs))
+            if size < maxsize:
+                totalsize += size
 
-            shares.append((directory, files))
+            # Extension and attributes
+            pos += 4 + unpack_length(message, pos)
+            pos += 4 + 8 * UINT_UNPACK_FROM(message, pos)[0]
 
-        self.list = shares
+        return pos, (directory, PackedFolderFiles(message, start, nfiles, totalsize))
+
+    def init_stream(self, size):
+        """ Prepares to parse a compressed message of the given size while its
+        chunks arrive, instead of waiting for the whole message """
+
+        self.list = []
+        self.stream_size = size
+        self.stream_received = 0
+        self._decompressor = zlib.decompressobj()
+        self._stream_buffer = bytearray()
+        self._stream_ndir = None
+
+    def parse_stream(self, chunk):
+        """ Decompresses the next chunk of the message, and returns the directories
+        that could be parsed from it. Decompressed data is discarded once parsed,
+        and only the packed files of each directory are kept. """
+
+        self.stream_received += len(chunk)
+
+        if self._decompressor is None:
+            # Parsing failed earlier, skip the rest of the message
+            return []
+
+        complete = (self.stream_received >= self.stream_size)
+        directories = []
+
+        try:
+            data = self._stream_buffer
+            data.extend(self._decompressor.decompress(chunk))
+            pos = 0
+
+            if complete:
+                data.extend(self._decompressor.flush())
+
+            if self._stream_ndir is None:
+                if len(data) < 4 and not complete:
+                    return directories
+
+                pos, self._stream_ndir = self.get_uint32(data)
+
+            while len(self.list) + len(directories) < self._stream_ndir:
+                if complete:
+                    next_pos, directory = self._parse_directory(data, pos)
+
+                else:
+                    try:
+                        next_pos, directory = self._parse_directory(data, pos)
+                    except (IndexError, struct.error):
+                        # Directory hasn't been received in full yet
+                        break
+
+                    if next_pos > len(data):
+                        break
+
+                # Keep the files of the directory, the rest of the buffer is discarded
+                directory, files = directory
+                files.message = bytes(data[files.start:next_pos])
+                files.start = 0
+
+                pos = next_pos
+                directories.append((directory, files))
+
+            del data[:pos]
+
+        except Exception as error:
+            log.add_warning(_("Exception during parsing %(area)s: %(exception)s"), {'area': 'SharedFileList', 'exception': error})
+            self._decompressor = self._stream_buffer = None
+            self.list = {}
+            return []
+
+        if complete:
+            self._decompressor = self._stream_buffer = None
+
+        self.list.extend(directories)
+        return directories
 
     def make_network_message(self, nozlib=0, rebuild=False):
         # Elaborate hack, to save CPU
@@ -1892,6 +2034,7 @@ class SharedFileList(PeerMessage):
         return self.built
 
 
+@message_fields(make="uint32 requestid, string text", parse="uint32 searchid, string searchterm")
 class FileSearchRequest(PeerMessage):
     """ Peer code: 8 """
     """ We send this to the peer when we search for a file.
@@ -1903,16 +2046,50 @@ class FileSearchRequest(PeerMessage):
         self.requestid = requestid
         self.text = text
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.requestid, unsignedint=True))
-        msg.extend(self.pack_object(self.text))
 
-        return msg
+class SearchResultFiles:
+    """ Files of a search result, decoded into columns. Searches can return tens of
+    thousands of files, and only the few that are displayed need strings for their
+    size, bitrate and length, so these are kept as numbers. Iterating yields the same
+    (code, name, size, ext, attrs) tuples as other file lists. """
 
-    def parse_network_message(self, message):
-        pos, self.searchid = self.get_object(message, int)
-        pos, self.searchterm = self.get_object(message, bytes, pos)
+    __slots__ = "codes", "paths", "name_offsets", "sizes", "exts", "attrs", "attr_offsets", \
+                "bitrates", "lengths", "vbr"
+
+    def __init__(self):
+        self.codes = bytearray()
+        self.paths = []
+        self.name_offsets = array("I")  # Start of the file name in the path
+        self.sizes = array("Q")
+        self.exts = []
+        self.attrs = array("I")
+        self.attr_offsets = array("I", [0])
+        self.bitrates = []  # Bitrate and length are None if unknown
+        self.lengths = []
+        self.vbr = bytearray()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        for i in range(len(self.paths)):
+            yield (self.codes[i], self.paths[i], self.sizes[i], self.exts[i],
+                   self.attrs[self.attr_offsets[i]:self.attr_offsets[i + 1]].tolist())
+
+    def append(self, code, path, size, ext, attrs):
+
+        bitrate, length, vbr = get_bitrate_length(size, attrs)
+
+        self.codes.append(code)
+        self.paths.append(path)
+        self.name_offsets.append(path.rfind("\\") + 1)
+        self.sizes.append(size)
+        self.exts.append(ext)
+        self.attrs.extend(attrs)
+        self.attr_offsets.append(len(self.attrs))
+        self.bitrates.append(bitrate)
+        self.lengths.append(length)
+        self.vbr.append(vbr)
 
 
 class FileSearchResult(PeerMessage):
@@ -1946,28 +2123,37 @@ class FileSearchResult(PeerMessage):
             self.list = {}
 
     def _parse_network_message(self, message):
-        self.pos, self.user = self.get_object(message, bytes)
-        self.pos, self.token = self.get_object(message, int, self.pos)
-        self.pos, nfiles = self.get_object(message, int, self.pos)
-        shares = []
+        pos, self.user = self.get_string(message)
+        pos, self.token = self.get_uint32(message, pos)
+        pos, nfiles = self.get_uint32(message, pos)
+        shares = SearchResultFiles()
+
         for i in range(nfiles):
-            self.pos, code = self.pos + 1, message[self.pos]
-            self.pos, name = self.get_object(message, bytes, self.pos)
-            # suppressing errors with unpacking, can be caused by incorrect sizetype
-            self.pos, size = self.get_object(message, int, self.pos, getunsignedlonglong=True, printerror=False)
-            self.pos, ext = self.get_object(message, bytes, self.pos, printerror=False)
-            self.pos, numattr = self.get_object(message, int, self.pos, printerror=False)
+            code = message[pos]
+            pos, name = unpack_string(message, pos + 1)
+
+            try:
+                size = ULONGLONG_UNPACK_FROM(message, pos)[0]
+                pos += 8
+            except struct.error:
+                # suppressing errors with unpacking, can be caused by incorrect sizetype
+                pos, size = self.get_uint64(message, pos, printerror=False)
+
+            pos, ext = unpack_string(message, pos)
+            pos, numattr = self.get_uint32(message, pos, printerror=False)
             attrs = []
-            if numattr:
-                for j in range(numattr):
-                    self.pos, attrnum = self.get_object(message, int, self.pos, printerror=False)
-                    self.pos, attr = self.get_object(message, int, self.pos, printerror=False)
-                    attrs.append(attr)
-            shares.append((code, name, size, ext, attrs))
+
+            for j in range(numattr):
+                pos, attrnum = self.get_uint32(message, pos, printerror=False)
+                pos, attr = self.get_uint32(message, pos, printerror=False)
+                attrs.append(attr)
+
+            shares.append(code, name, size, ext, attrs)
+
         self.list = shares
-        self.pos, self.freeulslots = self.pos + 1, message[self.pos]
-        self.pos, self.ulspeed = self.get_object(message, int, self.pos, getsignedint=True)
-        self.pos, self.inqueue = self.get_object(message, int, self.pos, getunsignedlonglong=True)
+        self.pos, self.freeulslots = pos + 1, message[pos]
+        self.pos, self.ulspeed = self.get_int32(message, self.pos)
+        self.pos, self.inqueue = self.get_uint64(message, self.pos)
 
     def make_network_message(self):
         queuesize = self.inqueue[0]
@@ -2040,16 +2226,16 @@ class UserInfoReply(PeerMessage):
         self.uploadallowed = uploadallowed
 
     def parse_network_message(self, message):
-        pos, self.descr = self.get_object(message, bytes)
+        pos, self.descr = self.get_string(message)
         pos, self.has_pic = pos + 1, message[pos]
         if self.has_pic:
-            pos, self.pic = self.get_object(message, bytes, pos, rawbytes=True)
-        pos, self.totalupl = self.get_object(message, int, pos)
-        pos, self.queuesize = self.get_object(message, int, pos)
+            pos, self.pic = self.get_bytes(message, pos)
+        pos, self.totalupl = self.get_uint32(message, pos)
+        pos, self.queuesize = self.get_uint32(message, pos)
         pos, self.slotsavail = pos + 1, message[pos]
 
         if len(message[pos:]) >= 4:
-            pos, self.uploadallowed = self.get_object(message, int, pos)
+            pos, self.uploadallowed = self.get_uint32(message, pos)
 
     def make_network_message(self):
         msg = bytearray()
@@ -2069,6 +2255,7 @@ class UserInfoReply(PeerMessage):
         return msg
 
 
+@message_fields(parse="uint32 msgid, uint32 timestamp, string user, string msg")
 class PMessageUser(PeerMessage):
     """ Peer code: 22 """
     """ Chat phrase sent to someone or received by us in private.
@@ -2085,13 +2272,8 @@ class PMessageUser(PeerMessage):
                 self.pack_object(self.user) +
                 self.pack_object(self.msg))
 
-    def parse_network_message(self, message):
-        pos, self.msgid = self.get_object(message, int)
-        pos, self.timestamp = self.get_object(message, int, pos)
-        pos, self.user = self.get_object(message, bytes, pos)
-        pos, self.msg = self.get_object(message, bytes, pos)
-
 
+@message_fields(parse="uint32 something, string dir")
 class FolderContentsRequest(PeerMessage):
     """ Peer code: 36 """
     """ We ask the peer to send us the contents of a single folder. """
@@ -2107,10 +2289,6 @@ class FolderContentsRequest(PeerMessage):
 
         return msg
 
-    def parse_network_message(self, message):
-        pos, self.something = self.get_object(message, int)
-        pos, self.dir = self.get_object(message, bytes, pos)
-
 
 class FolderContentsResponse(PeerMessage):
     """ Peer code: 37 """
@@ -2132,33 +2310,33 @@ class FolderContentsResponse(PeerMessage):
 
     def _parse_network_message(self, message):
         shares = {}
-        pos, nfolders = self.get_object(message, int)
+        pos, nfolders = self.get_uint32(message)
 
         for h in range(nfolders):
-            pos, folder = self.get_object(message, bytes, pos)
+            pos, folder = self.get_string(message, pos)
 
             shares[folder] = {}
 
-            pos, ndir = self.get_object(message, int, pos)
+            pos, ndir = self.get_uint32(message, pos)
 
             for i in range(ndir):
-                pos, directory = self.get_object(message, bytes, pos)
-                pos, nfiles = self.get_object(message, int, pos)
+                pos, directory = self.get_string(message, pos)
+                pos, nfiles = self.get_uint32(message, pos)
 
                 shares[folder][directory] = []
 
                 for j in range(nfiles):
                     pos, code = pos + 1, message[pos]
-                    pos, name = self.get_object(message, bytes, pos, printerror=False)
-                    pos, size = self.get_object(message, int, pos, getunsignedlonglong=True, printerror=False)
-                    pos, ext = self.get_object(message, bytes, pos, printerror=False)
-                    pos, numattr = self.get_object(message, int, pos, printerror=False)
+                    pos, name = self.get_string(message, pos, printerror=False)
+                    pos, size = self.get_uint64(message, pos, printerror=False)
+                    pos, ext = self.get_string(message, pos, printerror=False)
+                    pos, numattr = self.get_uint32(message, pos, printerror=False)
 
                     attrs = []
 
                     for k in range(numattr):
-                        pos, attrnum = self.get_object(message, int, pos, printerror=False)
-                        pos, attr = self.get_object(message, int, pos, printerror=False)
+                        pos, attrnum = self.get_uint32(message, pos, printerror=False)
+                        pos, attr = self.get_uint32(message, pos, printerror=False)
                         attrs.append(attr)
 
                     shares[folder][directory].append((code, name, size, ext, attrs))
@@ -2202,11 +2380,11 @@ class TransferRequest(PeerMessage):
         return msg
 
     def parse_network_message(self, message):
-        pos, self.direction = self.get_object(message, int)
-        pos, self.req = self.get_object(message, int, pos)
-        pos, self.file = self.get_object(message, bytes, pos)
+        pos, self.direction = self.get_uint32(message)
+        pos, self.req = self.get_uint32(message, pos)
+        pos, self.file = self.get_string(message, pos)
         if self.direction == 1:
-            pos, self.filesize = self.get_object(message, int, pos, getunsignedlonglong=True)
+            pos, self.filesize = self.get_uint64(message, pos)
 
 
 class TransferResponse(PeerMessage):
@@ -2235,15 +2413,16 @@ class TransferResponse(PeerMessage):
         return msg
 
     def parse_network_message(self, message):
-        pos, self.req = self.get_object(message, int)
+        pos, self.req = self.get_uint32(message)
         pos, self.allowed = pos + 1, message[pos]
         if message[pos:]:
             if self.allowed:
-                pos, self.filesize = self.get_object(message, int, pos, getunsignedlonglong=True)
+                pos, self.filesize = self.get_uint64(message, pos)
             else:
-                pos, self.reason = self.get_object(message, bytes, pos)
+                pos, self.reason = self.get_string(message, pos)
 
 
+@message_fields(make="string file", parse="string file")
 class PlaceholdUpload(PeerMessage):
     """ Peer code: 42 """
     """ DEPRECATED """
@@ -2252,18 +2431,13 @@ class PlaceholdUpload(PeerMessage):
         self.conn = conn
         self.file = file
 
-    def make_network_message(self):
-        return self.pack_object(self.file)
-
-    def parse_network_message(self, message):
-        pos, self.file = self.get_object(message, bytes)
-
 
 class QueueUpload(PlaceholdUpload):
     """ Peer code: 43 """
     pass
 
 
+@message_fields(make="string filename, uint32 place", parse="string filename, uint32 place")
 class PlaceInQueue(PeerMessage):
     """ Peer code: 44 """
 
@@ -2272,23 +2446,13 @@ class PlaceInQueue(PeerMessage):
         self.filename = filename
         self.place = place
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.filename))
-        msg.extend(self.pack_object(self.place, unsignedint=True))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.filename = self.get_object(message, bytes)
-        pos, self.place = self.get_object(message, int, pos)
-
 
 class UploadFailed(PlaceholdUpload):
     """ Peer code: 46 """
     pass
 
 
+@message_fields(make="string file, string reason", parse="string file, string reason")
 class QueueFailed(PeerMessage):
     """ Peer code: 50 """
 
@@ -2297,17 +2461,6 @@ class QueueFailed(PeerMessage):
         self.file = file
         self.reason = reason
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.file))
-        msg.extend(self.pack_object(self.reason))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.file = self.get_object(message, bytes)
-        pos, self.reason = self.get_object(message, bytes, pos)
-
 
 class PlaceInQueueRequest(PlaceholdUpload):
     """ Peer code: 51 """
@@ -2339,6 +2492,7 @@ class UnknownPeerMessage(PeerMessage):
         pass
 
 
+@message_fields(make="int32 req")
 class FileRequest(PeerMessage):
     """ Request a file from peer, or tell a peer that we want to send a file to
     them. """
@@ -2347,10 +2501,6 @@ class FileRequest(PeerMessage):
         self.conn = conn
         self.req = req
 
-    def make_network_message(self):
-        msg = self.pack_object(self.req)
-        return msg
-
 
 """
 Distributed Messages
@@ -2358,7 +2508,7 @@ Distributed Messages
 
 
 class DistribMessage(SlskMessage):
-    pass
+    __slots__ = ()
 
 
 class DistribAlive(DistribMessage):
@@ -2383,7 +2533,7 @@ class DistribSearch(DistribMessage):
     (TODO: check that this works / is implemented)
     """
 
-    __slots__ = "conn", "user", "searchid", "searchterm"
+    __slots__ = "conn", "unknown", "user", "searchid", "searchterm"
 
     def __init__(self, conn):
         self.conn = conn
@@ -2396,12 +2546,13 @@ class DistribSearch(DistribMessage):
             return False
 
     def _parse_network_message(self, message):
-        pos, self.unknown = self.get_object(message, int, printerror=False)
-        pos, self.user = self.get_object(message, bytes, pos, printerror=False)
-        pos, self.searchid = self.get_object(message, int, pos, printerror=False)
-        pos, self.searchterm = self.get_object(message, bytes, pos, printerror=False)
+        pos, self.unknown = self.get_uint32(message, printerror=False)
+        pos, self.user = self.get_string(message, pos, printerror=False)
+        pos, self.searchid = self.get_uint32(message, pos, printerror=False)
+        pos, self.searchterm = self.get_string(message, pos, printerror=False)
 
 
+@message_fields(parse="uint32 value")
 class DistribBranchLevel(DistribMessage):
     """ Distrib code: 4 """
     """ TODO: implement fully """
@@ -2409,10 +2560,8 @@ class DistribBranchLevel(DistribMessage):
     def __init__(self, conn):
         self.conn = conn
 
-    def parse_network_message(self, message):
-        pos, self.value = self.get_object(message, int)
-
 
+@message_fields(parse="string user")
 class DistribBranchRoot(DistribMessage):
     """ Distrib code: 5 """
     """ TODO: implement fully """
@@ -2420,10 +2569,8 @@ class DistribBranchRoot(DistribMessage):
     def __init__(self, conn):
         self.conn = conn
 
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-
 
+@message_fields(parse="uint32 value")
 class DistribChildDepth(DistribMessage):
     """ Distrib code: 7 """
     """ TODO: implement fully """
@@ -2431,9 +2578,6 @@ class DistribChildDepth(DistribMessage):
     def __init__(self, conn):
         self.conn = conn
 
-    def parse_network_message(self, message):
-        pos, self.value = self.get_object(message, int)
-
 
 class DistribServerSearch(DistribMessage):
     """ Distrib code: 93 """
@@ -2446,7 +2590,7 @@ class DistribServerSearch(DistribMessage):
     (TODO: check that this works / is implemented)
     """
 
-    __slots__ = "conn", "user", "searchid", "searchterm"
+    __slots__ = "conn", "unknown", "user", "searchid", "searchterm"
 
     def __init__(self, conn):
         self.conn = conn
@@ -2459,7 +2603,7 @@ class DistribServerSearch(DistribMessage):
             return False
 
     def _parse_network_message(self, message):
-        pos, self.unknown = self.get_object(message, int, getunsignedlonglong=True, printerror=False)
-        pos, self.user = self.get_object(message, bytes, pos, printerror=False)
-        pos, self.searchid = self.get_object(message, int, pos, printerror=False)
-        pos, self.searchterm = self.get_object(message, bytes, pos, printerror=False)
+        pos, self.unknown = self.get_uint64(message, printerror=False)
+        pos, self.user = self.get_string(message, pos, printerror=False)
+        pos, self.searchid = self.get_uint32(message, pos, printerror=False)
+        pos, self.searchterm = self.get_string(message, pos, printerror=False)
@@ -22,6 +22,7 @@
 This module implements Soulseek networking protocol.
 """
 
+import os
 import selectors
 import socket
 import struct
@@ -29,11 +30,21 @@ import sys
 import threading
 import time
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from errno import EINTR
+from errno import EINVAL
+from errno import ENOSYS
+from errno import ENOTSUP
+from errno import EOPNOTSUPP
+from errno import ESPIPE
+from functools import partial
 from gettext import gettext as _
 from itertools import islice
+from queue import Queue
 from random import uniform
 
+from pynicotine.iplist import IPList
 from pynicotine.logfacility import log
 from pynicotine.slskmessages import AcceptChildren
 from pynicotine.slskmessages import AckNotifyPrivileges
@@ -152,6 +163,7 @@ from pynicotine.slskmessages import SetStatus
 from pynicotine.slskmessages import SetUploadLimit
 from pynicotine.slskmessages import SetWaitPort
 from pynicotine.slskmessages import SharedFileList
+from pynicotine.slskmessages import SharedFileListProgress
 from pynicotine.slskmessages import SharedFoldersFiles
 from pynicotine.slskmessages import SimilarUsers
 from pynicotine.slskmessages import TransferRequest
@@ -170,8 +182,38 @@ from pynicotine.slskmessages import UserPrivileged
 from pynicotine.slskmessages import UserSearch
 from pynicotine.slskmessages import WishlistInterval
 from pynicotine.slskmessages import WishlistSearch
+from pynicotine.slskmessages import msg_contents
 
 
+""" Message headers are read in place from the input buffers """
+
+INT_UNPACK_FROM = struct.Struct("<i").unpack_from
+INT_PAIR_UNPACK_FROM = struct.Struct("<ii").unpack_from
+
+""" sendfile fails with these errors if a file or socket doesn't support it """
+
+SENDFILE_UNSUPPORTED_ERRORS = (EINVAL, ENOSYS, ENOTSUP, EOPNOTSUPP, ESPIPE)
+
+""" Disk space of downloads is reserved with fallocate on Linux. posix_fallocate
+would grow the incomplete file to its final size, but downloads are resumed from
+the size of the incomplete file, so the file size is kept. """
+
+FALLOC_FL_KEEP_SIZE = 1
+
+if sys.platform.startswith("linux"):
+    try:
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        fallocate = getattr(libc, "fallocate64", None) or libc.fallocate
+        fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+        fallocate.restype = ctypes.c_int
+
+    except (ImportError, OSError, AttributeError):
+        fallocate = None
+else:
+    fallocate = None
+
 """ Set the maximum number of open files to the hard limit reported by the OS.
 Our MAXSOCKETS value needs to be lower than the file limit, otherwise our open
 sockets in combination with other file activity can exceed the file limit,
@@ -211,41 +253,182 @@ class Connection:
     """
     Holds data about a connection. conn is a socket object,
     addr is (ip, port) pair, ibuf and obuf are input and output msgBuffer,
+    oframes holds the buffers of outgoing messages, which are sent before obuf,
     init is a PeerInit object (see slskmessages docstrings).
     """
 
-    __slots__ = "conn", "addr", "ibuf", "obuf", "init", "lastactive", "lastreadlength"
+    __slots__ = "conn", "addr", "ibuf", "obuf", "oframes", "init", "lastactive", "lastreadlength", "allowedrevision"
 
     def __init__(self, conn=None, addr=None):
         self.conn = conn
         self.addr = addr
         self.ibuf = bytearray()
         self.obuf = bytearray()
+        self.oframes = deque()
         self.init = None
         self.lastactive = time.time()
         self.lastreadlength = 100 * 1024
+        self.allowedrevision = None  # Revision of the IP block list that allowed the address
 
 
 class PeerConnection(Connection):
 
-    __slots__ = "filereq", "filedown", "fileupl", "filereadbytes", "bytestoread", "piercefw", \
-                "lastcallback", "starttime", "sentbytes2", "readbytes2"
+    __slots__ = "filereq", "filedown", "fileupl", "filewriter", "filereadbytes", "bytestoread", "piercefw", \
+                "lastcallback", "limiter", "sendfile", "partialmsg"
 
     def __init__(self, conn=None, addr=None, init=None):
         Connection.__init__(self, conn, addr)
         self.filereq = None
         self.filedown = None
         self.fileupl = None
+        self.filewriter = None  # DownloadWriter of a download
         self.filereadbytes = 0
         self.bytestoread = 0
         self.init = init
         self.piercefw = None
         self.lastactive = time.time()
         self.lastcallback = time.time()
+        self.limiter = None  # TokenBucket of a transfer with a speed limit
+        self.sendfile = hasattr(os, "sendfile")  # Uploads are sent by the kernel, not available on Windows
+        self.partialmsg = None  # Large message that is parsed while it arrives
+
+
+class TokenBucket:
+    """ Speed limit of a transfer. The bucket holds tokens, one per byte, that are
+    refilled at rate bytes per second, up to burst seconds of data. Data is only sent
+    or received while tokens are available, and a bucket can be limited by the parent
+    bucket of a total speed limit. """
+
+    __slots__ = "rate", "capacity", "quantum", "tokens", "timestamp", "parent"
+
+    # Data is sent and received in pieces of at least this size, unless the rate is lower
+    MIN_QUANTUM = 4096
+
+    def __init__(self, rate, burst, parent=None):
+        self.rate = self.capacity = self.tokens = 0
+        self.timestamp = time.monotonic()
+        self.parent = parent
+        self.set_rate(rate, burst)
+        self.tokens = self.capacity
+
+    def set_rate(self, rate, burst):
+        self.refill()
+        self.rate = max(rate, 1)
+        self.capacity = max(int(self.rate * burst), 1)
+        self.quantum = min(self.capacity, self.MIN_QUANTUM)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def refill(self):
+        timestamp = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (timestamp - self.timestamp) * self.rate)
+        self.timestamp = timestamp
+
+    def available(self):
+        """ Returns the number of bytes that can be transferred now, or 0 if the
+        transfer has to wait """
+
+        self.refill()
+
+        if self.tokens < self.quantum:
+            return 0
+
+        if self.parent is None:
+            return int(self.tokens)
+
+        return min(int(self.tokens), self.parent.available())
+
+    def consume(self, num_bytes):
+        """ Removes the tokens of transferred data. Data received beyond the available
+        tokens is paid for by waiting longer afterwards. """
+
+        self.tokens -= num_bytes
+
+        if self.parent is not None:
+            self.parent.consume(num_bytes)
+
+    def wait_time(self):
+        """ Returns the number of seconds until data can be transferred """
+
+        self.refill()
+        wait_time = max((self.quantum - self.tokens) / self.rate, 0)
+
+        if self.parent is None:
+            return wait_time
+
+        return max(wait_time, self.parent.wait_time())
+
 
-        self.starttime = None  # Used for upload bandwidth management
-        self.sentbytes2 = 0
-        self.readbytes2 = 0
+class DownloadWriter:
+    """ Writes the data of a download to its file. Received data is collected until
+    write_size bytes are buffered, and written in one go. The UI reads the progress of
+    downloads from the file position, so the buffer is also written before progress
+    is passed to the UI. With a pool, data is written by a background thread. """
+
+    __slots__ = "conn", "file", "buffer", "write_size", "fsync", "pool", "ui_callback"
+
+    def __init__(self, conn, file, ui_callback, write_size=1048576, fsync=False, pool=None):
+        self.conn = conn
+        self.file = file
+        self.buffer = bytearray()
+        self.write_size = write_size
+        self.fsync = fsync  # Sync the file to disk once the download is complete
+        self.pool = pool
+        self.ui_callback = ui_callback
+
+    def preallocate(self, offset, length):
+        """ Reserves disk space for the rest of the download, to avoid fragmenting the
+        file. Returns False if the platform or file system doesn't support it. """
+
+        if fallocate is None or length <= 0:
+            return False
+
+        try:
+            return fallocate(self.file.fileno(), FALLOC_FL_KEEP_SIZE, offset, length) == 0
+        except (AttributeError, OSError, ValueError):
+            return False
+
+    def write(self, data):
+
+        self.buffer.extend(data)
+
+        if len(self.buffer) >= self.write_size:
+            self.flush()
+
+    def flush(self, msgs=None, complete=False, wait=False):
+        """ Writes the buffered data, and passes msgs to the UI once written. If wait is
+        True, returns once the data is written, e.g. before the UI closes the file. """
+
+        data = self.buffer
+        self.buffer = bytearray()
+
+        if self.pool is None:
+            self.write_file(data, msgs, complete)
+            return
+
+        future = self.pool.submit(self.write_file, data, msgs, complete)
+
+        if wait:
+            future.result()
+
+    def write_file(self, data, msgs, complete):
+
+        try:
+            if data:
+                self.file.write(data)
+
+            if complete and self.fsync:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+
+        except IOError as strerror:
+            self.ui_callback([FileError(self.conn, self.file, strerror)])
+
+        except ValueError:
+            # File closed by the UI
+            pass
+
+        if msgs:
+            self.ui_callback(msgs)
 
 
 class PeerConnectionInProgress:
@@ -261,6 +444,21 @@ class PeerConnectionInProgress:
         self.lastactive = time.time()
 
 
+class MessageQueue(Queue):
+    """ Queue of messages sent to the networking thread. Putting a message in
+    the queue wakes the thread up, instead of having it poll the queue. """
+
+    def __init__(self):
+        Queue.__init__(self, 0)
+        self.wakeup = None
+
+    def put(self, item, block=True, timeout=None):
+        Queue.put(self, item, block, timeout)
+
+        if self.wakeup is not None:
+            self.wakeup()
+
+
 class SlskProtoThread(threading.Thread):
     """ This is a networking thread that actually does all the communication.
     It sends data to the UI thread via a callback function and receives data
@@ -397,6 +595,24 @@ class SlskProtoThread(threading.Thread):
     IN_PROGRESS_STALE_AFTER = 5
     CONNECTION_MAX_IDLE = 60
     CONNCOUNT_UI_INTERVAL = 0.5
+    # Without a MessageQueue, the queue is polled once per interval
+    QUEUE_POLL_INTERVAL = 0.2
+    # Transfers with a speed limit can send or receive this many seconds of data at once
+    TRANSFER_LIMIT_BURST = 0.2
+    # The share of a total speed limit each transfer gets is updated once per interval
+    TRANSFER_LIMIT_UPDATE_INTERVAL = 1
+    # Minimum speed of a transfer sharing a total speed limit, in bytes per second
+    MIN_TRANSFER_SPEED = 1024
+
+    # Compressed messages larger than this are handled by the compression workers
+    COMPRESSED_INLINE_MAX = 65536
+    # Shares with more folders than this are compressed by the compression workers
+    COMPRESSED_INLINE_MAX_FOLDERS = 256
+    COMPRESSION_WORKERS = 2
+    # Maximum number of message buffers sent in one system call
+    MAX_SEND_BUFFERS = 64
+    # The read size of a connection grows while the socket has more data, up to this size
+    MAX_READ_LENGTH = 1048576
 
     def __init__(self, ui_callback, queue, bindip, port, config, eventprocessor):
         """ ui_callback is a UI callback function to be called with messages
@@ -420,19 +636,70 @@ class SlskProtoThread(threading.Thread):
         for i in self.peercodes:
             self.peerclasses[self.peercodes[i]] = i
 
+        self.compressedcodes = set(self.peercodes[i] for i in (SharedFileList, FileSearchResult, FolderContentsResponse))
+
+        # zlib releases the GIL, so large messages are (de)compressed in parallel to the networking loop
+        self._compression_pool = ThreadPoolExecutor(max_workers=self.COMPRESSION_WORKERS)
+
+        # Data is received into one buffer, and copied to the input buffer of the connection
+        self._recv_view = memoryview(bytearray(self.MAX_READ_LENGTH))
+
+        # Downloads are written in order by a single thread, if enabled
+        self._download_write_pool = ThreadPoolExecutor(max_workers=1)
+
         self._p = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._p.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
         self._conns = {}
         self._connsinprogress = {}
-        self._uploadlimit = (self._calc_upload_limit_none, 0)
-        self._downloadlimit = (self._calc_download_limit_by_total, self._config.sections["transfers"]["downloadlimit"])
+        self._selector = selectors.DefaultSelector()
+        self._pending_server_msgs = []
+
+        # Writing to the wakeup pipe interrupts the selector, e.g. when a message is queued
+        if sys.platform == "win32":
+            # Only sockets can be selected on Windows
+            self._wakeup_fds = socket.socketpair()
+
+            for sock in self._wakeup_fds:
+                sock.setblocking(0)
+
+            self._wakeup_recv = partial(self._wakeup_fds[0].recv, 4096)
+            self._wakeup_send = partial(self._wakeup_fds[1].send, b"\0")
+
+        else:
+            read_fd, write_fd = os.pipe()
+
+            for fd in (read_fd, write_fd):
+                os.set_blocking(fd, False)
+
+            # File objects can't write to a reused file descriptor once closed
+            self._wakeup_fds = (open(read_fd, "rb", buffering=0), open(write_fd, "wb", buffering=0))
+            self._wakeup_recv = partial(self._wakeup_fds[0].read, 4096)
+            self._wakeup_send = partial(self._wakeup_fds[1].write, b"\0")
+
+        # Without a message queue that wakes us up, the queue is polled
+        self._poll_queue = not isinstance(queue, MessageQueue)
+
+        if not self._poll_queue:
+            queue.wakeup = self.wakeup
+
+        # Speed limits in bytes per second, None if disabled. Total limits have a bucket.
+        self._upload_limit = None
+        self._upload_bucket = None
+        self._download_limit = None
+        self._download_bucket = None
+        self.set_download_limit(self._config.sections["transfers"]["downloadlimit"])
+
+        self._ip_block_list = IPList()
+
         self._ulimits = {}
         self._dlimits = {}
+        self._next_limit_update = time.time()
         self.total_uploads = 0
         self.total_downloads = 0
 
         self.last_conncount_ui_update = time.time()
+        self.last_conncount = None
 
         # GeoIP Config
         self._geoip = None
@@ -475,69 +742,87 @@ class SlskProtoThread(threading.Thread):
     def _is_download(self, conn):
         return conn.__class__ is PeerConnection and conn.filedown is not None
 
-    def _calc_transfer_speed(self, i):
-        curtime = time.time()
+    def _is_upload_pending(self, conn):
+        """ Returns True if part of a file upload still has to be read and sent """
+
+        upload = conn.fileupl
 
-        if i.starttime is None:
-            i.starttime = curtime
+        if upload is None or upload.offset is None:
+            return False
 
-        elapsed = curtime - i.starttime
+        return upload.offset + upload.sentbytes < upload.size
 
-        if elapsed == 0:
-            return 0
-        elif self._is_upload(i):
-            return i.sentbytes2 / elapsed
+    def set_upload_limit(self, uselimit, limit, limitby):
+        """ limit is in KB/s. If limitby is True, the limit is the total speed of all
+        uploads, otherwise the speed of each upload. """
+
+        if not uselimit:
+            self._upload_limit = None
+            self._upload_bucket = None
+
+        elif limitby:
+            self._upload_limit = limit * 1024
+            self._upload_bucket = TokenBucket(self._upload_limit, self.TRANSFER_LIMIT_BURST)
+
+        else:
+            self._upload_limit = limit * 1024
+            self._upload_bucket = None
+
+    def set_download_limit(self, limit):
+        """ limit is the total speed of all downloads in KB/s, 0 if disabled """
+
+        if limit:
+            self._download_limit = limit * 1024
+            self._download_bucket = TokenBucket(self._download_limit, self.TRANSFER_LIMIT_BURST)
         else:
-            return i.readbytes2 / elapsed
+            self._download_limit = None
+            self._download_bucket = None
 
-    def _calc_upload_limit_by_transfer(self, conns, i):
-        self.total_uploads = sum(1 for j in conns.values() if self._is_upload(j))
+    def set_transfer_limiters(self, transfers, limit, parent):
+        """ Gives each transfer a token bucket for its speed limit. A total limit
+        is shared equally by the transfers, and also held by the parent bucket. """
 
-        return int(self._uploadlimit[1] * 1024.0)
+        if limit is None:
+            for conn in transfers:
+                conn.limiter = None
 
-    def _calc_upload_limit_by_total(self, conns, i):
-        max_limit = self._uploadlimit[1] * 1024.0
-        bw = 0.0
-        self.total_uploads = 1
+            return
 
-        """ Skip first upload
-        If we have 2 or more uploads, we start reducing their individual speeds to
-        stay below the total limit """
+        if parent is not None:
+            limit = max(limit / max(len(transfers), 1), self.MIN_TRANSFER_SPEED)
 
-        uploads = islice((j for j in conns.values() if self._is_upload(j)), 1, None)
-        for j in uploads:
-            bw += self._calc_transfer_speed(j)
-            self.total_uploads += 1
+        for conn in transfers:
+            if conn.limiter is None or conn.limiter.parent is not parent:
+                conn.limiter = TokenBucket(limit, self.TRANSFER_LIMIT_BURST, parent)
+            else:
+                conn.limiter.set_rate(limit, self.TRANSFER_LIMIT_BURST)
 
-        limit = int(max(1024, max_limit - bw))  # 1 KB/s is the minimum upload speed per transfer
-        return limit
+    def update_transfer_limits(self):
+        """ Updates the speed limits of all transfers. Called when transfers start,
+        when the limits change, and once per TRANSFER_LIMIT_UPDATE_INTERVAL. Limiting
+        a single send or receive only costs a bucket refill. """
 
-    def _calc_upload_limit_none(self, conns, i):
-        self.total_uploads = sum(1 for j in conns.values() if self._is_upload(j))
+        uploads = []
+        downloads = []
 
-        return None
+        for conn in self._conns.values():
+            if self._is_upload(conn):
+                uploads.append(conn)
 
-    def _calc_download_limit_by_total(self, conns, i):
-        max_limit = self._downloadlimit[1] * 1024.0
-        bw = 0.0
-        self.total_downloads = 1
+            elif self._is_download(conn):
+                downloads.append(conn)
 
-        """ Skip first download
-        If we have 2 or more downloads, we start reducing their individual speeds to
-        stay below the total limit """
+        self.total_uploads = len(uploads)
+        self.total_downloads = len(downloads)
 
-        downloads = islice((j for j in conns.values() if self._is_download(j)), 1, None)
-        for j in downloads:
-            bw += self._calc_transfer_speed(j)
-            self.total_downloads += 1
+        self.set_transfer_limiters(uploads, self._upload_limit, self._upload_bucket)
+        self.set_transfer_limiters(downloads, self._download_limit, self._download_bucket)
 
-        if max_limit == 0:
-            # Download limit disabled
-            limit = 0
-        else:
-            limit = int(max(1024, max_limit - bw))  # 1 KB/s is the minimum download speed per transfer
+        self._next_limit_update = time.time() + self.TRANSFER_LIMIT_UPDATE_INTERVAL
 
-        return limit
+    def has_transfer_limits(self):
+        return (self._upload_limit is not None and self.total_uploads > 0) or \
+            (self._download_limit is not None and self.total_downloads > 0)
 
     def socket_still_active(self, conn):
         try:
@@ -545,39 +830,31 @@ class SlskProtoThread(threading.Thread):
         except KeyError:
             return False
 
-        return len(connection.obuf) > 0 or len(connection.ibuf) > 0
+        return len(connection.obuf) > 0 or len(connection.oframes) > 0 or len(connection.ibuf) > 0
 
     def ip_blocked(self, address):
         if address is None:
             return True
 
-        ips = self._config.sections["server"]["ipblocklist"]
-        s_address = address.split(".")
+        ip_block_list = self._ip_block_list
+        ip_block_list.update(self._config.sections["server"]["ipblocklist"], self._config.revision)
 
-        for ip in ips:
-            # No Wildcard in IP
-            if "*" not in ip:
-                if address == ip:
-                    return True
-                continue
+        return address in ip_block_list
 
-            # Wildcard in IP
-            parts = ip.split(".")
-            seg = 0
+    def conn_blocked(self, conn_obj):
+        """ Checks if the IP address of an established connection is blocked. The
+        address is only checked again once the block list has changed. """
 
-            for part in parts:
-                # Stop if there's no wildcard or matching string number
-                if part != s_address[seg] and part != "*":
-                    break
+        ip_block_list = self._ip_block_list
+        ip_block_list.update(self._config.sections["server"]["ipblocklist"], self._config.revision)
 
-                seg += 1
+        if conn_obj.allowedrevision == ip_block_list.revision:
+            return False
 
-                # Last time around
-                if seg == 4:
-                    # Wildcard blocked
-                    return True
+        if self.ip_blocked(conn_obj.addr[0]):
+            return True
 
-        # Not blocked
+        conn_obj.allowedrevision = ip_block_list.revision
         return False
 
     def parse_file_req(self, conn, msg_buffer):
@@ -600,31 +877,50 @@ class SlskProtoThread(threading.Thread):
 
         return offset, msg_buffer
 
+    @staticmethod
+    def consume_buffer(msg_buffer, offset):
+        """ Removes processed messages from the start of an input buffer. Messages
+        are parsed from memoryviews of the buffer, and if a message object still
+        references the buffer, it can't be resized. Copy the rest of it instead. """
+
+        if offset:
+            try:
+                del msg_buffer[:offset]
+            except BufferError:
+                return msg_buffer[offset:]
+
+        return msg_buffer
+
     def process_server_input(self, msg_buffer):
         """ Server has sent us something, this function retrieves messages
         from the msg_buffer, creates message objects and returns them and the rest
         of the msg_buffer.
         """
         msgs = []
+        offset = 0
+        buffer_len = len(msg_buffer)
+        msg_view = memoryview(msg_buffer)
 
         # Server messages are 8 bytes or greater in length
-        while len(msg_buffer) >= 8:
-            msgsize, msgtype = struct.unpack("<ii", msg_buffer[:8])
+        while buffer_len - offset >= 8:
+            msgsize, msgtype = INT_PAIR_UNPACK_FROM(msg_buffer, offset)
+            msg_end = offset + msgsize + 4
 
-            if msgsize + 4 > len(msg_buffer):
+            if msg_end > buffer_len:
                 break
 
             elif msgtype in self.serverclasses:
                 msg = self.serverclasses[msgtype]()
-                msg.parse_network_message(msg_buffer[8:msgsize + 4])
+                msg.parse_network_message(msg_view[offset + 8:msg_end])
                 msgs.append(msg)
 
             else:
-                msgs.append(_("Server message type %(type)i size %(size)i contents %(msg_buffer)s unknown") % {'type': msgtype, 'size': msgsize - 4, 'msg_buffer': msg_buffer[8:msgsize + 4].__repr__()})
+                msgs.append(_("Server message type %(type)i size %(size)i contents %(msg_buffer)s unknown") % {'type': msgtype, 'size': msgsize - 4, 'msg_buffer': msg_buffer[offset + 8:msg_end].__repr__()})
 
-            msg_buffer = msg_buffer[msgsize + 4:]
+            offset = msg_end
 
-        return msgs, msg_buffer
+        msg_view.release()
+        return msgs, self.consume_buffer(msg_buffer, offset)
 
     def process_file_input(self, conn, msg_buffer):
         """ We have a "F" connection (filetransfer), peer has sent us
@@ -646,12 +942,7 @@ class SlskProtoThread(threading.Thread):
             addedbytes = msg_buffer[:leftbytes]
 
             if leftbytes > 0:
-                try:
-                    conn.filedown.file.write(addedbytes)
-                except IOError as strerror:
-                    self._ui_callback([FileError(conn, conn.filedown.file, strerror)])
-                except ValueError:
-                    pass
+                conn.filewriter.write(addedbytes)
 
             addedbyteslen = len(addedbytes)
             curtime = time.time()
@@ -667,7 +958,8 @@ class SlskProtoThread(threading.Thread):
                 """ We save resources by not sending data back to the UI every time
                 a part of a file is downloaded """
 
-                self._ui_callback([DownloadFile(conn.conn, addedbyteslen, conn.filedown.file)])
+                conn.filewriter.flush(
+                    [DownloadFile(conn.conn, addedbyteslen, conn.filedown.file)], complete=(leftbytes - addedbyteslen) == 0)
                 conn.lastcallback = curtime
 
             conn.filereadbytes += addedbyteslen
@@ -698,35 +990,50 @@ class SlskProtoThread(threading.Thread):
         and the rest of the msg_buffer.
         """
         msgs = []
+        offset = 0
+        buffer_len = len(msg_buffer)
+        msg_view = memoryview(msg_buffer)
+        transfer = None
 
-        while (conn.init is None or conn.init.type not in ['F', 'D']) and len(msg_buffer) >= 8:
-            msgsize = struct.unpack("<i", msg_buffer[:4])[0]
+        if conn.partialmsg is not None:
+            offset = self.process_partial_message(conn, msg_view, offset, msgs)
 
-            if len(msg_buffer) >= 8:
-                msgtype = struct.unpack("<i", msg_buffer[4:8])[0]
-                self._ui_callback([PeerTransfer(conn, msgsize, len(msg_buffer) - 4, self.peerclasses.get(msgtype, None))])
+        while (conn.init is None or conn.init.type not in ['F', 'D']) and buffer_len - offset >= 8:
+            msgsize, msgtype = INT_PAIR_UNPACK_FROM(msg_buffer, offset)
+            msg_end = offset + msgsize + 4
+
+            # Progress of the last message is reported once all buffered messages are processed
+            transfer = (msgsize, buffer_len - offset - 4, msgtype)
+
+            if msg_end > buffer_len:
+                if conn.init is not None and conn.init.type == 'P' and self.peerclasses.get(msgtype) is SharedFileList:
+                    # Browse responses can be huge, parse them while they arrive
+                    conn.partialmsg = SharedFileList(conn)
+                    conn.partialmsg.init_stream(msgsize - 4)
+
+                    offset = self.process_partial_message(conn, msg_view, offset + 8, msgs)
+                    transfer = None
 
-            if msgsize + 4 > len(msg_buffer):
                 break
 
             elif conn.init is None:
                 # Unpack Peer Connections
-                if msg_buffer[4] == 0:
+                if msg_buffer[offset + 4] == 0:
                     msg = PierceFireWall(conn)
 
                     try:
-                        msg.parse_network_message(msg_buffer[5:msgsize + 4])
+                        msg.parse_network_message(msg_view[offset + 5:msg_end])
                     except Exception as error:
                         log.add_warning("%s", error)
                     else:
                         conn.piercefw = msg
                         msgs.append(msg)
 
-                elif msg_buffer[4] == 1:
+                elif msg_buffer[offset + 4] == 1:
                     msg = PeerInit(conn)
 
                     try:
-                        msg.parse_network_message(msg_buffer[5:msgsize + 4])
+                        msg.parse_network_message(msg_view[offset + 5:msg_end])
                     except Exception as error:
                         log.add_warning("%s", error)
                     else:
@@ -735,11 +1042,12 @@ class SlskProtoThread(threading.Thread):
 
                 elif conn.piercefw is None:
                     msgs.append(_(
-                        "Unknown peer init code: {}, message contents ".format(msg_buffer[4]) +
-                        "{}".format(msg_buffer[5:msgsize + 4].__repr__())
+                        "Unknown peer init code: {}, message contents ".format(msg_buffer[offset + 4]) +
+                        "{}".format(msg_buffer[offset + 5:msg_end].__repr__())
                     ))
 
                     self._ui_callback([ConnClose(conn.conn, conn.addr)])
+                    self.unregister_socket(conn.conn)
                     conn.conn.close()
                     conn.conn = None
                     break
@@ -749,15 +1057,18 @@ class SlskProtoThread(threading.Thread):
 
             elif conn.init.type == 'P':
                 # Unpack Peer Messages
-                msgtype = struct.unpack("<i", msg_buffer[4:8])[0]
+                if msgtype in self.compressedcodes and msgsize > self.COMPRESSED_INLINE_MAX:
+                    # Decompress large messages in a worker, to keep other connections responsive
+                    msg = self.peerclasses[msgtype](conn)
+                    self._compression_pool.submit(self.parse_compressed_message, msg, bytes(msg_view[offset + 8:msg_end]))
 
-                if msgtype in self.peerclasses:
+                elif msgtype in self.peerclasses:
                     try:
                         msg = self.peerclasses[msgtype](conn)
 
                         # Parse Peer Message and handle exceptions
                         try:
-                            msg.parse_network_message(msg_buffer[8:msgsize + 4])
+                            msg.parse_network_message(msg_view[offset + 8:msg_end])
 
                         except Exception as error:
                             host = port = _("unknown")
@@ -768,11 +1079,11 @@ class SlskProtoThread(threading.Thread):
                             for line in traceback.format_tb(error.__traceback__):
                                 print(line)
 
-                            if "addr" in conn.__dict__:
-                                if conn.addr is not None:
-                                    host = conn.addr[0]
-                                    port = conn.addr[1]
-                            debugmessage = _("There was an error while unpacking Peer message type %(type)s size %(size)i contents %(msg_buffer)s from user: %(user)s, %(host)s:%(port)s") % {'type': msgname, 'size': msgsize - 4, 'msg_buffer': msg_buffer[8:msgsize + 4].__repr__(), 'user': conn.init.user, 'host': host, 'port': port}
+                            if conn.addr is not None:
+                                host = conn.addr[0]
+                                port = conn.addr[1]
+
+                            debugmessage = _("There was an error while unpacking Peer message type %(type)s size %(size)i contents %(msg_buffer)s from user: %(user)s, %(host)s:%(port)s") % {'type': msgname, 'size': msgsize - 4, 'msg_buffer': msg_buffer[offset + 8:msg_end].__repr__(), 'user': conn.init.user, 'host': host, 'port': port}
                             msgs.append(debugmessage)
 
                             del msg
@@ -797,7 +1108,7 @@ class SlskProtoThread(threading.Thread):
 
                     # massive speedup in the status log with the newline
                     # wrapping is incredibly slow
-                    for char in msg_buffer[8:msgsize + 4].__repr__():
+                    for char in msg_buffer[offset + 8:msg_end].__repr__():
                         if x % 80 == 0:
                             newbuf += "\n"
                         newbuf += char
@@ -811,13 +1122,74 @@ class SlskProtoThread(threading.Thread):
                 msgs.append(_("Can't handle connection type %s") % (conn.init.type))
 
             if msgsize >= 0:
-                msg_buffer = msg_buffer[msgsize + 4:]
+                offset = msg_end
             else:
-                msg_buffer = bytearray()
+                offset = buffer_len
 
-        conn.ibuf = msg_buffer
+        if transfer is not None:
+            msgsize, received, msgtype = transfer
+            self._ui_callback([PeerTransfer(conn, msgsize, received, self.peerclasses.get(msgtype, None))])
+
+        msg_view.release()
+        conn.ibuf = self.consume_buffer(msg_buffer, offset)
         return msgs, conn
 
+    def process_partial_message(self, conn, msg_view, offset, msgs):
+        """ Feeds the buffered part of a message that is parsed while it arrives to
+        the message object. Directories parsed so far are sent to the UI, and the
+        message itself once it's complete. Returns the offset following the part. """
+
+        msg = conn.partialmsg
+        end = min(offset + msg.stream_size - msg.stream_received, len(msg_view))
+        directories = msg.parse_stream(msg_view[offset:end])
+
+        if directories:
+            msgs.append(SharedFileListProgress(conn, directories))
+
+        if msg.stream_received >= msg.stream_size:
+            conn.partialmsg = None
+            msgs.append(msg)
+
+        self._ui_callback([PeerTransfer(conn, msg.stream_size, msg.stream_received, msg.__class__)])
+        return end
+
+    def parse_compressed_message(self, msg, payload):
+        """ Called in a compression worker to decompress and parse a large peer
+        message, which is passed to the UI once done """
+
+        try:
+            msg.parse_network_message(payload)
+        except Exception as error:
+            log.add_warning(_("Exception during parsing %(area)s: %(exception)s"), {'area': msg.__class__.__name__, 'exception': error})
+            return
+
+        self._ui_callback([msg])
+
+    def build_compressed_message(self, msg_obj):
+        """ Called in a compression worker to compress a large outgoing message,
+        which is queued again to be sent once built """
+
+        try:
+            msg_obj.make_network_message()
+        except Exception as error:
+            log.add_warning(_("Exception during packing %(area)s: %(exception)s"), {'area': msg_obj.__class__.__name__, 'exception': error})
+            return
+
+        self._queue.put(msg_obj)
+
+    def is_large_share_list(self, msg_obj):
+        """ Returns True if an outgoing shares message hasn't been compressed yet,
+        and is too large to compress in the networking loop """
+
+        if msg_obj.__class__ is not SharedFileList or msg_obj.built is not None:
+            return False
+
+        try:
+            return len(msg_obj.list) > self.COMPRESSED_INLINE_MAX_FOLDERS
+        except TypeError:
+            # Share databases don't always know their size
+            return True
+
     def process_distrib_input(self, conn, msg_buffer):
         """ We have a distributed network connection, parent has sent us
         something, this function retrieves messages
@@ -825,47 +1197,41 @@ class SlskProtoThread(threading.Thread):
         and the rest of the msg_buffer.
         """
         msgs = []
+        offset = 0
+        buffer_len = len(msg_buffer)
+        msg_view = memoryview(msg_buffer)
 
-        while len(msg_buffer) >= 5:
-            msgsize = struct.unpack("<i", msg_buffer[:4])[0]
+        while buffer_len - offset >= 5:
+            msgsize = INT_UNPACK_FROM(msg_buffer, offset)[0]
+            msg_end = offset + msgsize + 4
 
-            if msgsize + 4 > len(msg_buffer):
+            if msg_end > buffer_len:
                 break
 
-            msgtype = msg_buffer[4]
+            msgtype = msg_buffer[offset + 4]
 
             if msgtype in self.distribclasses:
                 msg = self.distribclasses[msgtype](conn)
-                msg.parse_network_message(msg_buffer[5:msgsize + 4])
+                msg.parse_network_message(msg_view[offset + 5:msg_end])
                 msgs.append(msg)
 
             else:
-                msgs.append(_("Distrib message type %(type)i size %(size)i contents %(msg_buffer)s unknown") % {'type': msgtype, 'size': msgsize - 1, 'msg_buffer': msg_buffer[5:msgsize + 4].__repr__()})
+                msgs.append(_("Distrib message type %(type)i size %(size)i contents %(msg_buffer)s unknown") % {'type': msgtype, 'size': msgsize - 1, 'msg_buffer': msg_buffer[offset + 5:msg_end].__repr__()})
                 self._ui_callback([ConnClose(conn.conn, conn.addr)])
+                self.unregister_socket(conn.conn)
                 conn.conn.close()
                 conn.conn = None
                 break
 
             if msgsize >= 0:
-                msg_buffer = msg_buffer[msgsize + 4:]
+                offset = msg_end
             else:
-                msg_buffer = bytearray()
+                offset = buffer_len
 
-        conn.ibuf = msg_buffer
+        msg_view.release()
+        conn.ibuf = self.consume_buffer(msg_buffer, offset)
         return msgs, conn
 
-    def _reset_counters(self, conns):
-        curtime = time.time()
-
-        for i in conns.values():
-            if self._is_upload(i):
-                i.starttime = curtime
-                i.sentbytes2 = 0
-
-            if self._is_download(i):
-                i.starttime = curtime
-                i.sentbytes2 = 0
-
     def set_server_socket_keepalive(self, server_socket, idle=10, interval=4, count=10):
         """ Ensure we are disconnected from the server in case of connectivity issues,
         by sending TCP keepalive pings. Assuming default values are used, once we reach
@@ -904,10 +1270,63 @@ class SlskProtoThread(threading.Thread):
                 )
             )
 
-    def close_connection(self, connection_list, connection):
+    def set_event_masks(self, sock, event_masks):
+        """ Registers a socket in the selector, or updates the events it's selected
+        for. The selector is only called when the events have changed. """
+
+        try:
+            key = self._selector.get_key(sock)
+
+        except KeyError:
+            self._selector.register(sock, event_masks)
+
+        else:
+            if key.events != event_masks:
+                self._selector.modify(sock, event_masks)
+
+    def unregister_socket(self, sock):
+        """ Removes a socket from the selector, before it's closed """
+
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def close_connection(self, connection_list, connection, msg=None):
+        """ Closes a connection. msg tells the UI about it, and is only sent once the
+        rest of a download is written, since the UI closes the file when it's told. """
+
+        self.flush_download(connection_list[connection])
+
+        if msg is not None:
+            self._ui_callback([msg])
+
+        self.unregister_socket(connection)
         connection.close()
         del connection_list[connection]
 
+    def new_download_writer(self, msg_obj):
+
+        transfers = self._config.sections["transfers"]
+        writer = DownloadWriter(
+            self._conns[msg_obj.conn], msg_obj.file, self._ui_callback,
+            write_size=transfers["downloadbuffersize"] * 1024,
+            fsync=transfers["downloadfsync"],
+            pool=self._download_write_pool if transfers["downloadwriterthread"] else None
+        )
+
+        if transfers["preallocate"]:
+            writer.preallocate(msg_obj.offset, msg_obj.filesize - msg_obj.offset)
+
+        return writer
+
+    def flush_download(self, conn_obj):
+        """ Writes the remaining buffered data of a download when its connection is closed.
+        The UI closes the file once it knows, so the data is written before we return. """
+
+        if conn_obj.__class__ is PeerConnection and conn_obj.filewriter is not None:
+            conn_obj.filewriter.flush(wait=True)
+
     def process_queue(self, queue, conns, connsinprogress, server_socket, maxsockets=MAXSOCKETS):
         """ Processes messages sent by UI thread. server_socket is a server connection
         socket object, queue holds the messages, conns and connsinprogress
@@ -915,7 +1334,6 @@ class SlskProtoThread(threading.Thread):
         messages."""
 
         msg_list = []
-        needsleep = False
         numsockets = len(conns) + len(connsinprogress)
 
         while not queue.empty():
@@ -927,15 +1345,14 @@ class SlskProtoThread(threading.Thread):
                     msg = msg_obj.make_network_message()
 
                     if server_socket in conns:
-                        conns[server_socket].obuf.extend(struct.pack("<ii", len(msg) + 4, self.servercodes[msg_obj.__class__]))
-                        conns[server_socket].obuf.extend(msg)
+                        self.queue_frame(conns[server_socket], struct.pack("<ii", len(msg) + 4, self.servercodes[msg_obj.__class__]), msg)
                     else:
-                        queue.put(msg_obj)
-                        needsleep = True
+                        # Sent once we're connected to the server
+                        self._pending_server_msgs.append(msg_obj)
 
                 except Exception as error:
-                    print(_("Error packaging message: %(type)s %(msg_obj)s, %(error)s") % {'type': msg_obj.__class__, 'msg_obj': vars(msg_obj), 'error': str(error)})
-                    self._ui_callback([_("Error packaging message: %(type)s %(msg_obj)s, %(error)s") % {'type': msg_obj.__class__, 'msg_obj': vars(msg_obj), 'error': str(error)}])
+                    print(_("Error packaging message: %(type)s %(msg_obj)s, %(error)s") % {'type': msg_obj.__class__, 'msg_obj': msg_contents(msg_obj), 'error': str(error)})
+                    self._ui_callback([_("Error packaging message: %(type)s %(msg_obj)s, %(error)s") % {'type': msg_obj.__class__, 'msg_obj': msg_contents(msg_obj), 'error': str(error)}])
 
             elif issubclass(msg_obj.__class__, PeerMessage):
                 if msg_obj.conn in conns:
@@ -946,24 +1363,20 @@ class SlskProtoThread(threading.Thread):
 
                         msg = msg_obj.make_network_message()
 
-                        conns[msg_obj.conn].obuf.extend(struct.pack("<i", len(msg) + 1))
-                        conns[msg_obj.conn].obuf.extend(bytes([0]))
-                        conns[msg_obj.conn].obuf.extend(msg)
+                        self.queue_frame(conns[msg_obj.conn], struct.pack("<iB", len(msg) + 1, 0), msg)
 
                     elif msg_obj.__class__ is PeerInit:
                         conns[msg_obj.conn].init = msg_obj
                         msg = msg_obj.make_network_message()
 
                         if conns[msg_obj.conn].piercefw is None:
-                            conns[msg_obj.conn].obuf.extend(struct.pack("<i", len(msg) + 1))
-                            conns[msg_obj.conn].obuf.extend(bytes([1]))
-                            conns[msg_obj.conn].obuf.extend(msg)
+                            self.queue_frame(conns[msg_obj.conn], struct.pack("<iB", len(msg) + 1, 1), msg)
 
                     elif msg_obj.__class__ is FileRequest:
                         conns[msg_obj.conn].filereq = msg_obj
 
                         msg = msg_obj.make_network_message()
-                        conns[msg_obj.conn].obuf.extend(msg)
+                        self.queue_frame(conns[msg_obj.conn], msg)
 
                         self._ui_callback([msg_obj])
 
@@ -976,14 +1389,16 @@ class SlskProtoThread(threading.Thread):
                             if (cc == "-" and self._geoip[0]) or (cc != "-" and self._geoip[1][0].find(cc) >= 0):
                                 checkuser = 0
 
-                        if checkuser:
+                        if checkuser and self.is_large_share_list(msg_obj):
+                            self._compression_pool.submit(self.build_compressed_message, msg_obj)
+
+                        elif checkuser:
                             msg = msg_obj.make_network_message()
-                            conns[msg_obj.conn].obuf.extend(struct.pack("<ii", len(msg) + 4, self.peercodes[msg_obj.__class__]))
-                            conns[msg_obj.conn].obuf.extend(msg)
+                            self.queue_frame(conns[msg_obj.conn], struct.pack("<ii", len(msg) + 4, self.peercodes[msg_obj.__class__]), msg)
 
                 else:
                     if msg_obj.__class__ not in [PeerInit, PierceFireWall, FileSearchResult]:
-                        log.add_conn(_("Can't send the message over the closed connection: %(type)s %(msg_obj)s"), {'type': msg_obj.__class__, 'msg_obj': vars(msg_obj)})
+                        log.add_conn(_("Can't send the message over the closed connection: %(type)s %(msg_obj)s"), {'type': msg_obj.__class__, 'msg_obj': msg_contents(msg_obj)})
 
             elif issubclass(msg_obj.__class__, InternalMessage):
                 if msg_obj.__class__ is ServerConn:
@@ -1011,8 +1426,7 @@ class SlskProtoThread(threading.Thread):
                             server_socket.close()
 
                 elif msg_obj.__class__ is ConnClose and msg_obj.conn in conns:
-                    self._ui_callback([ConnClose(msg_obj.conn, conns[msg_obj.conn].addr)])
-                    self.close_connection(conns, msg_obj.conn)
+                    self.close_connection(conns, msg_obj.conn, ConnClose(msg_obj.conn, conns[msg_obj.conn].addr))
 
                 elif msg_obj.__class__ is OutConn:
                     if msg_obj.addr[1] == 0:
@@ -1042,41 +1456,68 @@ class SlskProtoThread(threading.Thread):
 
                 elif msg_obj.__class__ is DownloadFile and msg_obj.conn in conns:
                     conns[msg_obj.conn].filedown = msg_obj
+                    conns[msg_obj.conn].filewriter = self.new_download_writer(msg_obj)
 
-                    conns[msg_obj.conn].obuf.extend(struct.pack("<Q", msg_obj.offset))
-                    conns[msg_obj.conn].obuf.extend(struct.pack("<i", 0))
+                    self.queue_frame(conns[msg_obj.conn], struct.pack("<Qi", msg_obj.offset, 0))
 
                     conns[msg_obj.conn].bytestoread = msg_obj.filesize - msg_obj.offset
 
                     self._ui_callback([DownloadFile(msg_obj.conn, 0, msg_obj.file)])
+                    self.update_transfer_limits()
 
                 elif msg_obj.__class__ is UploadFile and msg_obj.conn in conns:
                     conns[msg_obj.conn].fileupl = msg_obj
-                    self._reset_counters(conns)
+                    self.update_transfer_limits()
 
                 elif msg_obj.__class__ is SetGeoBlock:
                     self._geoip = msg_obj.config
 
                 elif msg_obj.__class__ is SetUploadLimit:
-                    if msg_obj.uselimit:
-                        if msg_obj.limitby:
-                            cb = self._calc_upload_limit_by_total
-                        else:
-                            cb = self._calc_upload_limit_by_transfer
+                    self.set_upload_limit(msg_obj.uselimit, msg_obj.limit, msg_obj.limitby)
+                    self.update_transfer_limits()
 
-                    else:
-                        cb = self._calc_upload_limit_none
+                elif msg_obj.__class__ is SetDownloadLimit:
+                    self.set_download_limit(msg_obj.limit)
+                    self.update_transfer_limits()
 
-                    self._reset_counters(conns)
-                    self._uploadlimit = (cb, msg_obj.limit)
+        return conns, connsinprogress, server_socket
 
-                elif msg_obj.__class__ is SetDownloadLimit:
-                    self._downloadlimit = (self._calc_download_limit_by_total, msg_obj.limit)
+    @staticmethod
+    def queue_frame(conn, *buffers):
+        """ Queues the buffers of an outgoing message on a connection. The buffers
+        aren't copied, so cached messages can be sent to any number of peers. """
 
-        if needsleep:
-            time.sleep(1)
+        for buffer in buffers:
+            if len(buffer) > 0:
+                conn.oframes.append(buffer)
 
-        return conns, connsinprogress, server_socket
+    def send_frames(self, sock, frames, limit=None):
+        """ Sends queued message buffers, in a single system call where possible.
+        Sent buffers are dropped from the queue. Returns the number of bytes sent. """
+
+        if limit is not None:
+            bytes_send = sock.send(memoryview(frames[0])[:limit])
+
+        elif hasattr(sock, "sendmsg"):
+            bytes_send = sock.sendmsg(list(islice(frames, self.MAX_SEND_BUFFERS)))
+
+        else:
+            # Not available on Windows
+            bytes_send = sock.send(frames[0])
+
+        remaining = bytes_send
+
+        while remaining > 0:
+            length = len(frames[0])
+
+            if remaining < length:
+                frames[0] = memoryview(frames[0])[remaining:]
+                break
+
+            frames.popleft()
+            remaining -= length
+
+        return bytes_send
 
     def write_data(self, server_socket, conns, i):
 
@@ -1090,31 +1531,61 @@ class SlskProtoThread(threading.Thread):
         conn.lastactive = time.time()
         i.setblocking(0)
 
-        if limit is None:
-            bytes_send = i.send(conn.obuf)
-        else:
-            bytes_send = i.send(conn.obuf[:limit])
+        if conn.oframes:
+            # Messages are sent before file data
+            bytes_send = self.send_frames(i, conn.oframes, limit)
+            i.setblocking(1)
+
+            if limit is not None:
+                conn.limiter.consume(bytes_send)
+
+            return
+
+        bytes_send = None
+
+        if not conn.obuf and i is not server_socket and self._is_upload_pending(conn):
+            bytes_send = self.sendfile_data(i, conn, limit)
+
+            if conn.fileupl is None:
+                # Upload stopped, the file is shorter than its size
+                i.setblocking(1)
+                return
+
+        use_sendfile = bytes_send is not None
+
+        if not use_sendfile:
+            if limit is None:
+                bytes_send = i.send(conn.obuf)
+            else:
+                bytes_send = i.send(conn.obuf[:limit])
+
+            conn.obuf = conn.obuf[bytes_send:]
+
+        if limit is not None:
+            conn.limiter.consume(bytes_send)
 
         i.setblocking(1)
-        conn.obuf = conn.obuf[bytes_send:]
 
         if i is not server_socket:
             if conn.fileupl is not None and conn.fileupl.offset is not None:
                 conn.fileupl.sentbytes += bytes_send
-                conn.sentbytes2 += bytes_send
 
                 totalsentbytes = conn.fileupl.offset + conn.fileupl.sentbytes + len(conn.obuf)
 
                 try:
                     size = conn.fileupl.size
 
-                    if totalsentbytes < size:
+                    if totalsentbytes < size and not use_sendfile:
                         bytestoread = bytes_send * 2 - len(conn.obuf) + 10 * 4024
 
                         if bytestoread > 0:
                             read = conn.fileupl.file.read(bytestoread)
                             conn.obuf.extend(read)
 
+                            if not read and not conn.obuf:
+                                self.upload_file_truncated(conn)
+                                return
+
                 except IOError as strerror:
                     self._ui_callback([FileError(conn, conn.fileupl.file, strerror)])
 
@@ -1140,6 +1611,71 @@ class SlskProtoThread(threading.Thread):
                     self._ui_callback([conn.fileupl])
                     conn.lastcallback = curtime
 
+    def sendfile_data(self, sock, conn, limit=None):
+        """ Sends the next part of an upload from the file to the socket in the kernel,
+        instead of copying it through Python. Returns the number of bytes sent, or None
+        if the file can't be sent with sendfile. Uploads then fall back to reading
+        the file. """
+
+        if not conn.sendfile:
+            return None
+
+        upload = conn.fileupl
+        offset = upload.offset + upload.sentbytes
+        count = upload.size - offset
+
+        if limit is not None:
+            count = min(count, limit)
+
+            if count <= 0:
+                return 0
+
+        try:
+            file_fd = upload.file.fileno()
+        except (AttributeError, OSError, ValueError):
+            # Not a regular file
+            file_fd = None
+
+        if file_fd is not None:
+            try:
+                bytes_send = os.sendfile(sock.fileno(), file_fd, offset, count)
+
+            except BlockingIOError:
+                return 0
+
+            except OSError as error:
+                if error.errno not in SENDFILE_UNSUPPORTED_ERRORS:
+                    # Socket error
+                    raise
+
+            else:
+                if not bytes_send:
+                    self.upload_file_truncated(conn)
+
+                return bytes_send
+
+        # sendfile is unsupported for the file, read it instead
+        conn.sendfile = False
+
+        try:
+            upload.file.seek(offset)
+        except (IOError, ValueError):
+            pass
+
+        return None
+
+    def upload_file_truncated(self, conn):
+        """ Stops an upload whose file is shorter than its size, e.g. because the file
+        changed after the upload was queued. Nothing is left to send, and the socket
+        would otherwise stay writable with an upload pending. """
+
+        upload = conn.fileupl
+        conn.fileupl = None
+        self.update_transfer_limits()
+
+        self._ui_callback([FileError(conn, upload.file, _("File is shorter than its size of %(size)s bytes") % {
+            'size': upload.size})])
+
     def read_data(self, conns, i):
         # Check for a download limit
         if i in self._dlimits:
@@ -1150,25 +1686,54 @@ class SlskProtoThread(threading.Thread):
         conn = conns[i]
 
         conn.lastactive = time.time()
+        recv_view = self._recv_view
 
         if limit is None:
             # Unlimited download data
-            data = i.recv(conn.lastreadlength)
-            conn.ibuf.extend(data)
-
-            if len(data) >= conn.lastreadlength // 2:
-                conn.lastreadlength = conn.lastreadlength * 2
+            length = i.recv_into(recv_view, conn.lastreadlength)
+            conn.ibuf.extend(recv_view[:length])
+            self.update_read_length(conn, length)
 
         else:
             # Speed Limited Download data (transfers)
-            data = i.recv(conn.lastreadlength)
-            conn.ibuf.extend(data)
-            conn.lastreadlength = limit
-            conn.readbytes2 += len(data)
+            length = i.recv_into(recv_view, min(limit, self.MAX_READ_LENGTH))
+            conn.ibuf.extend(recv_view[:length])
+            conn.limiter.consume(length)
+
+        if not length:
+            self.close_connection(conns, i, ConnClose(i, conn.addr))
+
+    def update_read_length(self, conn, length):
+        """ Reads more data at once while the socket fills most of the read buffer """
+
+        if length >= conn.lastreadlength // 2:
+            conn.lastreadlength = min(conn.lastreadlength * 2, self.MAX_READ_LENGTH)
+
+    def process_conn_input(self, conns, connection, server_socket):
+        """ Parses the messages in the input buffer of a connection, and passes
+        them to the UI """
+
+        conn_obj = conns[connection]
 
-        if not data:
-            self._ui_callback([ConnClose(i, conn.addr)])
-            self.close_connection(conns, i)
+        if connection is server_socket:
+            msgs, conn_obj.ibuf = self.process_server_input(conn_obj.ibuf)
+            self._ui_callback(msgs)
+            return
+
+        if conn_obj.init is None or conn_obj.init.type not in ['F', 'D']:
+            msgs, conn_obj = self.process_peer_input(conn_obj, conn_obj.ibuf)
+            self._ui_callback(msgs)
+
+        if conn_obj.init is not None and conn_obj.init.type == 'F':
+            msgs, conn_obj = self.process_file_input(conn_obj, conn_obj.ibuf)
+            self._ui_callback(msgs)
+
+        if conn_obj.init is not None and conn_obj.init.type == 'D':
+            msgs, conn_obj = self.process_distrib_input(conn_obj, conn_obj.ibuf)
+            self._ui_callback(msgs)
+
+        if conn_obj.conn is None:
+            del conns[connection]
 
     def run(self):
         """ Actual networking loop is here."""
@@ -1183,6 +1748,10 @@ class SlskProtoThread(threading.Thread):
         connsinprogress = self._connsinprogress
         queue = self._queue
 
+        # Sockets stay registered in the selector until they're closed
+        selector = self._selector
+        wakeup_fd = self._wakeup_fds[0]
+
         while not self._want_abort:
 
             if not queue.empty():
@@ -1192,38 +1761,88 @@ class SlskProtoThread(threading.Thread):
             self._ulimits = {}
             self._dlimits = {}
 
+            curtime = time.time()
+
+            if curtime >= self._next_limit_update and self.has_transfer_limits():
+                self.update_transfer_limits()
+
             try:
-                # Select Networking Input and Output sockets
-                selector = selectors.DefaultSelector()
+                # Select Networking Input and Output sockets. Wait until there's network
+                # activity, a queued message, or something to do at a later time.
+                deadline = None
+                last_activity = curtime
 
-                timeout = -1
+                if self._poll_queue:
+                    deadline = curtime + self.QUEUE_POLL_INTERVAL
+
+                if len(conns) + len(connsinprogress) != self.last_conncount:
+                    conncount_deadline = self.last_conncount_ui_update + self.CONNCOUNT_UI_INTERVAL
+
+                    if deadline is None or conncount_deadline < deadline:
+                        deadline = conncount_deadline
+
+                if self.has_transfer_limits() and (deadline is None or self._next_limit_update < deadline):
+                    deadline = self._next_limit_update
 
                 for i in conns:
                     conn = conns[i]
                     event_masks = selectors.EVENT_READ
+                    limit_deadline = None
 
-                    if len(conn.obuf) > 0 or (i is not server_socket and conn.fileupl is not None and conn.fileupl.offset is not None):
-                        if self._is_upload(conn):
-                            limit = self._uploadlimit[0](conns, conn)
+                    if i is not server_socket and conn.lastactive < last_activity:
+                        last_activity = conn.lastactive
 
-                            if limit is not None:
-                                limit = int(limit * 0.2)  # limit is per second, we loop 5 times a second
+                    if len(conn.obuf) > 0 or len(conn.oframes) > 0 or (i is not server_socket and self._is_upload_pending(conn)):
+                        if self._is_upload(conn) and conn.limiter is not None:
+                            limit = conn.limiter.available()
 
-                            if limit is None or limit > 0:
+                            if limit > 0:
                                 self._ulimits[i] = limit
                                 event_masks |= selectors.EVENT_WRITE
+                            else:
+                                # Upload used its limit, wait for the bucket to refill
+                                limit_deadline = curtime + conn.limiter.wait_time()
 
                         else:
                             event_masks |= selectors.EVENT_WRITE
 
-                    selector.register(i, event_masks)
+                    if self._is_download(conn) and conn.limiter is not None:
+                        limit = conn.limiter.available()
+
+                        if limit > 0:
+                            self._dlimits[i] = limit
+                        else:
+                            # Download used its limit, wait for the bucket to refill
+                            event_masks &= ~selectors.EVENT_READ
+                            limit_deadline = curtime + conn.limiter.wait_time()
+
+                    if limit_deadline is not None and (deadline is None or limit_deadline < deadline):
+                        deadline = limit_deadline
+
+                    if event_masks:
+                        self.set_event_masks(i, event_masks)
+                    else:
+                        self.unregister_socket(i)
+
+                if conns:
+                    idle_deadline = last_activity + self.CONNECTION_MAX_IDLE
+
+                    if deadline is None or idle_deadline < deadline:
+                        deadline = idle_deadline
 
                 for i in connsinprogress:
                     event_masks = selectors.EVENT_READ | selectors.EVENT_WRITE
-                    selector.register(i, event_masks)
+                    self.set_event_masks(i, event_masks)
+
+                    stale_deadline = connsinprogress[i].lastactive + self.IN_PROGRESS_STALE_AFTER
 
-                selector.register(p, selectors.EVENT_READ)
+                    if deadline is None or stale_deadline < deadline:
+                        deadline = stale_deadline
 
+                self.set_event_masks(p, selectors.EVENT_READ)
+                self.set_event_masks(wakeup_fd, selectors.EVENT_READ)
+
+                timeout = None if deadline is None else max(deadline - time.time(), 0)
                 key_events = selector.select(timeout)
                 input_list = set(key.fileobj for key, event in key_events if event & selectors.EVENT_READ)
                 output_list = set(key.fileobj for key, event in key_events if event & selectors.EVENT_WRITE)
@@ -1246,15 +1865,18 @@ class SlskProtoThread(threading.Thread):
                 time.sleep(0.2)
                 continue
 
+            if wakeup_fd in input_list:
+                self.clear_wakeup()
+
             # Update UI connection count
             curtime = time.time()
+            numsockets = len(conns) + len(connsinprogress)
 
-            if (curtime - self.last_conncount_ui_update) > self.CONNCOUNT_UI_INTERVAL:
+            if numsockets != self.last_conncount and (curtime - self.last_conncount_ui_update) >= self.CONNCOUNT_UI_INTERVAL:
                 # Avoid sending too many updates to the UI at once, if there are a lot of connections
-                numsockets = len(conns) + len(connsinprogress)
-
                 self._ui_callback([SetCurrentConnectionCount(numsockets)])
                 self.last_conncount_ui_update = curtime
+                self.last_conncount = numsockets
 
             # Listen / Peer Port
             if p in input_list:
@@ -1282,8 +1904,7 @@ class SlskProtoThread(threading.Thread):
 
                 if (curtime - conn_obj.lastactive) > self.IN_PROGRESS_STALE_AFTER:
 
-                    self._ui_callback([ConnectError(msg_obj)])
-                    self.close_connection(connsinprogress, connection_in_progress)
+                    self.close_connection(connsinprogress, connection_in_progress, ConnectError(msg_obj))
                     continue
 
                 try:
@@ -1292,8 +1913,7 @@ class SlskProtoThread(threading.Thread):
 
                 except socket.error as err:
 
-                    self._ui_callback([ConnectError(msg_obj, err)])
-                    self.close_connection(connsinprogress, connection_in_progress)
+                    self.close_connection(connsinprogress, connection_in_progress, ConnectError(msg_obj, err))
 
                 else:
                     if connection_in_progress in output_list:
@@ -1304,9 +1924,16 @@ class SlskProtoThread(threading.Thread):
 
                             self._ui_callback([ServerConn(server_socket, addr)])
 
+                            # Send messages that were queued before we were connected
+                            for msg_obj in self._pending_server_msgs:
+                                queue.put(msg_obj)
+
+                            self._pending_server_msgs = []
+
                         else:
                             if self.ip_blocked(addr[0]):
                                 log.add_conn("Blocking peer connection in progress to IP: %(ip)s Port: %(port)s", {"ip": addr[0], "port": addr[1]})
+                                self.unregister_socket(connection_in_progress)
                                 connection_in_progress.close()
                             else:
                                 conns[connection_in_progress] = PeerConnection(conn=connection_in_progress, addr=addr, init=msg_obj.init)
@@ -1327,8 +1954,7 @@ class SlskProtoThread(threading.Thread):
                         self.write_data(server_socket, conns, connection)
 
                     except socket.error as err:
-                        self._ui_callback([ConnectError(conn_obj, err)])
-                        self.close_connection(conns, connection)
+                        self.close_connection(conns, connection, ConnectError(conn_obj, err))
                         continue
 
                 if connection is not server_socket:
@@ -1338,66 +1964,72 @@ class SlskProtoThread(threading.Thread):
                         # Timeout Connections
 
                         if curtime - conn_obj.lastactive > self.CONNECTION_MAX_IDLE:
-                            self._ui_callback([ConnClose(connection, addr)])
-                            self.close_connection(conns, connection)
+                            self.close_connection(conns, connection, ConnClose(connection, addr))
                             continue
 
-                    if self.ip_blocked(addr[0]):
+                    if self.conn_blocked(conn_obj):
                         log.add_conn("Blocking peer connection to IP: %(ip)s Port: %(port)s", {"ip": addr[0], "port": addr[1]})
                         self.close_connection(conns, connection)
                         continue
 
                 if connection in input_list:
-                    if self._is_download(conn_obj):
-                        limit = self._downloadlimit[0](conns, connection)
-
-                        if limit is not None:
-                            limit = int(limit * 0.2)  # limit is per second, we loop 5 times a second
-
-                        if limit is None or limit > 0:
-                            self._dlimits[connection] = limit
-
                     try:
                         self.read_data(conns, connection)
 
                     except socket.error as err:
-                        self._ui_callback([ConnectError(conn_obj, err)])
-                        self.close_connection(conns, connection)
+                        self.close_connection(conns, connection, ConnectError(conn_obj, err))
                         continue
 
                 try:
                     if len(conn_obj.ibuf) > 0:
-                        if connection is server_socket:
-                            msgs, conns[server_socket].ibuf = self.process_server_input(conns[server_socket].ibuf)
-                            self._ui_callback(msgs)
-
-                        else:
-                            if conn_obj.init is None or conn_obj.init.type not in ['F', 'D']:
-                                msgs, conn_obj = self.process_peer_input(conn_obj, conn_obj.ibuf)
-                                self._ui_callback(msgs)
-
-                            if conn_obj.init is not None and conn_obj.init.type == 'F':
-                                msgs, conn_obj = self.process_file_input(conn_obj, conn_obj.ibuf)
-                                self._ui_callback(msgs)
-
-                            if conn_obj.init is not None and conn_obj.init.type == 'D':
-                                msgs, conn_obj = self.process_distrib_input(conn_obj, conn_obj.ibuf)
-                                self._ui_callback(msgs)
-
-                            if conn_obj.conn is None:
-                                del conns[connection]
+                        self.process_conn_input(conns, connection, server_socket)
                 except KeyError:
                     pass
 
-            # Don't exhaust the CPU
-            time.sleep(0.2)
+        # Write the rest of the downloads before their files are closed
+        for conn_obj in conns.values():
+            self.flush_download(conn_obj)
 
         # Close Server Port
         if server_socket is not None:
             server_socket.close()
 
+        selector.close()
+
+        for fileobj in self._wakeup_fds:
+            fileobj.close()
+
+        self._compression_pool.shutdown(wait=False)
+        self._download_write_pool.shutdown()
+
         # Networking thread aborted
 
+    def wakeup(self):
+        """ Interrupts the selector of the networking loop. Called from other threads
+        when a message is queued. """
+
+        try:
+            self._wakeup_send()
+
+        except ValueError:
+            # Networking thread stopped
+            pass
+
+        except OSError:
+            # The pipe is full, a wakeup is already pending
+            pass
+
+    def clear_wakeup(self):
+
+        try:
+            while self._wakeup_recv():
+                pass
+
+        except OSError:
+            # Nothing left to read
+            pass
+
     def abort(self):
         """ Call this to abort the thread """
         self._want_abort = True
+        self.wakeup()
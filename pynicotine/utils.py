@@ -146,14 +146,13 @@ def get_user_directories():
     return config_dir, data_dir
 
 
-def get_result_bitrate_length(filesize, attributes):
-    """ Used to get the audio bitrate and length of search results and
-    user browse files """
+def get_bitrate_length(filesize, attributes):
+    """ Used to get the audio bitrate, length in seconds and VBR flag of search
+    results and user browse files. Bitrate and length are None if unknown. """
 
-    h_bitrate = ""
-    h_length = ""
-
-    bitrate = 0
+    bitrate = None
+    length = None
+    vbr = False
 
     # If there are 3 entries in the attribute list
     if len(attributes) == 3:
@@ -165,24 +164,16 @@ def get_result_bitrate_length(filesize, attributes):
         # Sometimes the vbr indicator is in third position
         if third == 0 or third == 1:
 
-            if third == 1:
-                h_bitrate = " (vbr)"
-
+            vbr = (third == 1)
             bitrate = first
-            h_bitrate = str(bitrate) + h_bitrate
-
-            h_length = '%i:%02i' % (second / 60, second % 60)
+            length = second
 
         # Sometimes the vbr indicator is in second position
         elif second == 0 or second == 1:
 
-            if second == 1:
-                h_bitrate = " (vbr)"
-
+            vbr = (second == 1)
             bitrate = first
-            h_bitrate = str(bitrate) + h_bitrate
-
-            h_length = '%i:%02i' % (third / 60, third % 60)
+            length = third
 
         # Lossless audio, length is in first position
         elif third > 1:
@@ -190,52 +181,65 @@ def get_result_bitrate_length(filesize, attributes):
             # Bitrate = sample rate (Hz) * word length (bits) * channel count
             # Bitrate = 44100 * 16 * 2
             bitrate = (second * third * 2) / 1000
-            h_bitrate = str(bitrate)
-
-            h_length = '%i:%02i' % (first / 60, first % 60)
+            length = first
 
         else:
 
             bitrate = first
-            h_bitrate = str(bitrate) + h_bitrate
 
     # If there are 2 entries in the attribute list
     elif len(attributes) == 2:
 
         first = attributes[0]
         second = attributes[1]
+        bitrate = first
 
         # Sometimes the vbr indicator is in second position
         if second == 0 or second == 1:
 
             # If it's a vbr file we can't deduce the length
             if second == 1:
-
-                h_bitrate = " (vbr)"
-
-                bitrate = first
-                h_bitrate = str(bitrate) + h_bitrate
+                vbr = True
 
             # If it's a constant bitrate we can deduce the length
-            else:
-
-                bitrate = first
-                h_bitrate = str(bitrate) + h_bitrate
-
+            elif bitrate:
                 # Dividing the file size by the bitrate in Bytes should give us a good enough approximation
                 length = filesize / (bitrate / 8 * 1000)
 
-                h_length = '%i:%02i' % (length / 60, length % 60)
-
         # Sometimes the bitrate is in first position and the length in second position
         else:
 
-            bitrate = first
-            h_bitrate = str(bitrate) + h_bitrate
+            length = second
+
+    return bitrate, length, vbr
+
+
+def human_bitrate_length(bitrate, length, vbr):
+    """ Returns the bitrate and length returned by get_bitrate_length as strings """
+
+    h_bitrate = ""
+    h_length = ""
+
+    if bitrate is not None:
+        h_bitrate = str(bitrate)
+
+        if vbr:
+            h_bitrate += " (vbr)"
+
+    if length is not None:
+        h_length = '%i:%02i' % (length / 60, length % 60)
+
+    return h_bitrate, h_length
+
+
+def get_result_bitrate_length(filesize, attributes):
+    """ Used to get the audio bitrate and length of search results and
+    user browse files """
 
-            h_length = '%i:%02i' % (second / 60, second % 60)
+    bitrate, length, vbr = get_bitrate_length(filesize, attributes)
+    h_bitrate, h_length = human_bitrate_length(bitrate, length, vbr)
 
-    return h_bitrate, bitrate, h_length
+    return h_bitrate, bitrate or 0, h_length
 
 
 def apply_translation():
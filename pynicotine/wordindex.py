@@ -0,0 +1,540 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module contains the compact word index used to answer search requests.
+"""
+
+import mmap
+import os
+import struct
+import sys
+
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+from collections.abc import Mapping
+
+""" Word index files are laid out as follows (all integers are little-endian
+unsigned 32-bit values):
+
+header                  magic, version, number of words, size of file postings,
+                        number of folder postings, number of folders, number of bitmaps
+word offsets            number of words + 1 offsets into the string table
+file posting offsets    number of words + 1 offsets into the file postings table
+folder posting offsets  number of words + 1 offsets into the folder postings table
+folder table            id of the first file in each folder, followed by the number
+                        of files
+bitmap table            sorted ids of words whose file postings are bitmaps
+string table            UTF-8 encoded words, sorted, without separators
+file postings table     file ids, sorted, grouped by word, or bitmaps
+folder postings table   folder ids, sorted, grouped by word
+
+A word's id is its position in the sorted string table. Its postings are found
+between two consecutive posting offsets. The whole file is mapped into memory,
+so loading an index does not require parsing it.
+
+Words in folder names are only stored once per folder, instead of once per file
+in the folder. Files in a folder always have consecutive ids, which lets us find
+the folder of a file, and the files of a folder, without storing them.
+
+Words present in many file names, such as file extensions, would need a large
+list of file ids. Once a list would take up more space than one bit per file,
+the word's file postings are stored as a bitmap instead. Searches check these
+words last, and only for files matching the other words. """
+
+HEADER = struct.Struct("<4sIIIIII")
+MAGIC = b"NPWI"
+VERSION = 3
+
+# Use a bitmap once more than one in BITMAP_THRESHOLD files contain a word
+BITMAP_THRESHOLD = 32
+
+UINT_TYPE = "I" if array("I").itemsize == 4 else "L"
+UINT_SIZE = 4
+
+
+def encode_word(word):
+    # Undecodable file names are stored with surrogates, keep them intact
+    return word.encode("utf-8", "surrogatepass")
+
+
+def decode_word(data):
+    return data.decode("utf-8", "surrogatepass")
+
+
+def uint_array(data=b""):
+    """ Returns an array of unsigned 32-bit integers from little-endian bytes """
+
+    values = array(UINT_TYPE)
+    values.frombytes(data)
+
+    if sys.byteorder == "big":
+        values.byteswap()
+
+    return values
+
+
+def uint_bytes(values):
+    """ Returns little-endian bytes from an array of unsigned 32-bit integers """
+
+    if sys.byteorder == "big":
+        values = array(UINT_TYPE, values)
+        values.byteswap()
+
+    return values.tobytes()
+
+
+def add_posting(postings, word, item_id):
+
+    try:
+        postings[word].append(item_id)
+    except KeyError:
+        postings[word] = array(UINT_TYPE, (item_id,))
+
+
+def get_range(postings, start, end):
+    """ Returns the ids between start (inclusive) and end (exclusive) in a sorted
+    list of postings, or a bitmap """
+
+    if isinstance(postings, FileBitmap):
+        return postings.get_range(start, end)
+
+    return postings[bisect_left(postings, start):bisect_left(postings, end)]
+
+
+class FileBitmap:
+    """ Set of file ids, stored as one bit per file """
+
+    __slots__ = ("bits",)
+
+    def __init__(self, bits=None):
+        self.bits = bytearray() if bits is None else bytearray(bits)
+
+    @classmethod
+    def from_ids(cls, file_ids, num_files):
+
+        bitmap = cls(bytes(-(-num_files // 32) * UINT_SIZE))
+
+        for file_id in file_ids:
+            bitmap.add(file_id)
+
+        return bitmap
+
+    def add(self, file_id):
+
+        pos = file_id >> 3
+
+        if pos >= len(self.bits):
+            self.bits.extend(bytes(pos - len(self.bits) + 1))
+
+        self.bits[pos] |= 1 << (file_id & 7)
+
+    def get_range(self, start, end):
+        return [file_id for file_id in range(start, end) if file_id in self]
+
+    def __contains__(self, file_id):
+
+        pos = file_id >> 3
+        return pos < len(self.bits) and self.bits[pos] >> (file_id & 7) & 1 == 1
+
+    def __iter__(self):
+
+        for pos, byte in enumerate(self.bits):
+            if not byte:
+                continue
+
+            for bit in range(8):
+                if byte >> bit & 1:
+                    yield pos * 8 + bit
+
+    def __len__(self):
+        return bin(int.from_bytes(self.bits, "little")).count("1")
+
+
+class WordIndex(Mapping):
+    """ Maps words to the ids of the files they appear in. The index is stored on
+    disk as a sorted string table and contiguous postings tables, and is
+    memory-mapped when loaded. Words added after loading are kept in memory, and
+    written to disk when the index is closed. """
+
+    def __init__(self, filename=None):
+
+        self.filename = filename
+
+        self._mmap = None
+        self._num_words = 0
+        self._word_offsets = self._file_offsets = self._folder_offsets = uint_array()
+        self._strings_start = self._file_postings_start = self._folder_postings_start = 0
+
+        self._folder_starts = uint_array()
+        self._num_files = 0
+        self._bitmap_ids = set()
+
+        self._pending_files = {}
+        self._pending_folders = {}
+
+        if filename is not None and os.path.exists(filename):
+            self._load()
+
+    def _load(self):
+
+        with open(self.filename, "rb") as file_handle:
+            self._mmap = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, version, num_words, file_postings_size, _num_folder_postings, num_folders, num_bitmaps = \
+                HEADER.unpack_from(self._mmap)
+
+        except struct.error:
+            magic = version = None
+
+        if magic != MAGIC or version != VERSION:
+            self._unmap()
+            raise ValueError("%s is not a valid word index" % self.filename)
+
+        pos = HEADER.size
+
+        self._word_offsets = self._read_uints(pos, num_words + 1)
+        pos += len(self._word_offsets) * UINT_SIZE
+
+        self._file_offsets = self._read_uints(pos, num_words + 1)
+        pos += len(self._file_offsets) * UINT_SIZE
+
+        self._folder_offsets = self._read_uints(pos, num_words + 1)
+        pos += len(self._folder_offsets) * UINT_SIZE
+
+        self._folder_starts = self._read_uints(pos, num_folders + 1)
+        pos += len(self._folder_starts) * UINT_SIZE
+        self._num_files = self._folder_starts.pop()
+
+        self._bitmap_ids = set(self._read_uints(pos, num_bitmaps))
+        pos += num_bitmaps * UINT_SIZE
+
+        self._strings_start = pos
+        self._file_postings_start = pos + self._word_offsets[-1]
+        self._folder_postings_start = self._file_postings_start + file_postings_size * UINT_SIZE
+        self._num_words = num_words
+
+    def _read_uints(self, pos, count):
+        return uint_array(self._mmap[pos:pos + count * UINT_SIZE])
+
+    def _read_postings(self, start, offsets, word_id):
+        offset = offsets[word_id]
+        return self._read_uints(start + offset * UINT_SIZE, offsets[word_id + 1] - offset)
+
+    def _read_bitmap(self, word_id):
+
+        offsets = self._file_offsets
+        start = self._file_postings_start
+
+        return FileBitmap(self._mmap[start + offsets[word_id] * UINT_SIZE:start + offsets[word_id + 1] * UINT_SIZE])
+
+    def _get_word(self, word_id):
+        offsets = self._word_offsets
+        start = self._strings_start
+
+        return self._mmap[start + offsets[word_id]:start + offsets[word_id + 1]]
+
+    def get_word_id(self, word):
+        """ Returns the id of a word stored on disk, or -1 if the word is unknown """
+
+        if self._mmap is None:
+            if self._num_words:
+                raise ValueError("Word index is closed")
+
+            return -1
+
+        key = encode_word(word)
+        low = 0
+        high = self._num_words
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self._get_word(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self._num_words and self._get_word(low) == key:
+            return low
+
+        return -1
+
+    def get_postings(self, word):
+        """ Returns the ids of files whose names contain a word, and the ids of
+        folders whose paths contain it, or None if the word is unknown. File ids
+        of words present in many files are returned as a FileBitmap. """
+
+        word_id = self.get_word_id(word)
+        pending_files = self._pending_files.get(word)
+        pending_folders = self._pending_folders.get(word)
+
+        if word_id in self._bitmap_ids:
+            files = self._read_bitmap(word_id)
+            folders = self._read_postings(self._folder_postings_start, self._folder_offsets, word_id)
+
+        elif word_id >= 0:
+            files = self._read_postings(self._file_postings_start, self._file_offsets, word_id)
+            folders = self._read_postings(self._folder_postings_start, self._folder_offsets, word_id)
+
+        elif pending_files is None and pending_folders is None:
+            return None
+
+        else:
+            files = uint_array()
+            folders = uint_array()
+
+        if pending_files is not None:
+            if isinstance(files, FileBitmap):
+                for file_id in pending_files:
+                    files.add(file_id)
+            else:
+                files.extend(pending_files)
+
+        if pending_folders is not None:
+            folders.extend(pending_folders)
+
+        return files, folders
+
+    def get_num_files(self):
+        """ Returns the number of file ids in the index, including gaps """
+        return self._num_files
+
+    def get_folder(self, file_id):
+        """ Returns the id of the folder a file belongs to """
+        return bisect_right(self._folder_starts, file_id) - 1
+
+    def get_folder_range(self, folder_id):
+        """ Returns the id of the first file in a folder, and the id following
+        the last file """
+
+        starts = self._folder_starts
+        end = starts[folder_id + 1] if folder_id + 1 < len(starts) else self._num_files
+
+        return starts[folder_id], end
+
+    def add_folder(self, words, first_file_id):
+        """ Add a folder, which contains the files added from first_file_id onwards.
+        Folders must be added in ascending order of their first file id. """
+
+        folder_id = len(self._folder_starts)
+        self._folder_starts.append(first_file_id)
+        self._num_files = max(self._num_files, first_file_id)
+
+        for word in words:
+            add_posting(self._pending_folders, word, folder_id)
+
+    def add_file(self, words, file_id):
+        """ Add a file to the folder added last. Files must be added in ascending
+        order of their id. Words already present in the folder's path don't need to
+        be added again. """
+
+        self._num_files = max(self._num_files, file_id + 1)
+
+        for word in words:
+            add_posting(self._pending_files, word, file_id)
+
+    def search(self, words, maxresults=None):
+        """ Returns the ids of files that match every word, either in their name or
+        in the path of their folder """
+
+        terms = []
+        common_terms = []
+
+        for word in set(words):
+            postings = self.get_postings(word)
+
+            if postings is None:
+                return []
+
+            files, folders = postings
+            num_matches = 0
+
+            for folder_id in folders:
+                start, end = self.get_folder_range(folder_id)
+                num_matches += end - start
+
+            if isinstance(files, FileBitmap):
+                common_terms.append((num_matches, files, folders))
+                continue
+
+            terms.append((num_matches + len(files), files, folders))
+
+        if not terms and not common_terms:
+            return []
+
+        """ Start with the word that has the fewest matches, and only look at the folders
+        containing those matches. In each folder, the remaining words either match the
+        whole folder, or we filter the matches with the word's files in the folder.
+        Words stored as bitmaps match many files, and are checked last. """
+
+        terms.sort(key=lambda term: term[0])
+
+        if not terms:
+            common_terms.sort(key=lambda term: term[0] + len(term[1]))
+
+        terms += common_terms
+
+        _num_matches, files, folders = terms[0]
+        other_terms = [(other_files, set(other_folders)) for _num, other_files, other_folders in terms[1:]]
+
+        matching_folders = set(folders)
+
+        if isinstance(files, FileBitmap):
+            candidate_folders = range(len(self._folder_starts))
+        else:
+            candidate_folders = set(folders)
+            candidate_folders.update(self.get_folder(file_id) for file_id in files)
+            candidate_folders = sorted(candidate_folders)
+
+        results = []
+
+        for folder_id in candidate_folders:
+            start, end = self.get_folder_range(folder_id)
+
+            if folder_id in matching_folders:
+                matches = range(start, end)
+            else:
+                matches = get_range(files, start, end)
+
+            for other_files, other_folders in other_terms:
+                if folder_id in other_folders:
+                    continue
+
+                if isinstance(other_files, FileBitmap):
+                    allowed = other_files
+                else:
+                    allowed = set(get_range(other_files, start, end))
+
+                matches = [file_id for file_id in matches if file_id in allowed]
+
+                if not matches:
+                    break
+
+            results.extend(matches)
+
+            if maxresults is not None and len(results) >= maxresults:
+                del results[maxresults:]
+                break
+
+        return results
+
+    def __getitem__(self, word):
+
+        postings = self.get_postings(word)
+
+        if postings is None:
+            raise KeyError(word)
+
+        files, folders = postings
+        file_ids = set(files)
+
+        for folder_id in folders:
+            file_ids.update(range(*self.get_folder_range(folder_id)))
+
+        return array(UINT_TYPE, sorted(file_ids))
+
+    def __contains__(self, word):
+        return word in self._pending_files or word in self._pending_folders or self.get_word_id(word) >= 0
+
+    def __iter__(self):
+
+        for word_id in range(self._num_words):
+            yield decode_word(self._get_word(word_id))
+
+        for word in set(self._pending_files).union(self._pending_folders):
+            if self.get_word_id(word) < 0:
+                yield word
+
+    def __len__(self):
+        return sum(1 for _word in self)
+
+    def save(self, filename):
+        """ Write the index, including words added since it was loaded, to a file """
+
+        word_offsets = array(UINT_TYPE, (0,))
+        file_offsets = array(UINT_TYPE, (0,))
+        folder_offsets = array(UINT_TYPE, (0,))
+        bitmap_ids = array(UINT_TYPE)
+        strings = bytearray()
+        file_postings = bytearray()
+        folder_postings = array(UINT_TYPE)
+
+        for word_id, word in enumerate(sorted(self)):
+            files, folders = self.get_postings(word)
+
+            strings.extend(encode_word(word))
+            word_offsets.append(len(strings))
+
+            if len(files) * BITMAP_THRESHOLD > self._num_files:
+                if not isinstance(files, FileBitmap):
+                    files = FileBitmap.from_ids(files, self._num_files)
+
+                bitmap_ids.append(word_id)
+                file_postings.extend(files.bits)
+                file_postings.extend(bytes(-len(files.bits) % UINT_SIZE))
+
+            else:
+                file_postings.extend(uint_bytes(array(UINT_TYPE, files)))
+
+            file_offsets.append(len(file_postings) // UINT_SIZE)
+
+            folder_postings.extend(folders)
+            folder_offsets.append(len(folder_postings))
+
+        folder_starts = array(UINT_TYPE, self._folder_starts)
+        folder_starts.append(self._num_files)
+
+        if filename == self.filename:
+            self._unmap()
+
+        tmp_filename = filename + ".tmp"
+
+        with open(tmp_filename, "wb") as file_handle:
+            file_handle.write(HEADER.pack(
+                MAGIC, VERSION, len(word_offsets) - 1, len(file_postings) // UINT_SIZE, len(folder_postings),
+                len(folder_starts) - 1, len(bitmap_ids)
+            ))
+
+            for values in (word_offsets, file_offsets, folder_offsets, folder_starts, bitmap_ids):
+                file_handle.write(uint_bytes(values))
+
+            file_handle.write(strings)
+            file_handle.write(file_postings)
+            file_handle.write(uint_bytes(folder_postings))
+
+        os.replace(tmp_filename, filename)
+
+    def close(self):
+        """ Unmap the index file, and save words added since it was loaded """
+
+        if (self._pending_files or self._pending_folders) and self.filename is not None:
+            self.save(self.filename)
+
+            self._pending_files = {}
+            self._pending_folders = {}
+
+        self._unmap()
+
+    def _unmap(self):
+
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
@@ -0,0 +1,156 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the memory used by live protocol objects. Run from the source folder:
+
+    python3 -m test.benchmark.bench_memory --results 20000 --users 20000
+
+Search results and room user lists are parsed from generated messages, and kept
+alive while the memory allocated for them is measured.
+"""
+
+import argparse
+import random
+import tracemalloc
+import zlib
+
+from pynicotine import slskmessages
+from pynicotine.pynicotine import UserAddr
+from test.benchmark.library import WORDS
+from test.benchmark.measure import print_results
+
+
+def generate_search_result(rng, index):
+    """ Returns a compressed search result with one file, as sent by peers """
+
+    message = slskmessages.SlskMessage()
+    msg = bytearray()
+    msg.extend(message.pack_object("user%i" % index))
+    msg.extend(message.pack_object(index, unsignedint=True))
+    msg.extend(message.pack_object(1, unsignedint=True))
+
+    msg.extend(bytes([1]))
+    msg.extend(message.pack_object("Music\\%s.mp3" % " ".join(rng.sample(WORDS, 3))))
+    msg.extend(message.pack_object(rng.randint(1000000, 20000000), unsignedlonglong=True))
+    msg.extend(message.pack_object("mp3"))
+    msg.extend(message.pack_object(0, unsignedint=True))
+
+    msg.extend(bytes([1]))
+    msg.extend(message.pack_object(rng.randint(0, 100000), unsignedint=True))
+    msg.extend(message.pack_object(0, unsignedlonglong=True))
+
+    return zlib.compress(msg)
+
+
+def generate_join_room(rng, num_users):
+    """ Returns the user list of a room, as sent by the server """
+
+    message = slskmessages.SlskMessage()
+    msg = bytearray()
+    msg.extend(message.pack_object("room"))
+
+    msg.extend(message.pack_object(num_users, unsignedint=True))
+    for index in range(num_users):
+        msg.extend(message.pack_object("user%i" % index))
+
+    msg.extend(message.pack_object(num_users, unsignedint=True))
+    for _index in range(num_users):
+        msg.extend(message.pack_object(rng.choice((1, 2)), unsignedint=True))
+
+    msg.extend(message.pack_object(num_users, unsignedint=True))
+    for _index in range(num_users):
+        for value in (rng.randint(0, 100000), 0, 0, rng.randint(0, 50000), rng.randint(0, 5000)):
+            msg.extend(message.pack_object(value, unsignedint=True))
+
+    msg.extend(message.pack_object(num_users, unsignedint=True))
+    for _index in range(num_users):
+        msg.extend(message.pack_object(0, unsignedint=True))
+
+    msg.extend(message.pack_object(num_users, unsignedint=True))
+    for _index in range(num_users):
+        msg.extend(message.pack_object(rng.choice(("US", "DE", "FR", "BR"))))
+
+    return bytes(msg)
+
+
+def measure(function, *args):
+    """ Returns the object created by function, and the bytes allocated for it """
+
+    tracemalloc.start()
+    result = function(*args)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return result, size
+
+
+def parse_search_results(payloads):
+
+    results = []
+
+    for payload in payloads:
+        msg = slskmessages.FileSearchResult(None)
+        msg.parse_network_message(payload)
+        results.append(msg)
+
+    return results
+
+
+def parse_join_room(payload):
+
+    msg = slskmessages.JoinRoom()
+    msg.parse_network_message(payload)
+
+    return msg
+
+
+def create_user_addrs(num_users):
+    return {"user%i" % index: UserAddr(status=1) for index in range(num_users)}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark memory used by live protocol objects")
+    parser.add_argument("--results", type=int, default=20000, help="search results kept alive")
+    parser.add_argument("--users", type=int, default=20000, help="users in the room")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    payloads = [generate_search_result(rng, index) for index in range(args.results)]
+    join_room = generate_join_room(rng, args.users)
+
+    results, results_size = measure(parse_search_results, payloads)
+    assert len(results) == args.results
+
+    room, room_size = measure(parse_join_room, join_room)
+    assert len(room.users) == args.users
+
+    users, users_size = measure(create_user_addrs, args.users)
+
+    print_results("Live protocol objects", [
+        ("search results", args.results),
+        ("bytes per result", "%.0f" % (results_size / args.results)),
+        ("room users", args.users),
+        ("bytes per room user", "%.0f" % (room_size / args.users)),
+        ("bytes per user address", "%.0f" % (users_size / args.users))
+    ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of protocol message decoding and encoding. Run from the source folder:
+
+    python3 -m test.benchmark.bench_messages --folders 2000 --files 25 --results 5000 --users 20000
+
+A browse response (SharedFileList), a search response (FileSearchResult) and a room
+user list (JoinRoom) of the given sizes are generated, and parsed a number of times.
+Checksums of the encoded messages are printed, to verify that changes to the codec
+keep producing the same bytes.
+"""
+
+import argparse
+import random
+import time
+import zlib
+
+from pynicotine import slskmessages
+from test.benchmark.bench_memory import generate_join_room
+from test.benchmark.library import WORDS
+from test.benchmark.library import make_name
+from test.benchmark.measure import human_size
+from test.benchmark.measure import print_results
+
+
+def generate_shared_folders(num_folders, num_files, seed=0):
+    """ Returns the folders of a browse response, with their files packed the
+    same way as in the share databases """
+
+    rng = random.Random(seed)
+    message = slskmessages.SlskMessage()
+    folders = {}
+
+    for folder_index in range(num_folders):
+        msg = bytearray()
+        msg.extend(message.pack_object(num_files, unsignedint=True))
+
+        for file_index in range(num_files):
+            msg.extend(bytes([1]))
+            msg.extend(message.pack_object("%02i - %s.mp3" % (file_index, " ".join(rng.sample(WORDS, 3)))))
+            msg.extend(message.pack_object(rng.randint(1000000, 20000000), unsignedlonglong=True))
+            msg.extend(message.pack_object("mp3"))
+            msg.extend(message.pack_object(3, unsignedint=True))
+
+            for attribute, value in enumerate((320, rng.randint(60, 600), 0)):
+                msg.extend(message.pack_object(attribute, unsignedint=True))
+                msg.extend(message.pack_object(value, unsignedint=True))
+
+        folders["Music\\%s\\%s %i" % (make_name(rng), make_name(rng), folder_index)] = bytes(msg)
+
+    return folders
+
+
+def generate_file_index(num_files, seed=0):
+    """ Returns a file index of the given size, as used to respond to searches """
+
+    rng = random.Random(seed)
+    fileindex = {}
+
+    for index in range(num_files):
+        path = "Music\\%s\\%02i - %s.mp3" % (make_name(rng), index % 100, make_name(rng))
+
+        if rng.random() < 0.2:
+            # File without metadata
+            fileindex[repr(index)] = (path, rng.randint(0, 100000), None, None)
+            continue
+
+        bitrate = (rng.choice((128, 192, 256, 320)), rng.choice((0, 1)))
+        fileindex[repr(index)] = (path, rng.randint(1000000, 20000000), bitrate, rng.randint(60, 600))
+
+    return fileindex
+
+
+def create_search_result(fileindex):
+
+    return slskmessages.FileSearchResult(
+        None, user="user", token=1, shares=range(len(fileindex)), fileindex=fileindex,
+        freeulslots=1, ulspeed=100000, inqueue=(0,), numresults=len(fileindex)
+    )
+
+
+def time_function(function, *args, rounds=5):
+    """ Returns the best time out of a number of calls to function, and its result """
+
+    best = None
+
+    for _i in range(rounds):
+        start_time = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start_time
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, result
+
+
+def parse(message_class, payload):
+
+    message = message_class(None)
+    message.parse_network_message(payload)
+
+    return message
+
+
+def time_parse(message_class, payload, rounds):
+    return time_function(parse, message_class, payload, rounds=rounds)
+
+
+def get_checksum(payload, compressed=True):
+    """ Returns a checksum of the contents of an encoded message """
+
+    if compressed:
+        payload = zlib.decompress(payload)
+
+    return "%08x" % zlib.crc32(payload)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark protocol message decoding and encoding")
+    parser.add_argument("--folders", type=int, default=2000, help="folders in the browse response")
+    parser.add_argument("--files", type=int, default=25, help="files per folder in the browse response")
+    parser.add_argument("--results", type=int, default=5000, help="files in the search response")
+    parser.add_argument("--users", type=int, default=20000, help="users in the room user list")
+    parser.add_argument("--rounds", type=int, default=5, help="number of times each message is parsed")
+    args = parser.parse_args()
+
+    # Browse response
+    shares = slskmessages.SharedFileList(None, generate_shared_folders(args.folders, args.files))
+    make_elapsed, payload = time_function(shares.make_network_message, 0, True, rounds=args.rounds)
+    size = len(zlib.decompress(payload))
+    num_files = args.folders * args.files
+
+    elapsed, message = time_parse(slskmessages.SharedFileList, payload, args.rounds)
+    assert sum(len(files) for _folder, files in message.list) == num_files
+
+    print_results("SharedFileList parsing", [
+        ("files", num_files),
+        ("compressed size", human_size(len(payload))),
+        ("decompressed size", human_size(size)),
+        ("best time", "%.3f s" % elapsed),
+        ("files per second", "%.0f" % (num_files / elapsed)),
+        ("throughput", "%s/s" % human_size(size / elapsed)),
+        ("best encoding time", "%.3f s" % make_elapsed),
+        ("checksum", get_checksum(payload))
+    ])
+
+    # Search response
+    result = create_search_result(generate_file_index(args.results))
+    make_elapsed, payload = time_function(result.make_network_message, rounds=args.rounds)
+    size = len(zlib.decompress(payload))
+
+    elapsed, message = time_parse(slskmessages.FileSearchResult, payload, args.rounds)
+    assert len(message.list) == args.results
+
+    print_results("FileSearchResult parsing", [
+        ("files", args.results),
+        ("compressed size", human_size(len(payload))),
+        ("decompressed size", human_size(size)),
+        ("best time", "%.3f s" % elapsed),
+        ("files per second", "%.0f" % (args.results / elapsed)),
+        ("throughput", "%s/s" % human_size(size / elapsed)),
+        ("best encoding time", "%.3f s" % make_elapsed),
+        ("checksum", get_checksum(payload))
+    ])
+
+    # Room user list
+    payload = generate_join_room(random.Random(0), args.users)
+
+    elapsed, message = time_parse(slskmessages.JoinRoom, payload, args.rounds)
+    assert len(message.users) == args.users
+
+    print_results("JoinRoom parsing", [
+        ("users", args.users),
+        ("size", human_size(len(payload))),
+        ("best time", "%.3f s" % elapsed),
+        ("users per second", "%.0f" % (args.users / elapsed)),
+        ("throughput", "%s/s" % human_size(len(payload) / elapsed)),
+        ("checksum", get_checksum(payload, compressed=False))
+    ])
+
+
+if __name__ == '__main__':
+    main()
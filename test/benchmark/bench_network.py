@@ -0,0 +1,213 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Loopback benchmark of the networking engines. Run from the source folder:
+
+    python3 -m test.benchmark.bench_network --messages 100000 --upload-size 64
+
+A peer on the same host sends messages to the engine, receives messages from
+it, and downloads a file from it. The wall time and the CPU time of the process
+are measured for each engine. The peer runs in the same process, and does the
+same work for both engines.
+"""
+
+import argparse
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+from types import SimpleNamespace
+
+from pynicotine import slskmessages
+from pynicotine.asyncproto import AsyncProtoThread
+from pynicotine.slskproto import MessageQueue
+from pynicotine.slskproto import SlskProtoThread
+from test.benchmark.measure import human_size
+from test.benchmark.measure import print_results
+
+ENGINES = (
+    ("thread", SlskProtoThread),
+    ("asyncio", AsyncProtoThread)
+)
+PORT_RANGE = (24100, 24199)
+
+
+class Peer:
+    """ Networking engine with a UI callback that collects what the benchmark waits for """
+
+    def __init__(self, engine_class, upload_file=None):
+
+        self.handle = None
+        self.num_received = 0
+        self.num_expected = None
+        self.connected = threading.Event()
+        self.done = threading.Event()
+        self.upload_file = upload_file
+        self.port = None
+
+        config = SimpleNamespace(sections={
+            "server": {"portrange": PORT_RANGE, "ipblocklist": {}},
+            "transfers": {"downloadlimit": 0}
+        })
+        self.queue = MessageQueue()
+        self.engine = engine_class(self.callback, self.queue, "127.0.0.1", None, config, SimpleNamespace(geoip=None))
+
+    def callback(self, msgs):
+
+        for msg in msgs:
+            msg_class = msg.__class__
+
+            if msg_class is slskmessages.IncPort:
+                self.port = msg.port
+
+            elif msg_class is slskmessages.IncConn:
+                self.handle = msg.conn
+                self.connected.set()
+
+            elif msg_class is slskmessages.UserInfoRequest:
+                self.num_received += 1
+
+                if self.num_received == self.num_expected:
+                    self.done.set()
+
+            elif msg_class is slskmessages.FileRequest:
+                self.queue.put(slskmessages.UploadFile(msg.conn, self.upload_file, os.path.getsize(self.upload_file.name)))
+
+    def connect(self, init_type):
+
+        client = socket.create_connection(("127.0.0.1", self.port))
+        msg = slskmessages.PeerInit(None, "user", init_type, 0).make_network_message()
+        client.sendall(struct.pack("<iB", len(msg) + 1, 1) + msg)
+
+        return client
+
+    def close(self):
+        self.engine.abort()
+        self.engine.join()
+
+
+def recv_exactly(sock, size):
+
+    received = 0
+    buffer = bytearray(1048576)
+
+    while received < size:
+        length = sock.recv_into(buffer, min(len(buffer), size - received))
+
+        if not length:
+            break
+
+        received += length
+
+    return received
+
+
+def measure(function, *args):
+    """ Returns the wall time and the CPU time of the process spent in function """
+
+    start_time = time.perf_counter()
+    start_cpu = time.process_time()
+    function(*args)
+
+    return time.perf_counter() - start_time, time.process_time() - start_cpu
+
+
+def receive_messages(peer, num_messages):
+    """ The engine receives and parses messages from a peer """
+
+    peer.num_expected = num_messages
+    client = peer.connect("P")
+    payload = struct.pack("<ii", 4, peer.engine.peercodes[slskmessages.UserInfoRequest]) * num_messages
+
+    client.sendall(payload)
+    peer.done.wait()
+    client.close()
+
+
+def send_messages(peer, num_messages):
+    """ The engine packs and sends messages queued by the UI to a peer """
+
+    client = peer.connect("P")
+    peer.connected.wait()
+
+    for _index in range(num_messages):
+        peer.queue.put(slskmessages.UserInfoRequest(peer.handle))
+
+    recv_exactly(client, 8 * num_messages)
+    client.close()
+
+
+def upload_file(peer, size):
+    """ The engine uploads a file to a peer """
+
+    client = peer.connect("F")
+    client.sendall(struct.pack("<iQ", 1, 0))
+
+    recv_exactly(client, size)
+    client.close()
+
+
+def run_engine(engine_class, function, *args, upload_file=None):
+
+    peer = Peer(engine_class, upload_file)
+
+    try:
+        return measure(function, peer, *args)
+    finally:
+        peer.close()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark the networking engines over loopback")
+    parser.add_argument("--messages", type=int, default=100000, help="messages sent in each direction")
+    parser.add_argument("--upload-size", type=int, default=64, help="size of the uploaded file in MiB")
+    args = parser.parse_args()
+
+    upload_size = args.upload_size * 1048576
+
+    with tempfile.NamedTemporaryFile() as file_handle:
+        file_handle.write(os.urandom(1048576) * args.upload_size)
+        file_handle.flush()
+
+        for name, engine_class in ENGINES:
+            results = []
+
+            wall_time, cpu_time = run_engine(engine_class, receive_messages, args.messages)
+            results.append(("receive messages/s", "%.0f" % (args.messages / wall_time)))
+            results.append(("receive CPU time", "%.3f s" % cpu_time))
+
+            wall_time, cpu_time = run_engine(engine_class, send_messages, args.messages)
+            results.append(("send messages/s", "%.0f" % (args.messages / wall_time)))
+            results.append(("send CPU time", "%.3f s" % cpu_time))
+
+            with open(file_handle.name, "rb") as upload:
+                wall_time, cpu_time = run_engine(engine_class, upload_file, upload_size, upload_file=upload)
+
+            results.append(("upload speed", "%s/s" % human_size(upload_size / wall_time)))
+            results.append(("upload CPU time", "%.3f s" % cpu_time))
+
+            print_results("%s engine" % name, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of search responses. Search terms are replayed through
+Shares.process_search_request, and the resulting FileSearchResult messages are
+built. Run from the source folder:
+
+    python3 -m test.benchmark.bench_search --queries 10000
+
+Searches are answered from a synthetic library, or from the shares of an existing
+data folder with --data-dir. Search terms are generated, or read from a file with
+--query-file, one search term per line.
+"""
+
+import argparse
+import os
+import queue
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from pynicotine.config import Config
+from pynicotine.shares import Shares
+from test.benchmark.library import WORDS
+from test.benchmark.library import generate_library
+from test.benchmark.measure import get_percentile
+from test.benchmark.measure import human_size
+from test.benchmark.measure import print_results
+
+
+class Transfers:
+
+    def get_upload_queue_sizes(self):
+        return 0, 0
+
+    def allow_new_uploads(self):
+        return True
+
+
+class NetworkEventProcessor:
+    """ Stands in for the network event processor, and builds the messages that
+    would be sent to peers """
+
+    def __init__(self):
+        self.transfers = Transfers()
+        self.speed = 0
+        self.num_results = 0
+        self.num_bytes = 0
+        self.count_blocks = False
+        self.num_blocks = 0  # Traced memory blocks in use once the last response was built
+
+    def check_user(self, user, addr):
+        return 1, ""
+
+    def process_request_to_peer(self, user, message):
+
+        data = message.make_network_message()
+
+        if self.count_blocks:
+            self.num_blocks = max(self.num_blocks, count_traced_blocks())
+
+        self.num_results += 1
+        self.num_bytes += len(data)
+
+
+def count_traced_blocks():
+    """ Returns the number of memory blocks allocated since tracing started and still in use """
+    return sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+
+
+def generate_queries(num_queries, seed=0):
+    """ Generate search terms from the library vocabulary, with some common file
+    extensions, excluded words and words we don't share """
+
+    rng = random.Random(seed)
+    extra_words = ("mp3", "ogg", "flac", "-live", "-remix", "unknownword", "zzz")
+    queries = []
+
+    for _i in range(num_queries):
+        words = [rng.choice(WORDS) for _j in range(rng.randint(1, 3))]
+
+        if rng.random() < 0.3:
+            words.append(rng.choice(extra_words))
+
+        queries.append(" ".join(words))
+
+    return queries
+
+
+def replay(shares, queries):
+    """ Returns the latency of each search request """
+
+    latencies = []
+
+    for searchid, searchterm in enumerate(queries):
+        start_time = time.perf_counter()
+        shares.process_search_request(searchterm, "benchuser", searchid)
+        latencies.append(time.perf_counter() - start_time)
+
+    return latencies
+
+
+def measure_allocations(shares, queries):
+    """ Returns the average and maximum amount of memory allocated at once while
+    answering a search request, and the average and maximum number of memory blocks
+    allocated for it. Blocks are counted once the response is built, since blocks
+    freed before that can't be seen in a snapshot. Tracing memory allocations is
+    slow, so this is done separately from measuring latency. """
+
+    if not hasattr(tracemalloc, "reset_peak"):
+        # Python 3.9 or newer is required
+        return None, None, None, None
+
+    np = shares.np
+    np.count_blocks = True
+    tracemalloc.start()
+    total_memory = 0
+    max_memory = 0
+    total_blocks = 0
+    max_blocks = 0
+
+    for searchid, searchterm in enumerate(queries):
+        blocks_before = np.num_blocks = count_traced_blocks()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+        shares.process_search_request(searchterm, "benchuser", searchid)
+
+        memory = tracemalloc.get_traced_memory()[1] - memory_before
+        total_memory += memory
+        max_memory = max(max_memory, memory)
+
+        blocks = max(np.num_blocks, count_traced_blocks()) - blocks_before
+        total_blocks += blocks
+        max_blocks = max(max_blocks, blocks)
+
+    tracemalloc.stop()
+    np.count_blocks = False
+
+    num_queries = max(1, len(queries))
+    return total_memory / num_queries, max_memory, total_blocks / num_queries, max_blocks
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark search responses")
+    parser.add_argument("--data-dir", help="answer searches from the shares of an existing data folder")
+    parser.add_argument("--query-file", help="file containing one search term per line")
+    parser.add_argument("--queries", type=int, default=5000, help="number of generated search terms")
+    parser.add_argument("--maxresults", type=int, default=50, help="maximum number of results per search")
+    parser.add_argument("--depth", type=int, default=3, help="depth of the synthetic library")
+    parser.add_argument("--folders", type=int, default=6, help="subfolders per folder in the synthetic library")
+    parser.add_argument("--files", type=int, default=15, help="files per folder in the synthetic library")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the library and search term generators")
+    args = parser.parse_args()
+
+    work_dir = None
+    data_dir = args.data_dir
+
+    try:
+        if data_dir is None:
+            work_dir = tempfile.mkdtemp(prefix="nicotine-bench-")
+            library_dir = os.path.join(work_dir, "library")
+            data_dir = os.path.join(work_dir, "data")
+            os.makedirs(data_dir)
+
+            generate_library(library_dir, depth=args.depth, folders_per_folder=args.folders,
+                             files_per_folder=args.files, seed=args.seed)
+
+        config = Config(os.path.join(data_dir, "config"), data_dir)
+        config.sections["searches"]["maxresults"] = args.maxresults
+
+        np = NetworkEventProcessor()
+        shares = Shares(np, config, queue.Queue(0))
+
+        if work_dir is not None:
+            config.sections["transfers"]["shared"] = [("Library", library_dir)]
+            shares.rescan_shares()
+
+        if args.query_file:
+            with open(args.query_file, encoding="utf-8") as file_handle:
+                queries = [line.strip() for line in file_handle if line.strip()]
+        else:
+            queries = generate_queries(args.queries, args.seed)
+
+        # Warm up caches before measuring
+        replay(shares, queries[:100])
+        np.num_results = np.num_bytes = 0
+
+        start_time = time.perf_counter()
+        latencies = replay(shares, queries)
+        elapsed = time.perf_counter() - start_time
+
+        latencies.sort()
+        num_results = np.num_results
+        num_bytes = np.num_bytes
+
+        average_memory, max_memory, average_blocks, max_blocks = measure_allocations(shares, queries)
+
+        print_results("Search responses", [
+            ("search terms", len(queries)),
+            ("responses", num_results),
+            ("response size", human_size(num_bytes)),
+            ("queries per second", "%.0f" % (len(queries) / elapsed if elapsed else 0)),
+            ("p50 latency", "%.3f ms" % (get_percentile(latencies, 50) * 1000)),
+            ("p99 latency", "%.3f ms" % (get_percentile(latencies, 99) * 1000)),
+            ("max latency", "%.3f ms" % (latencies[-1] * 1000 if latencies else 0)),
+            ("memory per query", human_size(average_memory)),
+            ("max memory per query", human_size(max_memory)),
+            ("blocks per query", "unknown" if average_blocks is None else "%.0f" % average_blocks),
+            ("max blocks per query", "unknown" if max_blocks is None else max_blocks)
+        ])
+
+        shares.close_shares()
+
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
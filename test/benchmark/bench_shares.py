@@ -0,0 +1,127 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of share scans on a synthetic library. Run from the source folder:
+
+    python3 -m test.benchmark.bench_shares --depth 3 --folders 6 --files 20
+
+A full scan, an unchanged incremental rescan, an incremental rescan after
+modifying some folders, and a rebuild are timed in turn.
+"""
+
+import argparse
+import os
+import queue
+import shutil
+import tempfile
+import time
+
+from pynicotine.config import Config
+from pynicotine.shares import Shares
+from test.benchmark.library import generate_library
+from test.benchmark.library import modify_library
+from test.benchmark.measure import get_dir_size
+from test.benchmark.measure import get_peak_rss
+from test.benchmark.measure import human_size
+from test.benchmark.measure import print_results
+
+
+def count_files(path):
+    return sum(len(files) for _root, _dirs, files in os.walk(path))
+
+
+def wait_for_compression(shares):
+    """ Shares are compressed for browsing in a separate thread, wait for it """
+
+    while shares.compressed_shares_normal.built is None:
+        time.sleep(0.01)
+
+
+def time_scan(shares, title, num_files, data_dir, rebuild=False):
+
+    start_time = time.time()
+    shares.rescan_shares(rebuild)
+    elapsed = time.time() - start_time
+
+    wait_for_compression(shares)
+    compression_elapsed = time.time() - start_time - elapsed
+
+    print_results(title, [
+        ("time", "%.2f s" % elapsed),
+        ("compression time", "%.2f s" % compression_elapsed),
+        ("files per second", "%.0f" % (num_files / elapsed if elapsed else 0)),
+        ("peak RSS", human_size(get_peak_rss())),
+        ("database size", human_size(get_dir_size(data_dir)))
+    ])
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark share scans on a synthetic library")
+    parser.add_argument("--depth", type=int, default=3, help="depth of the folder tree")
+    parser.add_argument("--folders", type=int, default=4, help="subfolders per folder")
+    parser.add_argument("--files", type=int, default=10, help="files per folder")
+    parser.add_argument("--tagged", type=float, default=0.8, help="share of tagged audio files, between 0 and 1")
+    parser.add_argument("--modified", type=float, default=0.1, help="share of folders modified before the incremental rescan")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the library generator")
+    parser.add_argument("--keep", action="store_true", help="keep the generated library and databases")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="nicotine-bench-")
+    library_dir = os.path.join(work_dir, "library")
+    data_dir = os.path.join(work_dir, "data")
+    os.makedirs(data_dir)
+
+    try:
+        start_time = time.time()
+        folders = generate_library(
+            library_dir, depth=args.depth, folders_per_folder=args.folders,
+            files_per_folder=args.files, tagged_ratio=args.tagged, seed=args.seed
+        )
+        num_files = count_files(library_dir)
+
+        print_results("Library", [
+            ("folders", len(folders)),
+            ("files", num_files),
+            ("generated in", "%.2f s" % (time.time() - start_time)),
+            ("location", work_dir)
+        ])
+
+        config = Config(os.path.join(data_dir, "config"), data_dir)
+        config.sections["transfers"]["shared"] = [("Library", library_dir)]
+
+        shares = Shares(None, config, queue.Queue(0))
+
+        time_scan(shares, "Full scan", num_files, data_dir)
+        time_scan(shares, "Incremental rescan, no changes", num_files, data_dir)
+
+        modify_library(folders, ratio=args.modified, seed=args.seed + 1)
+        time_scan(shares, "Incremental rescan, %i%% of folders modified" % (args.modified * 100), num_files, data_dir)
+
+        time_scan(shares, "Rebuild", num_files, data_dir, rebuild=True)
+
+        shares.close_shares()
+
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
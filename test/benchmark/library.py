@@ -0,0 +1,108 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Generator for synthetic share trees, used by the benchmarks.
+"""
+
+import os
+import random
+import shutil
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "unit", "shares", "sharedfiles")
+TAGGED_TEMPLATES = (
+    os.path.join(TEMPLATES_DIR, "nicotinetestdata.mp3"),
+    os.path.join(TEMPLATES_DIR, "nicotinetestdata.ogg")
+)
+UNTAGGED_EXTENSIONS = ("jpg", "txt", "nfo", "cue", "log", "pdf")
+
+WORDS = (
+    "the", "a", "of", "and", "live", "remastered", "edition", "deluxe", "complete", "discography",
+    "best", "greatest", "hits", "vol", "disc", "session", "demo", "mix", "remix", "instrumental",
+    "acoustic", "version", "original", "soundtrack", "night", "day", "love", "blue", "black", "white",
+    "red", "summer", "winter", "city", "river", "moon", "sun", "dream", "fire", "ocean",
+    "gwen", "auto", "radio", "orchestra", "quartet", "symphony", "concerto", "sonata", "jazz", "blues"
+)
+
+
+def make_name(rng, min_words=1, max_words=4):
+    return " ".join(rng.choice(WORDS) for _i in range(rng.randint(min_words, max_words))).title()
+
+
+def add_file(folder, rng, tagged_ratio, index):
+    """ Add a tagged audio file, or an untagged file, to a folder """
+
+    if rng.random() < tagged_ratio:
+        template = rng.choice(TAGGED_TEMPLATES)
+        extension = os.path.splitext(template)[1]
+        path = os.path.join(folder, "%02i - %s%s" % (index, make_name(rng), extension))
+
+        # Link tagged files to the templates to save disk space
+        try:
+            os.link(template, path)
+        except OSError:
+            shutil.copyfile(template, path)
+
+        return path
+
+    path = os.path.join(folder, "%s %02i.%s" % (make_name(rng), index, rng.choice(UNTAGGED_EXTENSIONS)))
+
+    with open(path, "wb") as file_handle:
+        file_handle.write(os.urandom(rng.randint(0, 4096)))
+
+    return path
+
+
+def generate_library(path, depth=3, folders_per_folder=4, files_per_folder=10, tagged_ratio=0.8, seed=0):
+    """ Create a share tree at path. Every folder up to the given depth contains
+    folders_per_folder subfolders, and each folder contains files_per_folder files.
+    tagged_ratio is the share of tagged audio files among them. Returns the list of
+    folders that were created. """
+
+    rng = random.Random(seed)
+    folders = []
+    parents = [path]
+
+    for _level in range(depth):
+        children = []
+
+        for parent in parents:
+            for index in range(folders_per_folder):
+                folder = os.path.join(parent, "%s %i" % (make_name(rng), index))
+                os.makedirs(folder)
+                children.append(folder)
+
+                for file_index in range(files_per_folder):
+                    add_file(folder, rng, tagged_ratio, file_index)
+
+        folders += children
+        parents = children
+
+    return folders
+
+
+def modify_library(folders, ratio=0.1, seed=1):
+    """ Add a file to a share of the folders, to simulate changes between two scans """
+
+    rng = random.Random(seed)
+    modified = rng.sample(folders, int(len(folders) * ratio))
+
+    for folder in modified:
+        add_file(folder, rng, 1, 99)
+
+    return modified
@@ -0,0 +1,88 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Helpers to measure and report benchmark results.
+"""
+
+import os
+import sys
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+def get_peak_rss():
+    """ Returns the peak resident set size of the process in bytes, or None if unknown """
+
+    if resource is None:
+        return None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if sys.platform == "darwin":
+        return peak_rss
+
+    return peak_rss * 1024
+
+
+def get_dir_size(path):
+    """ Returns the total size of the files in a folder """
+
+    size = 0
+
+    for entry in os.scandir(path):
+        if entry.is_file():
+            size += entry.stat().st_size
+
+    return size
+
+
+def get_percentile(values, percentile):
+    """ Returns the given percentile of a list of sorted values """
+
+    if not values:
+        return 0
+
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+def human_size(size):
+
+    if size is None:
+        return "unknown"
+
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return "%.1f %s" % (size, unit)
+
+        size /= 1024
+
+    return "%.1f GiB" % size
+
+
+def print_results(title, results):
+    """ Print a table of results, one (name, value) pair per row """
+
+    print(title)
+
+    for name, value in results:
+        print("  %-24s %s" % (name, value))
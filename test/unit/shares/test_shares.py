@@ -17,10 +17,17 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import pickle
 import queue
+import shelve
+
+import pytest
 
 from time import sleep
+from time import time
 
+from pynicotine.shares import ScanCancelled
+from pynicotine.shares import ScanThrottle
 from pynicotine.shares import Shares
 from pynicotine.config import Config
 
@@ -77,3 +84,128 @@ def test_shares_add_downloaded():
 
     assert ('nicotinetestdata.mp3', 80919, (128, 0), 5) in list(config.sections["transfers"]["sharedfiles"].values())[0]
     assert ('Downloaded\\nicotinetestdata.mp3', 80919, (128, 0), 5) in config.sections["transfers"]["fileindex"].values()
+
+
+def test_scan_throttle():
+    """ Test that background scans are limited to the configured number of files per second """
+
+    config = Config("temp_config", DB_DIR)
+    config.sections["transfers"]["rescanthrottle"] = True
+    config.sections["transfers"]["rescanfilespersecond"] = 100
+
+    throttle = ScanThrottle(None, config)
+    start_time = time()
+
+    for _i in range(5):
+        throttle.file_scanned()
+
+    assert time() - start_time >= 0.04
+    assert throttle.num_files == 5
+    assert 0 < throttle.get_rate() <= 125
+
+
+def test_scan_throttle_cancelled():
+    """ Test that the throttle stops waiting once the scan is cancelled """
+
+    config = Config("temp_config", DB_DIR)
+    config.sections["transfers"]["rescanthrottle"] = True
+    config.sections["transfers"]["rescanfilespersecond"] = 1
+
+    shares = Shares(None, config, queue.Queue(0))
+    throttle = ScanThrottle(None, config, shares.scan_cancelled)
+    start_time = time()
+
+    shares.cancel_scans()
+
+    for _i in range(5):
+        throttle.file_scanned()
+
+    assert time() - start_time < 1
+
+
+def test_shares_scan_resume():
+    """ Test that cancelled scans resume from their checkpoint """
+
+    config = Config("temp_config", DB_DIR)
+    config.sections["transfers"]["shared"] = [("Shares", SHARES_DIR)]
+
+    shares = Shares(None, config, queue.Queue(0))
+    mtimes = {SHARES_DIR: os.stat(SHARES_DIR).st_mtime}
+    checkpoint_path = shares.get_checkpoint_path("normal")
+
+    shares.cancel_scans()
+
+    with pytest.raises(ScanCancelled):
+        shares.get_files_list("normal", mtimes, {}, {}, {})
+
+    # Pretend an earlier scan was interrupted after scanning our folder
+    checkpoint = shelve.open(checkpoint_path, protocol=pickle.HIGHEST_PROTOCOL)
+    checkpoint[SHARES_DIR] = (mtimes[SHARES_DIR], "Shares", [("checkpoint_file", 1, None, None)], b"")
+    checkpoint.close()
+
+    shares.scan_cancelled.clear()
+    files, _streams = shares.get_files_list("normal", mtimes, {}, {}, {})
+
+    assert files == {"Shares": [("checkpoint_file", 1, None, None)]}
+
+    # Rebuilding the shares reads every folder again
+    files, _streams = shares.get_files_list("normal", mtimes, {}, {}, {}, rebuild=True)
+
+    assert ("checkpoint_file", 1, None, None) not in files["Shares"]
+    assert ("dummy_file", 0, None, None) in files["Shares"]
+
+    shares.remove_checkpoint("normal")
+
+
+def test_shares_legacy_word_index(tmpdir):
+    """ Word indexes stored in shelves by older versions are removed, and the shares
+    are cleared, so that they're rescanned """
+
+    data_dir = str(tmpdir)
+    legacy_file = os.path.join(data_dir, "wordindex.db.dat")
+
+    with open(legacy_file, "wb") as file_handle:
+        file_handle.write(b"old")
+
+    config = Config("temp_config", data_dir)
+    Shares(None, config, queue.Queue(0))
+
+    assert not os.path.exists(legacy_file)
+    assert os.path.exists(os.path.join(data_dir, "wordindex.idx"))
+    assert len(config.sections["transfers"]["wordindex"]) == 0
+
+
+def test_shares_stale_word_index(tmpdir, monkeypatch):
+    """ Shares are cleared if files were added to the file index, but the word index
+    wasn't saved afterwards """
+
+    # Shares are compressed in a thread, which would read the databases after we close them
+    monkeypatch.setattr(Shares, "compress_shares", lambda self, sharestype: None)
+    data_dir = str(tmpdir)
+    config = Config("temp_config", data_dir)
+    shares = Shares(None, config, queue.Queue(0))
+    transfers = config.sections["transfers"]
+
+    shares.add_file_to_index(0, "song.mp3", "Shares", ("song.mp3", 100, None, None),
+                             transfers["wordindex"], transfers["fileindex"])
+    shares.close_shares()
+
+    config = Config("temp_config", data_dir)
+    shares = Shares(None, config, queue.Queue(0))
+    transfers = config.sections["transfers"]
+
+    assert transfers["wordindex"].get_num_files() == len(transfers["fileindex"]) == 1
+
+    # Exit without saving the word index, as if we crashed
+    shares.add_file_to_index(1, "other song.mp3", "Shares", ("other song.mp3", 100, None, None),
+                             transfers["wordindex"], transfers["fileindex"])
+
+    for db in ("sharedfiles", "sharedfilesstreams", "fileindex", "sharedmtimes",
+               "bsharedfiles", "bsharedfilesstreams", "bfileindex", "bsharedmtimes"):
+        transfers[db].close()
+
+    config = Config("temp_config", data_dir)
+    Shares(None, config, queue.Queue(0))
+    transfers = config.sections["transfers"]
+
+    assert transfers["wordindex"].get_num_files() == len(transfers["fileindex"]) == 0
@@ -0,0 +1,294 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import io
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+from unittest.mock import MagicMock, Mock
+
+import pytest
+
+from pynicotine.asyncproto import AsyncProtoThread
+from pynicotine.slskmessages import ConnClose, DownloadFile, FileError, FileRequest, IncConn, OutConn
+from pynicotine.slskmessages import PeerInit, UploadFile, UserInfoRequest
+from pynicotine.slskproto import MessageQueue
+
+TIMEOUT = 5
+
+
+@pytest.fixture
+def config():
+    config = MagicMock()
+    config.sections = {
+        'server': {'portrange': (1, 2), 'ipblocklist': {}},
+        'transfers': {
+            'downloadlimit': 0, 'preallocate': False, 'downloadbuffersize': 1024,
+            'downloadfsync': False, 'downloadwriterthread': False
+        }
+    }
+    return config
+
+
+@pytest.fixture
+def engine(config, monkeypatch):
+    """ Engine that isn't started, its event loop is run by the tests """
+
+    monkeypatch.setattr(AsyncProtoThread, 'start', lambda self: None)
+    proto = AsyncProtoThread(
+        ui_callback=Mock(), queue=MessageQueue(), bindip='127.0.0.1',
+        port=get_free_port(), config=config, eventprocessor=Mock()
+    )
+
+    yield proto
+
+    proto.close_all()
+    proto._p.close()
+
+
+@pytest.fixture
+def peer(engine):
+    """ Outgoing file transfer connection of the engine to a peer. Returns the
+    protocol of the connection, and the socket of the peer. """
+
+    with socket.socket() as listen_socket:
+        listen_socket.bind(('127.0.0.1', 0))
+        listen_socket.listen(1)
+
+        engine._queue.put(OutConn(None, listen_socket.getsockname(), PeerInit(None, 'user', 'F', 0)))
+        run_until(engine, lambda: engine._conns)
+
+        peer_socket, _addr = listen_socket.accept()
+
+    protocol = next(iter(engine._conns))
+    engine._queue.put(FileRequest(protocol, 1))
+    run_until(engine, lambda: engine._conns[protocol].filereq is not None)
+
+    assert peer_socket.recv(4) == struct.pack("<i", 1)
+
+    yield protocol, peer_socket
+
+    peer_socket.close()
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_until(engine, condition):
+    """ Runs the event loop of the engine until condition() returns True """
+
+    async def wait():
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    engine._loop.run_until_complete(asyncio.wait_for(wait(), TIMEOUT))
+
+
+def receive_all(engine, sock, size):
+    """ Runs the event loop of the engine until size bytes are received by sock """
+
+    data = bytearray()
+    sock.setblocking(False)
+
+    def received():
+        try:
+            data.extend(sock.recv(65536))
+        except BlockingIOError:
+            pass
+
+        return len(data) >= size
+
+    run_until(engine, received)
+    return bytes(data)
+
+
+def test_peer_messages(config) -> None:
+    """ Messages are received from and sent to a peer over loopback """
+
+    msgs = []
+    received = threading.Event()
+
+    def ui_callback(new_msgs):
+        msgs.extend(new_msgs)
+
+        if any(msg.__class__ in (UserInfoRequest, ConnClose) for msg in new_msgs):
+            received.set()
+
+    port = get_free_port()
+    queue = MessageQueue()
+    proto = AsyncProtoThread(
+        ui_callback=ui_callback, queue=queue, bindip='127.0.0.1',
+        port=port, config=config, eventprocessor=Mock()
+    )
+
+    try:
+        peer = socket.create_connection(('127.0.0.1', port), timeout=TIMEOUT)
+        init = PeerInit(None, 'user', 'P', 0).make_network_message()
+        peer.sendall(struct.pack("<iB", len(init) + 1, 1) + init + struct.pack("<ii", 4, 15))
+
+        assert received.wait(TIMEOUT)
+        received.clear()
+
+        handle = next(msg.conn for msg in msgs if msg.__class__ is IncConn)
+        peer_init, user_info_request = [msg for msg in msgs if msg.__class__ in (PeerInit, UserInfoRequest)]
+
+        assert peer_init.user == 'user'
+        assert user_info_request.conn.conn is handle
+
+        queue.put(UserInfoRequest(handle))
+        assert peer.recv(8) == struct.pack("<ii", 4, 15)
+
+        peer.close()
+        assert received.wait(TIMEOUT)
+        assert msgs[-1].__class__ is ConnClose
+        assert not proto.socket_still_active(handle)
+
+    finally:
+        proto.abort()
+        proto.join(TIMEOUT)
+
+    assert not proto.is_alive()
+
+
+def test_outgoing_connection(engine, peer) -> None:
+    """ Outgoing connections are wrapped in a transport once they're established """
+
+    protocol, _peer_socket = peer
+    msgs = [msg for msg in engine._ui_callback.call_args_list if msg[0][0][0].__class__ is OutConn]
+
+    assert msgs[0][0][0][0].conn is protocol
+    assert engine._conns[protocol].init.type == 'F'
+    assert engine._connsinprogress == {}
+
+
+@pytest.mark.parametrize("file_type", ["file", "bytes"])
+def test_upload_sendfile(engine, peer, monkeypatch, file_type) -> None:
+    """ Uploads are sent with sendfile, or read from the file if it doesn't
+    support sendfile """
+
+    protocol, peer_socket = peer
+    data = bytes(range(256)) * 1024
+    loop_sendfile = Mock(wraps=engine._loop.sendfile)
+    monkeypatch.setattr(engine._loop, 'sendfile', loop_sendfile)
+
+    with tempfile.TemporaryFile() as file_handle:
+        file_handle.write(data)
+        file_handle.flush()
+        file_obj = file_handle if file_type == "file" else io.BytesIO(data)
+
+        engine._queue.put(UploadFile(protocol, file_obj, len(data)))
+        run_until(engine, lambda: engine._conns[protocol].fileupl is not None)
+
+        # The peer sends the offset to start the upload from
+        peer_socket.sendall(struct.pack("<Q", 1000))
+
+        assert receive_all(engine, peer_socket, len(data) - 1000) == data[1000:]
+
+        upload = engine._conns[protocol].fileupl
+        assert upload.sentbytes == len(data) - 1000
+        assert loop_sendfile.call_count > 0
+        assert engine._conns[protocol].sendfile == (file_type == "file")
+
+
+def test_upload_file_truncated(engine, peer) -> None:
+    """ Uploads of files that are shorter than their size are stopped """
+
+    protocol, peer_socket = peer
+    data = b"a" * 1000
+
+    with tempfile.TemporaryFile() as file_handle:
+        file_handle.write(data)
+        file_handle.flush()
+
+        engine._queue.put(UploadFile(protocol, file_handle, 2000))
+        run_until(engine, lambda: engine._conns[protocol].fileupl is not None)
+        peer_socket.sendall(struct.pack("<Q", 0))
+
+        assert receive_all(engine, peer_socket, len(data)) == data
+        run_until(engine, lambda: engine._conns[protocol].fileupl is None)
+
+    assert engine._ui_callback.call_args[0][0][0].__class__ is FileError
+
+
+def test_download_speed_limit(engine, peer, monkeypatch) -> None:
+    """ Speed limited downloads stop reading once they've used their limit, and
+    continue once their token bucket is refilled """
+
+    protocol, peer_socket = peer
+    data = b"a" * 61440
+    wait_for_limiter = Mock(wraps=engine.wait_for_limiter)
+    monkeypatch.setattr(engine, 'wait_for_limiter', wait_for_limiter)
+
+    # 100 KiB/s, with a burst of 20 KiB
+    engine.set_download_limit(100)
+
+    with tempfile.TemporaryFile() as file_handle:
+        engine._queue.put(DownloadFile(protocol, 0, file_handle, len(data)))
+        run_until(engine, lambda: engine._conns[protocol].filedown is not None)
+
+        assert engine._conns[protocol].limiter is not None
+        assert peer_socket.recv(12) == struct.pack("<Qi", 0, 0)
+
+        start_time = time.monotonic()
+        peer_socket.sendall(data)
+        run_until(engine, lambda: engine._conns[protocol].filereadbytes == len(data))
+
+        assert time.monotonic() - start_time >= 0.3
+        assert wait_for_limiter.call_count > 0
+
+        file_handle.seek(0)
+        assert file_handle.read() == data
+
+
+@pytest.mark.parametrize("closed_by", ["peer", "timeout"])
+def test_download_closed(engine, peer, config, closed_by) -> None:
+    """ The UI is told that a download connection closed once the data of the
+    download is written by the writer thread """
+
+    protocol, peer_socket = peer
+    config.sections['transfers']['downloadwriterthread'] = True
+    positions = []
+
+    with tempfile.TemporaryFile() as file_handle:
+        engine._queue.put(DownloadFile(protocol, 0, file_handle, 10000))
+        run_until(engine, lambda: engine._conns[protocol].filedown is not None)
+
+        assert peer_socket.recv(12) == struct.pack("<Qi", 0, 0)
+        peer_socket.sendall(b"a" * 3000)
+        run_until(engine, lambda: engine._conns[protocol].filereadbytes == 3000)
+
+        # Keep the writer thread busy, so the write is still pending
+        engine._download_write_pool.submit(time.sleep, 0.2)
+        engine._ui_callback.side_effect = lambda msgs: positions.append((msgs[0].__class__, file_handle.tell()))
+
+        if closed_by == "peer":
+            peer_socket.close()
+        else:
+            engine._conns[protocol].lastactive = 0
+            engine.check_connections()
+
+        run_until(engine, lambda: protocol not in engine._conns)
+
+    assert (ConnClose, 3000) in positions
@@ -0,0 +1,99 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from pynicotine.config import Config
+from pynicotine.iplist import IPList
+
+
+def test_ip_list_patterns():
+    """ Addresses, wildcard patterns and CIDR ranges are matched """
+
+    ip_list = IPList({
+        "1.2.3.4": "user",
+        "10.0.*.*": "",
+        "192.168.0.0/16": "",
+        "5.*.7.8": "",
+        "not an address": ""
+    })
+
+    assert "1.2.3.4" in ip_list
+    assert "1.2.3.5" not in ip_list
+
+    assert "10.0.0.1" in ip_list
+    assert "10.0.255.255" in ip_list
+    assert "10.1.0.0" not in ip_list
+
+    assert "192.168.10.20" in ip_list
+    assert "192.169.0.0" not in ip_list
+
+    assert "5.6.7.8" in ip_list
+    assert "5.6.7.9" not in ip_list
+
+    assert "" not in ip_list
+    assert "1.2.3" not in ip_list
+
+
+def test_ip_list_merged_ranges():
+    """ Overlapping and adjacent ranges are merged """
+
+    ip_list = IPList(["10.0.0.0/24", "10.0.0.*", "10.0.1.*", "10.0.0.5", "20.0.0.1"])
+
+    assert ip_list.starts == [0x0A000000, 0x14000001]
+    assert ip_list.ends == [0x0A0001FF, 0x14000001]
+    assert "10.0.1.200" in ip_list
+    assert "10.0.2.0" not in ip_list
+
+
+def test_ip_list_update(tmpdir):
+    """ The list is compiled again when the config list changes """
+
+    ips = {"1.1.1.1": ""}
+    ip_list = IPList()
+    ip_list.update(ips)
+    revision = ip_list.revision
+
+    ip_list.update(ips)
+    assert ip_list.revision == revision
+    assert "2.2.2.2" not in ip_list
+
+    ips["2.2.2.2"] = ""
+    ip_list.update(ips)
+    assert ip_list.revision == revision + 1
+    assert "2.2.2.2" in ip_list
+
+    ip_list.update({"1.1.1.1": "", "2.2.2.2": ""})
+    assert ip_list.revision == revision + 2
+
+    # An address swapped for another one is noticed once the config is written
+    config = Config(os.path.join(str(tmpdir), "config"), str(tmpdir))
+    ips = config.sections["server"]["ipblocklist"]
+    ips["1.1.1.1"] = ""
+
+    ip_list = IPList()
+    ip_list.update(ips, config.revision)
+    assert "1.1.1.1" in ip_list
+
+    del ips["1.1.1.1"]
+    ips["2.2.2.2"] = ""
+    config.write_configuration()
+    ip_list.update(ips, config.revision)
+
+    assert "1.1.1.1" not in ip_list
+    assert "2.2.2.2" in ip_list
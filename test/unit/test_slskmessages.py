@@ -16,18 +16,29 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
+import os
+import pickle
+import random
+import struct
 import unittest
+import zlib
 
+from pynicotine import slskmessages
 from pynicotine.slskmessages import AckNotifyPrivileges
 from pynicotine.slskmessages import AddUser
 from pynicotine.slskmessages import ChangePassword
+from pynicotine.slskmessages import FileSearchResult
+from pynicotine.slskmessages import FolderContentsResponse
 from pynicotine.slskmessages import GetPeerAddress
+from pynicotine.slskmessages import GlobalUserList
 from pynicotine.slskmessages import GetUserStatus
 from pynicotine.slskmessages import JoinPublicRoom
 from pynicotine.slskmessages import JoinRoom
 from pynicotine.slskmessages import LeavePublicRoom
 from pynicotine.slskmessages import Login
 from pynicotine.slskmessages import NotifyPrivileges
+from pynicotine.slskmessages import PeerInit
 from pynicotine.slskmessages import PrivateRoomAddUser
 from pynicotine.slskmessages import PrivateRoomDismember
 from pynicotine.slskmessages import PrivateRoomDisown
@@ -37,7 +48,14 @@ from pynicotine.slskmessages import RemoveUser
 from pynicotine.slskmessages import SayChatroom
 from pynicotine.slskmessages import SetStatus
 from pynicotine.slskmessages import SetWaitPort
+from pynicotine.slskmessages import SharedFileList
 from pynicotine.slskmessages import SlskMessage
+from pynicotine.slskmessages import build_message_maker
+from pynicotine.slskmessages import build_message_parser
+from pynicotine.slskmessages import message_fields
+
+# Messages encoded by the hand-written codec that preceded the field declarations
+LEGACY_FIELDS_DATAFILE = os.path.join(os.path.dirname(__file__), "data", "messages", "legacy_fields.json")
 
 
 class SlskMessageTest(unittest.TestCase):
@@ -60,6 +78,51 @@ class SlskMessageTest(unittest.TestCase):
         self.assertEqual(b'\t\x00\x00\x00testbytes', bytes_message)
 
 
+class SlskMessageReaderTest(unittest.TestCase):
+    def test_get_integers(self):
+        # Arrange
+        obj = SlskMessage()
+        message = b'{\x00\x00\x00\xff\xff\xff\xff\x01\x00\x00\x00\x00\x00\x00\x00\x02\x00\x00\x00'
+
+        # Act / Assert
+        self.assertEqual((4, 123), obj.get_uint32(message))
+        self.assertEqual((8, -1), obj.get_int32(message, 4))
+        self.assertEqual((4, 123), obj.get_uint16(message))
+        self.assertEqual((16, 1), obj.get_uint64(message, 8))
+
+        # Unsigned long longs at the end of a message fall back to unsigned integers
+        self.assertEqual((20, 2), obj.get_uint64(message, 16))
+
+        with self.assertRaises(struct.error):
+            obj.get_uint32(message, 18, printerror=False)
+
+    def test_get_strings(self):
+        # Arrange
+        obj = SlskMessage()
+        message = obj.pack_object('tëst') + b'\x04\x00\x00\x00t\xebst' + obj.pack_object(b'raw')
+
+        # Act / Assert
+        self.assertEqual((9, 'tëst'), obj.get_string(message))
+        self.assertEqual((17, 'tëst'), obj.get_string(message, 9))
+        self.assertEqual((24, b'raw'), obj.get_bytes(message, 17))
+        self.assertEqual((9, 'tëst'), obj.get_string(memoryview(message)))
+        self.assertEqual((24, b'raw'), obj.get_bytes(memoryview(message), 17))
+
+        # Missing length prefix at the end of a message
+        self.assertEqual((28, ''), obj.get_string(message, 24))
+
+    def test_get_object(self):
+        # Arrange
+        obj = SlskMessage()
+        message = obj.pack_object(123, unsignedint=True) + obj.pack_object('test')
+
+        # Act / Assert
+        self.assertEqual((4, 123), obj.get_object(message, int))
+        self.assertEqual((4, 123), obj.get_object(message, int, getintasshort=True))
+        self.assertEqual((12, 'test'), obj.get_object(message, bytes, 4))
+        self.assertEqual((12, b'test'), obj.get_object(message, bytes, 4, rawbytes=True))
+
+
 class LoginMessageTest(unittest.TestCase):
     def test_make_network_message(self):
         # Arrange
@@ -353,3 +416,384 @@ class PrivateRoomRemoveUserMessageTest(unittest.TestCase):
         # Assert
         self.assertEqual('nicotine', obj.room)
         self.assertEqual('admin', obj.user)
+
+
+class SharedFileListMessageTest(unittest.TestCase):
+    def test_parse_stream(self):
+        # Arrange
+        obj = SlskMessage()
+        message = bytearray(obj.pack_object(30))
+
+        for i in range(30):
+            message.extend(obj.pack_object('music\\folder %i' % i))
+            message.extend(obj.pack_object(2))
+
+            for j in range(2):
+                message.extend(bytes([1]))
+                message.extend(obj.pack_object('file %i.mp3' % j))
+                message.extend(obj.pack_object(1000 * i + j, unsignedlonglong=True))
+                message.extend(obj.pack_object('mp3'))
+                message.extend(obj.pack_object(1))
+                message.extend(obj.pack_object(0) + obj.pack_object(320))
+
+        compressed = zlib.compress(message)
+        expected = SharedFileList(None)
+        expected.parse_network_message(compressed)
+
+        # Act
+        obj = SharedFileList(None)
+        obj.init_stream(len(compressed))
+        progress = []
+
+        for i in range(0, len(compressed), 7):
+            progress.extend(obj.parse_stream(compressed[i:i + 7]))
+
+        # Assert
+        self.assertEqual(30, len(expected.list))
+        self.assertEqual(expected.list, obj.list)
+        self.assertEqual(expected.list, progress)
+        self.assertEqual((1, 'file 1.mp3', 29001, 'mp3', [320]), obj.list[29][1][1])
+
+    def test_packed_files(self):
+        # Arrange
+        obj = SlskMessage()
+        message = bytearray(obj.pack_object(1))
+        message.extend(obj.pack_object('music'))
+        message.extend(obj.pack_object(2))
+
+        for j in range(2):
+            message.extend(bytes([1]))
+            message.extend(obj.pack_object('file %i.flac' % j))
+            message.extend(obj.pack_object(100 + j, unsignedlonglong=True))
+            message.extend(obj.pack_object('flac'))
+            message.extend(obj.pack_object(0))
+
+        # Act
+        obj = SharedFileList(None)
+        obj.parse_network_message(zlib.compress(message))
+        directory, files = obj.list[0]
+
+        # Assert
+        self.assertEqual('music', directory)
+        self.assertEqual(2, len(files))
+        self.assertEqual(201, files.size)
+        self.assertEqual([(1, 'file 1.flac', 101, 'flac', [])], list(files)[1:])
+        self.assertEqual((1, 'file 0.flac', 100, 'flac', []), files[0])
+        self.assertIs(files[0], files[0])
+        self.assertEqual(list(files), files.files)
+        self.assertEqual(list(files), pickle.loads(pickle.dumps(files)))
+
+
+class MessageFieldsTest(unittest.TestCase):
+    SAMPLE_VALUES = {
+        "uint8": 7,
+        "bool": True,
+        "uint16": 2234,
+        "int32": -5,
+        "uint32": 123456,
+        "uint64": 2 ** 40,
+        "ip": "10.0.0.1",
+        "string": "nicotine ü",
+        "bytes": b"\x00\xff"
+    }
+
+    def get_message_classes(self, attribute):
+        return [obj for obj in vars(slskmessages).values()
+                if isinstance(obj, type) and attribute in vars(obj)]
+
+    def create_message(self, cls, fields):
+        obj = cls.__new__(cls)
+
+        for field_type, name in fields:
+            setattr(obj, name, self.SAMPLE_VALUES[field_type])
+
+        return obj
+
+    def test_make_fields(self):
+        for cls in self.get_message_classes("make_fields"):
+            with self.subTest(cls=cls.__name__):
+                # Arrange
+                obj = self.create_message(cls, cls.make_fields)
+                parsed = cls.__new__(cls)
+
+                # Act
+                message = obj.make_network_message()
+                build_message_parser(cls.make_fields)(parsed, bytes(message))
+
+                # Assert
+                for field_type, name in cls.make_fields:
+                    self.assertEqual(self.SAMPLE_VALUES[field_type], getattr(parsed, name))
+
+    def test_parse_fields(self):
+        for cls in self.get_message_classes("parse_fields"):
+            with self.subTest(cls=cls.__name__):
+                # Arrange
+                obj = self.create_message(cls, cls.parse_fields)
+                message = build_message_maker(cls.parse_fields)(obj)
+                parsed = cls.__new__(cls)
+
+                # Act
+                parsed.parse_network_message(memoryview(message))
+
+                # Assert
+                for field_type, name in cls.parse_fields:
+                    self.assertEqual(self.SAMPLE_VALUES[field_type], getattr(parsed, name))
+
+    def test_truncated_message(self):
+        # Arrange
+        obj = PeerInit(None)
+
+        # Act / Assert
+        with self.assertRaises(struct.error):
+            obj.parse_network_message(b'\x04\x00\x00\x00user\x01\x00\x00\x00P\x01')
+
+
+class FileSearchResultMessageTest(unittest.TestCase):
+    def test_parse_network_message(self):
+        # Arrange
+        obj = SlskMessage()
+        message = bytearray(obj.pack_object('user') + obj.pack_object(1234, unsignedint=True) + obj.pack_object(2))
+
+        for path, attrs in (('music\\album\\song.mp3', [(0, 320), (1, 185), (2, 0)]), ('song.flac', [])):
+            message.extend(bytes([1]))
+            message.extend(obj.pack_object(path))
+            message.extend(obj.pack_object(5000000, unsignedlonglong=True))
+            message.extend(obj.pack_object(path[-3:]))
+            message.extend(obj.pack_object(len(attrs)))
+
+            for attr in attrs:
+                message.extend(obj.pack_object(attr[0]) + obj.pack_object(attr[1]))
+
+        message.extend(bytes([1]) + obj.pack_object(100) + obj.pack_object(0, unsignedlonglong=True))
+
+        # Act
+        obj = FileSearchResult(None)
+        obj.parse_network_message(zlib.compress(message))
+        files = obj.list
+
+        # Assert
+        self.assertEqual(2, len(files))
+        self.assertEqual([12, 0], files.name_offsets.tolist())
+        self.assertEqual([320, None], files.bitrates)
+        self.assertEqual([185, None], files.lengths)
+        self.assertEqual((1, 'music\\album\\song.mp3', 5000000, 'mp3', [320, 185, 0]), list(files)[0])
+        self.assertEqual(1, obj.freeulslots)
+
+
+class MessageRoundTripTest(unittest.TestCase):
+    def test_symmetric_messages(self):
+        for cls in MessageFieldsTest().get_message_classes("make_fields"):
+            if cls.make_fields != getattr(cls, "parse_fields", None):
+                continue
+
+            with self.subTest(cls=cls.__name__):
+                # Arrange
+                obj = MessageFieldsTest().create_message(cls, cls.make_fields)
+                message = bytes(obj.make_network_message())
+                parsed = cls.__new__(cls)
+
+                # Act
+                parsed.parse_network_message(message)
+
+                # Assert
+                self.assertEqual(message, bytes(parsed.make_network_message()))
+
+    def test_file_search_result(self):
+        # Arrange
+        fileindex = {
+            '0': ('music\\album\\song.mp3', 5000000, (320, 0), 185),
+            '1': ('music\\album\\cover.jpg', 20000, None, None)
+        }
+        obj = FileSearchResult(None, user='user', token=1234, shares=range(2), fileindex=fileindex,
+                               freeulslots=1, ulspeed=100, inqueue=(3,), numresults=2)
+        message = obj.make_network_message()
+
+        # Act
+        parsed = FileSearchResult(None)
+        parsed.parse_network_message(message)
+
+        # Assert
+        self.assertEqual(('user', 1234, 1, 100, 3),
+                         (parsed.user, parsed.token, parsed.freeulslots, parsed.ulspeed, parsed.inqueue))
+        self.assertEqual([(1, 'music\\album\\song.mp3', 5000000, 'mp3', [320, 185, 0]),
+                          (1, 'music\\album\\cover.jpg', 20000, '', [])], list(parsed.list))
+
+
+@message_fields(
+    make="uint8 a, bool b, uint16 c, int32 d, uint32 e, uint64 f, ip g, string h, bytes i",
+    parse="uint8 a, bool b, uint16 c, int32 d, uint32 e, uint64 f, ip g, string h, bytes i")
+class AllFieldsMessage(SlskMessage):
+    pass
+
+
+class LegacyEncodingTest(unittest.TestCase):
+    # Sample values of MessageFieldsTest, encoded the way the hand-written codec did
+    ALL_FIELDS = (
+        b'\x07'                                 # uint8
+        b'\x01'                                 # bool
+        b'\xba\x08\x00\x00'                     # uint16, padded to 4 bytes
+        b'\xfb\xff\xff\xff'                     # int32
+        b'\x40\xe2\x01\x00'                     # uint32
+        b'\x00\x00\x00\x00\x00\x01\x00\x00'     # uint64
+        b'\x01\x00\x00\x0a'                     # ip, in reverse byte order
+        b'\x0b\x00\x00\x00nicotine \xc3\xbc'     # string, UTF-8
+        b'\x02\x00\x00\x00\x00\xff'             # bytes
+    )
+
+    def setUp(self):
+        with open(LEGACY_FIELDS_DATAFILE, encoding="utf-8") as file_handle:
+            self.legacy_messages = json.load(file_handle)
+
+    def test_field_types(self):
+        # Arrange
+        obj = MessageFieldsTest().create_message(AllFieldsMessage, AllFieldsMessage.make_fields)
+        parsed = AllFieldsMessage()
+
+        # Act
+        message = obj.make_network_message()
+        parsed.parse_network_message(self.ALL_FIELDS)
+
+        # Assert
+        self.assertEqual(self.ALL_FIELDS, bytes(message))
+
+        for field_type, name in AllFieldsMessage.parse_fields:
+            self.assertEqual(MessageFieldsTest.SAMPLE_VALUES[field_type], getattr(parsed, name))
+
+    def test_latin1_string(self):
+        # Arrange
+        message = self.ALL_FIELDS.replace(b'\x0b\x00\x00\x00nicotine \xc3\xbc', b'\x04\x00\x00\x00caf\xe9')
+        parsed = AllFieldsMessage()
+
+        # Act
+        parsed.parse_network_message(message)
+
+        # Assert
+        self.assertEqual('caf\xe9', parsed.h)
+        self.assertEqual(b'\x00\xff', parsed.i)
+
+    def test_make_fields(self):
+        classes = MessageFieldsTest().get_message_classes("make_fields")
+        self.assertEqual(sorted(cls.__name__ for cls in classes), sorted(self.legacy_messages["make"]))
+
+        for cls in classes:
+            with self.subTest(cls=cls.__name__):
+                # Arrange
+                obj = MessageFieldsTest().create_message(cls, cls.make_fields)
+
+                # Act
+                message = obj.make_network_message()
+
+                # Assert
+                self.assertEqual(bytes.fromhex(self.legacy_messages["make"][cls.__name__]), bytes(message))
+
+    def test_parse_fields(self):
+        classes = MessageFieldsTest().get_message_classes("parse_fields")
+        self.assertEqual(sorted(cls.__name__ for cls in classes), sorted(self.legacy_messages["parse"]))
+
+        for cls in classes:
+            with self.subTest(cls=cls.__name__):
+                # Arrange
+                parsed = cls.__new__(cls)
+
+                # Act
+                parsed.parse_network_message(bytes.fromhex(self.legacy_messages["parse"][cls.__name__]))
+
+                # Assert
+                for field_type, name in cls.parse_fields:
+                    self.assertEqual(MessageFieldsTest.SAMPLE_VALUES[field_type], getattr(parsed, name))
+
+
+class MessageFuzzTest(unittest.TestCase):
+    """ Malformed messages must fail with a parsing error, which is logged by the
+    networking thread, instead of other exceptions or endless loops """
+
+    PARSE_ERRORS = (struct.error, IndexError)
+    COMPRESSED_CLASSES = (FileSearchResult, FolderContentsResponse, SharedFileList)
+
+    def get_message_classes(self):
+        base_classes = (slskmessages.ServerMessage, slskmessages.PeerMessage, slskmessages.DistribMessage)
+
+        return [obj for obj in vars(slskmessages).values()
+                if isinstance(obj, type) and issubclass(obj, base_classes) and
+                obj.parse_network_message is not SlskMessage.parse_network_message]
+
+    def get_corpus(self):
+        """ Returns valid (uncompressed) messages to derive malformed ones from """
+
+        obj = SlskMessage()
+        packed_files = b''.join((
+            obj.pack_object(1), bytes([1]), obj.pack_object('song.mp3'), obj.pack_object(5000000, unsignedlonglong=True),
+            obj.pack_object('mp3'), obj.pack_object(1), obj.pack_object(0), obj.pack_object(320)
+        ))
+        search_result = b''.join((
+            obj.pack_object('user'), obj.pack_object(1), packed_files,
+            bytes([1]), obj.pack_object(100), obj.pack_object(0, unsignedlonglong=True)
+        ))
+        corpus = [
+            (JoinRoom, b''.join(obj.pack_object(value) for value in (
+                'room', 1, 'user', 1, 1, 1, 100, 0, 0, 20, 2, 1, 0, 1, 'US', 'owner', 1, 'user'))),
+            (SharedFileList, SharedFileList(None, {'dir': packed_files}).make_network_message(nozlib=1)),
+            (FolderContentsResponse, zlib.decompress(FolderContentsResponse(None, 'dir', packed_files).make_network_message())),
+            (FileSearchResult, search_result)
+        ]
+
+        for cls in MessageFieldsTest().get_message_classes("parse_fields"):
+            fields_obj = MessageFieldsTest().create_message(cls, cls.parse_fields)
+            corpus.append((cls, bytes(build_message_maker(cls.parse_fields)(fields_obj))))
+
+        return corpus
+
+    def parse(self, cls, message):
+        try:
+            obj = cls(None)
+        except TypeError:
+            obj = cls()
+
+        if cls in self.COMPRESSED_CLASSES:
+            message = zlib.compress(message)
+
+        try:
+            obj.parse_network_message(message)
+
+            if cls is SharedFileList:
+                # Files are decoded when they're needed
+                for _directory, files in obj.list:
+                    list(files)
+
+        except self.PARSE_ERRORS:
+            pass
+
+    def test_random_input(self):
+        rng = random.Random(0)
+
+        for cls in self.get_message_classes():
+            with self.subTest(cls=cls.__name__):
+                for _i in range(20):
+                    self.parse(cls, bytes(rng.getrandbits(8) for _j in range(rng.randint(0, 64))))
+
+    def test_truncated_input(self):
+        for cls, message in self.get_corpus():
+            with self.subTest(cls=cls.__name__):
+                for length in range(len(message)):
+                    self.parse(cls, message[:length])
+
+    def test_mutated_input(self):
+        rng = random.Random(0)
+
+        for cls, message in self.get_corpus():
+            with self.subTest(cls=cls.__name__):
+                for _i in range(50):
+                    mutated = bytearray(message)
+
+                    for _j in range(rng.randint(1, 4)):
+                        mutated[rng.randrange(len(mutated))] = rng.getrandbits(8)
+
+                    self.parse(cls, bytes(mutated))
+
+    def test_endless_count(self):
+        # Arrange
+        obj = GlobalUserList()
+
+        # Act / Assert
+        with self.assertRaises(struct.error):
+            obj.parse_network_message(obj.pack_object(0xFFFFFFFF, unsignedint=True))
@@ -0,0 +1,349 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import selectors
+import socket
+import struct
+import tempfile
+
+from time import sleep
+from unittest.mock import Mock, MagicMock
+
+import pytest
+
+from pynicotine import slskproto
+from pynicotine.slskproto import DownloadWriter, MessageQueue, PeerConnection, SlskProtoThread, TokenBucket
+from pynicotine.slskmessages import ConnClose, FileError, FolderContentsResponse, GetPeerAddress, ServerConn, UploadFile
+
+
+@pytest.fixture
+def config():
+    config = MagicMock()
+    config.sections = {'server': {'portrange': (1, 2)}, 'transfers': {'downloadlimit': 10}}
+    return config
+
+
+@pytest.fixture
+def proto(config, monkeypatch):
+    """ Networking thread that isn't started, so its methods can be called directly """
+
+    monkeypatch.setattr(SlskProtoThread, 'start', lambda self: None)
+    proto = SlskProtoThread(
+        ui_callback=Mock(), queue=MessageQueue(), bindip='',
+        port=None, config=config, eventprocessor=Mock()
+    )
+
+    yield proto
+
+    proto._p.close()
+    proto._selector.close()
+
+    for fileobj in proto._wakeup_fds:
+        fileobj.close()
+
+    proto._compression_pool.shutdown()
+    proto._download_write_pool.shutdown()
+
+
+@pytest.fixture
+def socket_pair():
+
+    sock, other_sock = socket.socketpair()
+    yield sock, other_sock
+
+    sock.close()
+    other_sock.close()
+
+
+def test_process_server_input(proto) -> None:
+    """ Complete messages are parsed from the buffer, a partial one is kept """
+
+    payload = GetPeerAddress('user').pack_object('user') + bytes([1, 0, 0, 127]) + (2234).to_bytes(4, 'little')
+    message = struct.pack('<ii', len(payload) + 4, 3) + payload
+    msg_buffer = bytearray(message * 2 + message[:10])
+
+    msgs, msg_buffer = proto.process_server_input(msg_buffer)
+
+    assert len(msgs) == 2
+    assert msgs[1].user == 'user'
+    assert msgs[1].ip == '127.0.0.1'
+    assert msgs[1].port == 2234
+    assert msg_buffer == message[:10]
+
+
+def test_process_peer_input_compressed(proto) -> None:
+    """ Large compressed messages are parsed by the compression workers """
+
+    proto._compression_pool.shutdown()
+    proto._compression_pool = Mock()
+
+    response = FolderContentsResponse(None, 'dir', FolderContentsResponse(None).pack_object(0))
+    payload = response.make_network_message()
+    message = struct.pack('<ii', len(payload) + 4, 37) + payload
+    conn = PeerConnection(init=Mock(type='P'))
+
+    # Small messages are parsed in the networking loop
+    msgs, conn = proto.process_peer_input(conn, bytearray(message))
+
+    assert msgs[0].list == {'dir': {'dir': []}}
+    assert proto._compression_pool.submit.call_count == 0
+
+    proto.COMPRESSED_INLINE_MAX = 0
+    msgs, conn = proto.process_peer_input(conn, bytearray(message))
+
+    assert msgs == []
+    assert conn.ibuf == b''
+    assert proto._compression_pool.submit.call_count == 1
+
+    function, msg, msg_payload = proto._compression_pool.submit.call_args[0]
+    function(msg, msg_payload)
+
+    assert proto._ui_callback.call_args[0][0] == [msg]
+    assert msg.list == {'dir': {'dir': []}}
+
+
+def test_send_frames(proto) -> None:
+    """ Message buffers are sent without being copied, and partially sent ones are kept """
+
+    payload = bytes(range(100))
+    conns = [PeerConnection(), PeerConnection()]
+
+    for conn in conns:
+        proto.queue_frame(conn, struct.pack('<ii', len(payload) + 4, 5), payload, b'')
+
+    assert conns[0].oframes[1] is conns[1].oframes[1] is payload
+    assert len(conns[0].oframes) == 2
+
+    sock = Mock()
+    sock.sendmsg.return_value = 50
+    assert proto.send_frames(sock, conns[0].oframes) == 50
+    assert sock.sendmsg.call_args[0][0][1] is payload
+    assert bytes(conns[0].oframes[0]) == payload[42:]
+
+    sock.sendmsg.return_value = 58
+    proto.send_frames(sock, conns[0].oframes)
+    assert len(conns[0].oframes) == 0
+
+
+def test_token_bucket(monkeypatch) -> None:
+    """ Transfers wait for tokens, refilled over time and limited by a total speed limit """
+
+    clock = [100.0]
+    monkeypatch.setattr(slskproto.time, 'monotonic', lambda: clock[0])
+
+    total = TokenBucket(10000, 1)
+    bucket = TokenBucket(8000, 1, parent=total)
+    assert bucket.available() == 8000
+
+    bucket.consume(8000)
+    assert bucket.available() == 0
+    assert total.tokens == 2000
+    assert bucket.wait_time() == pytest.approx(bucket.quantum / 8000)
+
+    clock[0] += 1
+    assert bucket.available() == 8000
+    assert total.available() == 10000
+
+    # Data received beyond the limit delays the transfer
+    bucket.consume(10000)
+    assert bucket.available() == 0
+    assert bucket.wait_time() == pytest.approx((bucket.quantum + 2000) / 8000)
+
+    # The total limit holds when it's lower than the limit of the transfer
+    clock[0] += 10
+    total.set_rate(1000, 1)
+    assert bucket.available() == 1000
+
+
+@pytest.mark.skipif(not hasattr(os, 'sendfile'), reason="sendfile is not available")
+def test_sendfile_data(proto, socket_pair) -> None:
+    """ Uploads are sent from the file at the current offset, and fall back to
+    reading the file if it doesn't support sendfile """
+
+    sock, other_sock = socket_pair
+    data = bytes(range(256)) * 16
+
+    with tempfile.TemporaryFile() as file_handle:
+        file_handle.write(data)
+        file_handle.flush()
+        conn = PeerConnection(conn=sock)
+        conn.fileupl = UploadFile(sock, file_handle, len(data), sentbytes=100, offset=1000)
+
+        assert proto.sendfile_data(sock, conn, limit=500) == 500
+        assert other_sock.recv(1000) == data[1100:1600]
+        assert conn.sendfile
+
+    conn = PeerConnection(conn=sock)
+    conn.fileupl = UploadFile(sock, io.BytesIO(data), len(data), sentbytes=100, offset=1000)
+
+    assert proto.sendfile_data(sock, conn) is None
+    assert not conn.sendfile
+    assert conn.fileupl.file.tell() == 1100
+
+
+def test_upload_file_truncated(proto, socket_pair) -> None:
+    """ Uploads of files that are shorter than their size are stopped """
+
+    sock, other_sock = socket_pair
+    data = b"a" * 1000
+
+    with tempfile.TemporaryFile() as file_handle:
+        file_handle.write(data)
+        file_handle.flush()
+
+        for file_obj in (file_handle, io.BytesIO(data)):
+            conns = {sock: PeerConnection(conn=sock)}
+            conn = conns[sock]
+            conn.fileupl = UploadFile(sock, file_obj, 2000, offset=0)
+            file_obj.seek(0)
+
+            for _ in range(3):
+                if conn.fileupl is not None:
+                    proto.write_data(None, conns, sock)
+
+            assert conn.fileupl is None
+            assert proto._ui_callback.call_args[0][0][0].__class__ is FileError
+            assert other_sock.recv(4096) == data
+
+
+def test_download_writer() -> None:
+    """ Downloaded data is written in large writes, and before progress is passed to the UI """
+
+    ui_callback = Mock()
+
+    with tempfile.TemporaryFile() as file_handle:
+        writer = DownloadWriter(None, file_handle, ui_callback, write_size=1000)
+
+        if writer.preallocate(0, 100000):
+            # The size of an incomplete file is the offset downloads are resumed from
+            assert os.fstat(file_handle.fileno()).st_size == 0
+
+        writer.write(b"a" * 600)
+        assert file_handle.tell() == 0
+
+        writer.write(b"b" * 600)
+        assert file_handle.tell() == 1200
+        assert not writer.buffer
+
+        writer.write(b"c" * 10)
+        writer.flush(["progress"], complete=True)
+        assert file_handle.tell() == 1210
+        ui_callback.assert_called_once_with(["progress"])
+
+
+def test_download_writer_thread(proto) -> None:
+    """ Data written by the writer thread is on disk before the connection is closed """
+
+    with tempfile.TemporaryFile() as file_handle:
+        conn = PeerConnection()
+        conn.filewriter = DownloadWriter(
+            conn, file_handle, Mock(), write_size=1000, pool=proto._download_write_pool)
+
+        # Keep the writer thread busy, so the writes are still pending
+        proto._download_write_pool.submit(sleep, 0.2)
+
+        for _ in range(10):
+            conn.filewriter.write(b"a" * 150)
+
+        proto.flush_download(conn)
+        assert file_handle.tell() == 1500
+
+
+def test_download_closed(proto, socket_pair) -> None:
+    """ The UI is told that a download connection closed once its data is written """
+
+    sock, other_sock = socket_pair
+    positions = []
+
+    with tempfile.TemporaryFile() as file_handle:
+        conns = {sock: PeerConnection(conn=sock)}
+        conn = conns[sock]
+        conn.filewriter = DownloadWriter(
+            conn, file_handle, Mock(), write_size=1000, pool=proto._download_write_pool)
+        proto._ui_callback.side_effect = lambda msgs: positions.append((msgs[0].__class__, file_handle.tell()))
+
+        proto._download_write_pool.submit(sleep, 0.2)
+        conn.filewriter.write(b"a" * 100)
+
+        other_sock.close()
+        proto.read_data(conns, sock)
+
+    assert conns == {}
+    assert positions == [(ConnClose, 100)]
+
+
+def test_read_data(proto, socket_pair) -> None:
+    """ Data is received into the receive buffer, and the read size is capped """
+
+    sock, other_sock = socket_pair
+    conns = {sock: PeerConnection(conn=sock)}
+    conn = conns[sock]
+
+    other_sock.sendall(b"abc")
+    proto.read_data(conns, sock)
+    assert conn.ibuf == b"abc"
+
+    for _ in range(10):
+        proto.update_read_length(conn, conn.lastreadlength)
+
+    assert conn.lastreadlength == proto.MAX_READ_LENGTH
+
+    other_sock.close()
+    proto.read_data(conns, sock)
+    assert conns == {}
+
+
+def test_selector_registrations(proto, socket_pair) -> None:
+    """ Sockets are registered once, and only modified when their events change """
+
+    proto._selector = selector = Mock(wraps=proto._selector)
+    sock, _other_sock = socket_pair
+    conns = {sock: PeerConnection(conn=sock)}
+
+    proto.set_event_masks(sock, selectors.EVENT_READ)
+    proto.set_event_masks(sock, selectors.EVENT_READ)
+
+    assert selector.register.call_count == 1
+    assert selector.modify.call_count == 0
+
+    proto.set_event_masks(sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+    assert selector.modify.call_count == 1
+
+    proto.close_connection(conns, sock)
+    assert conns == {}
+    assert len(selector.get_map()) == 0
+
+
+def test_message_queue_wakeup(proto) -> None:
+    """ Queued messages wake the networking loop up """
+
+    selector = selectors.DefaultSelector()
+    selector.register(proto._wakeup_fds[0], selectors.EVENT_READ)
+
+    assert selector.select(0) == []
+
+    proto._queue.put(ServerConn())
+    proto._queue.put(ServerConn())
+    assert len(selector.select(0)) == 1
+
+    proto.clear_wakeup()
+    assert selector.select(0) == []
+
+    selector.close()
@@ -0,0 +1,157 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import pytest
+
+from pynicotine.wordindex import FileBitmap
+from pynicotine.wordindex import WordIndex
+
+
+def test_word_index_write_load(tmpdir):
+    """ Test that a word index survives being written to disk """
+
+    path = os.path.join(str(tmpdir), "wordindex.idx")
+    words = WordIndex()
+
+    words.add_folder(["music", "nicotine"], 0)
+    words.add_file(["mp3"], 0)
+    words.add_file(["ogg"], 1)
+    words.add_folder(["other"], 2)
+    words.add_file(["nicotine", "ünïcödé"], 2)
+
+    words.save(path)
+    word_index = WordIndex(path)
+
+    assert set(word_index) == set(["music", "nicotine", "mp3", "ogg", "other", "ünïcödé"])
+    assert len(word_index) == 6
+    assert list(word_index["nicotine"]) == [0, 1, 2]
+    assert list(word_index["music"]) == [0, 1]
+    assert list(word_index["ünïcödé"]) == [2]
+    assert "flac" not in word_index
+
+    with pytest.raises(KeyError):
+        word_index["flac"]
+
+    word_index.close()
+
+
+def test_word_index_search():
+    """ Test that words in folder and file names are intersected """
+
+    words = WordIndex()
+
+    words.add_folder(["complete", "discography"], 0)
+
+    for file_id in range(0, 5):
+        words.add_file(["track", str(file_id)], file_id)
+
+    words.add_folder(["singles"], 5)
+    words.add_file(["discography", "track", "1"], 5)
+    words.add_file(["track", "2"], 6)
+
+    assert words.search(["discography"]) == [0, 1, 2, 3, 4, 5]
+    assert words.search(["discography", "track"]) == [0, 1, 2, 3, 4, 5]
+    assert words.search(["discography", "1"]) == [1, 5]
+    assert words.search(["complete", "1", "track"]) == [1]
+    assert words.search(["singles", "2"]) == [6]
+    assert words.search(["singles", "3"]) == []
+    assert words.search(["discography", "flac"]) == []
+    assert words.search(["track"], maxresults=3) == [0, 1, 2]
+
+
+def test_word_index_common_words(tmpdir):
+    """ Test that words present in many files are stored as bitmaps """
+
+    path = os.path.join(str(tmpdir), "wordindex.idx")
+    words = WordIndex()
+
+    for folder_id in range(0, 10):
+        words.add_folder(["album", str(folder_id)], folder_id * 10)
+
+        for file_id in range(folder_id * 10, folder_id * 10 + 10):
+            words.add_file(["mp3" if file_id % 2 else "flac", "track", "track" + str(file_id)], file_id)
+
+    words.save(path)
+    word_index = WordIndex(path)
+
+    assert isinstance(word_index.get_postings("mp3")[0], FileBitmap)
+    assert not isinstance(word_index.get_postings("track7")[0], FileBitmap)
+
+    assert list(word_index["flac"]) == list(range(0, 100, 2))
+    assert word_index.search(["track", "mp3", "track7"]) == [7]
+    assert word_index.search(["track", "flac", "track7"]) == []
+    assert word_index.search(["album", "3", "mp3"]) == [31, 33, 35, 37, 39]
+    assert word_index.search(["mp3", "track"], maxresults=3) == [1, 3, 5]
+
+    # Files added after loading are included in bitmaps
+    word_index.add_folder(["singles"], 100)
+    word_index.add_file(["mp3"], 100)
+
+    assert word_index.search(["singles", "mp3"]) == [100]
+
+    word_index.close()
+
+    word_index = WordIndex(path)
+    assert word_index.search(["mp3"])[-2:] == [99, 100]
+
+    word_index.close()
+
+
+def test_word_index_add_after_load(tmpdir):
+    """ Test that words added to a loaded index are saved when closing it """
+
+    path = os.path.join(str(tmpdir), "wordindex.idx")
+    words = WordIndex()
+    words.add_folder(["nicotine"], 0)
+    words.add_file(["mp3"], 0)
+    words.save(path)
+
+    word_index = WordIndex(path)
+    word_index.add_folder(["nicotine"], 1)
+    word_index.add_file(["flac"], 1)
+
+    assert list(word_index["nicotine"]) == [0, 1]
+    assert len(word_index) == 3
+
+    word_index.close()
+
+    word_index = WordIndex(path)
+    assert dict((word, list(file_ids)) for word, file_ids in word_index.items()) == {
+        "nicotine": [0, 1], "mp3": [0], "flac": [1]
+    }
+    assert word_index.search(["nicotine", "flac"]) == [1]
+
+    word_index.close()
+
+    # Closed indexes behave like closed shelves
+    with pytest.raises(ValueError):
+        word_index["nicotine"]
+
+
+def test_word_index_invalid_file(tmpdir):
+    """ Test that unknown file formats are rejected """
+
+    path = os.path.join(str(tmpdir), "wordindex.idx")
+
+    with open(path, "wb") as file_handle:
+        file_handle.write(b"not a word index")
+
+    with pytest.raises(ValueError):
+        WordIndex(path)